@@ -59,8 +59,9 @@ import json
 import re
 import sys
 import argparse
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, List, Union, Optional
+from typing import Dict, Any, List, Tuple, Union, Optional
 
 # Import project config
 from scripts.config import PROJECT_ROOT, PROCESSED_SCHEMA_AI_FRIENDLY, SQL_TESTING_PATH
@@ -89,6 +90,19 @@ def setup_llm():
 
 
 # --- 1.2 Utility Functions ---
+@lru_cache(maxsize=4)
+def _load_query_index(data_file: str) -> Dict[Tuple[str, str], Optional[List[str]]]:
+    """Load the test data once and index its query tokens by (db_id, question)."""
+    with open(data_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    index = {}
+    for item in data:
+        # First match wins, as in the original linear scan
+        # Note: keeping original typo from data
+        index.setdefault((item.get("db_id"), item.get("question")), item.get("guery_toks"))
+    return index
+
+
 def get_true_query_toks(
     db_id: str, question: str, data_file: Path = SQL_TESTING_PATH
 ) -> Optional[List[str]]:
@@ -107,32 +121,23 @@ def get_true_query_toks(
         Optional[List[str]]: The list of SQL tokens if found, else None
     """
     try:
-        with open(data_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        # Print all questions for the db_id to help debug
-        if not QUIET_MODE:
-            print(f"Testing: All questions for db_id={db_id}:")
-        found = False
-        for item in data:
-            if item.get("db_id") == db_id:
-                if item.get("question") == question:
-                    found = True
-                    if not QUIET_MODE:
-                        print("  --> Matched question!")
-                        print(f"  guery_toks: {item.get('guery_toks')}")
-                    return item.get(
-                        "guery_toks"
-                    )  # Note: keeping original typo from data
-
-        if not found and not QUIET_MODE:
-            print(f"Question not found for db_id={db_id}: '{question}'")
-        return None
+        index = _load_query_index(str(data_file))
     except Exception as e:
         if not QUIET_MODE:
             print(f"Error loading test data: {e}")
         return None
 
+    key = (db_id, question)
+    if key not in index:
+        if not QUIET_MODE:
+            print(f"Question not found for db_id={db_id}: '{question}'")
+        return None
+    if not QUIET_MODE:
+        print(f"Testing: db_id={db_id}")
+        print("  --> Matched question!")
+        print(f"  guery_toks: {index[key]}")
+    return index[key]
+
 
 def tokenize_sql(sql: str) -> List[str]:
     """Simple SQL tokenizer: split on whitespace and punctuation"""
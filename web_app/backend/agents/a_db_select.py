@@ -1,10 +1,21 @@
+import copy
+import hashlib
 import json
 import os
-import re
+import faiss
+import numpy as np
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from langchain.embeddings import CacheBackedEmbeddings
 from langchain.prompts import PromptTemplate
+from langchain.storage import LocalFileStore
 from langchain_community.vectorstores import FAISS
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from utils import llm_pool, timing, vectorstore_cache
+from . import parsing
+
+# Whether schema and query vectors are L2-normalized; fixed here rather than
+# read back from the FAISS store, so batched searches match single ones
+NORMALIZE_L2 = False
 
 
 # Helpers
@@ -19,6 +30,10 @@ def get_user_embeddings_folder(user_id: int) -> str:
     return os.path.join(get_user_schema_dir(user_id), "embeddings")
 
 
+def get_user_embedding_cache_folder(user_id: int) -> str:
+    return os.path.join(get_user_schema_dir(user_id), "embedding_cache")
+
+
 def get_user_schema_file(user_id: int) -> str:
     return os.path.join(get_user_schema_dir(user_id), "schema_ab.jsonl")
 
@@ -31,40 +46,117 @@ def load_processed_schema(input_file: str):
 # Embeddings + vectorstore
 
 
+def cached_embeddings(embeddings, cache_folder: str):
+    """
+    Wrap `embeddings` with a persistent on-disk cache of document vectors, keyed by
+    the sha256 of each schema line and namespaced by the embedding model, so index
+    rebuilds only pay for new or changed lines. Query embeddings are not cached.
+    """
+    namespace = getattr(embeddings, "model", None) or type(embeddings).__name__
+    return CacheBackedEmbeddings.from_bytes_store(
+        embeddings,
+        LocalFileStore(cache_folder),
+        namespace=namespace,
+        key_encoder="sha256",
+    )
+
+
+def schema_doc_id(schema_text: str) -> str:
+    """Stable vectorstore id for one schema_ab line (content hash)."""
+    return hashlib.sha1(schema_text.encode("utf-8")).hexdigest()
+
+
+def reconcile_vectorstore(vectorstore, schema_texts) -> bool:
+    """
+    Bring an existing FAISS index in line with the current schema lines: drop
+    vectors whose line no longer exists and embed only the new lines.
+    Returns True if the index changed.
+    """
+    wanted = {schema_doc_id(t): t for t in schema_texts}
+    existing = set(vectorstore.index_to_docstore_id.values())
+
+    stale = [doc_id for doc_id in existing if doc_id not in wanted]
+    if stale:
+        vectorstore.delete(stale)
+    new_ids = [doc_id for doc_id in wanted if doc_id not in existing]
+    if new_ids:
+        vectorstore.add_texts([wanted[i] for i in new_ids], ids=new_ids)
+    return bool(stale or new_ids)
+
+
+def _with_embeddings(vectorstore, embeddings):
+    """
+    A view of the shared, cached `vectorstore` (same index and docstore) that
+    embeds queries with `embeddings`, i.e. the caller's API key. The cached
+    object itself is never rebound, so concurrent users can't swap keys.
+    """
+    view = copy.copy(vectorstore)
+    view.embedding_function = embeddings
+    return view
+
+
 def create_or_load_embeddings(api_key: str, user_id: int):
+    schema_dir = get_user_schema_dir(user_id)
     schema_file = get_user_schema_file(user_id)
     embeddings_folder = get_user_embeddings_folder(user_id)
-    embeddings = OpenAIEmbeddings(api_key=api_key)
+    embeddings = cached_embeddings(
+        llm_pool.get_embeddings(api_key), get_user_embedding_cache_folder(user_id)
+    )
 
-    if os.path.exists(embeddings_folder) and os.listdir(embeddings_folder):
-        return FAISS.load_local(
-            embeddings_folder, embeddings, allow_dangerous_deserialization=True
+    # Serve from the in-process cache while schema_ab.jsonl is unchanged
+    fingerprint = vectorstore_cache.schema_fingerprint(schema_file)
+    cached = vectorstore_cache.get(schema_dir, fingerprint)
+    if cached is not None:
+        # Query embeddings must use the caller's current API key
+        return _with_embeddings(cached, embeddings)
+
+    with vectorstore_cache.lock_for(schema_dir):
+        # Another request may have loaded it while we waited
+        cached = vectorstore_cache.get(schema_dir, fingerprint)
+        if cached is not None:
+            return _with_embeddings(cached, embeddings)
+
+        schema_texts = (
+            load_processed_schema(schema_file) if os.path.exists(schema_file) else []
         )
+        if not schema_texts:
+            raise FileNotFoundError(
+                f"Database file not found, please upload a database first."
+            )
 
-    if not os.path.exists(schema_file):
-        raise FileNotFoundError(
-            f"Database file not found, please upload a database first."
-        )
+        if os.path.exists(embeddings_folder) and os.listdir(embeddings_folder):
+            vectorstore = FAISS.load_local(
+                embeddings_folder,
+                embeddings,
+                allow_dangerous_deserialization=True,
+                normalize_L2=NORMALIZE_L2,
+            )
+            # Only vectors for added/changed/removed schema lines are touched
+            if reconcile_vectorstore(vectorstore, schema_texts):
+                vectorstore.save_local(embeddings_folder)
+        else:
+            vectorstore = FAISS.from_texts(
+                schema_texts,
+                embeddings,
+                ids=[schema_doc_id(t) for t in schema_texts],
+                normalize_L2=NORMALIZE_L2,
+            )
+            vectorstore.save_local(embeddings_folder)
 
-    schema_texts = load_processed_schema(schema_file)
-    vectorstore = FAISS.from_texts(schema_texts, embeddings)
-    vectorstore.save_local(embeddings_folder)
-    return vectorstore
+        vectorstore_cache.put(schema_dir, fingerprint, vectorstore)
+        return _with_embeddings(vectorstore, embeddings)
 
 
 # LLM chain
 
 
-def create_agent(vectorstore, api_key: str, model: str = "gpt-5-mini", top_k: int = 5):
-    llm = ChatOpenAI(model=model, temperature=0, api_key=api_key)
-    prompt_db = PromptTemplate(
-        input_variables=["query", "retrieved_schema"],
-        template="""
+# Static instructions first and the user query last, so consecutive requests
+# share the longest possible prompt prefix (provider-side prompt caching).
+DB_SELECT_PROMPT = PromptTemplate(
+    input_variables=["query", "retrieved_schema"],
+    template="""
 Please select the single most relevant database and table to answer the user's query.
 
-User query: {query}
-Schema info: {retrieved_schema}
-
 Respond **only** with a valid JSON object (no backticks, no extra text). 
 The JSON must include the following keys: "db_name", "tables", "columns", and "reasons". 
 Each key should appear on its own line for readability.
@@ -76,82 +168,180 @@ Example format:
   "tables": ["..."],
   "reasons": "Explanation of why this database was selected based on the similarity scores and schema content"
 }}
+
+Schema info: {retrieved_schema}
+
+User query: {query}
 """,
+)
+
+
+def _format_retrieved(relevant_docs) -> str:
+    return "\n".join(
+        f"score: {score:.4f}, content: {doc.page_content}"
+        for doc, score in relevant_docs
     )
 
-    db_chain = prompt_db | llm
 
-    def database_selection_agent(user_query: str):
-        # similarity_search_with_score returns (Document, distance). Lower distance = closer.
-        relevant_docs = vectorstore.similarity_search_with_score(user_query, k=top_k)
-        retrieved_schema = "\n".join(
-            f"score: {score:.4f}, content: {doc.page_content}"
-            for doc, score in relevant_docs
-        )
+# Keys Agent A's reply must contain (see agents/parsing.py)
+REPLY_SCHEMA = {("db_name", "database"): str}
 
-        response = db_chain.invoke(
-            {"query": user_query, "retrieved_schema": retrieved_schema}
-        )
-        raw = response.content if hasattr(response, "content") else str(response)
 
+def _parse_selection(reply: dict, user_query: str, relevant_docs) -> dict:
+    if reply["error"]:
+        return {"error": f"invalid LLM output: {reply['error']}", "raw": reply["raw"]}
+    parsed_json = reply["data"]
+
+    # Transform retrieved_schema into structured list for display
+    structured_schema = []
+    for doc, score in relevant_docs:
         try:
-            match = re.search(r"\{.*\}", raw, re.DOTALL)
-            parsed_json = (
-                json.loads(match.group(0))
-                if match
-                else {"error": "no JSON found", "raw": raw}
+            schema_json = json.loads(doc.page_content)
+            distance = float(score)
+            # Provide a derived similarity (1/(1+distance)); higher is better
+            similarity = round(1.0 / (1.0 + max(distance, 0.0)), 6)
+            structured_schema.append(
+                {
+                    "similarity": similarity,
+                    "database": schema_json.get("database"),
+                    "table": schema_json.get("table"),
+                    "columns": schema_json.get("columns", []),
+                }
             )
         except json.JSONDecodeError:
-            parsed_json = {"error": "invalid LLM output", "raw": raw}
-
-        # Transform retrieved_schema into structured list for display
-        structured_schema = []
-        for doc, score in relevant_docs:
-            try:
-                schema_json = json.loads(doc.page_content)
-                distance = float(score)
-                # Provide a derived similarity (1/(1+distance)); higher is better
-                similarity = round(1.0 / (1.0 + max(distance, 0.0)), 6)
-                structured_schema.append(
-                    {
-                        "similarity": similarity,
-                        "database": schema_json.get("database"),
-                        "table": schema_json.get("table"),
-                        "columns": schema_json.get("columns", []),
-                    }
-                )
-            except json.JSONDecodeError:
-                distance = float(score)
-                similarity = round(1.0 / (1.0 + max(distance, 0.0)), 6)
-                structured_schema.append(
-                    {
-                        "similarity": similarity,
-                        "raw_content": doc.page_content,
-                    }
-                )
-
-        # Normalize output and include retrieved schemas
-        db_name = None
-        reasons = ""
-        if isinstance(parsed_json, dict):
-            db_name = parsed_json.get("db_name") or parsed_json.get("database")
-            reasons = parsed_json.get("reasons", "")
-
-        return {
-            "query": user_query,
-            "database": db_name,
-            "reasons": reasons,
-            "retrieved_schemas": structured_schema,
-        }
+            distance = float(score)
+            similarity = round(1.0 / (1.0 + max(distance, 0.0)), 6)
+            structured_schema.append(
+                {
+                    "similarity": similarity,
+                    "raw_content": doc.page_content,
+                }
+            )
+
+    # Normalize output and include retrieved schemas
+    db_name = parsed_json.get("db_name") or parsed_json.get("database")
+    reasons = parsed_json.get("reasons", "")
+
+    output = {
+        "query": user_query,
+        "database": db_name,
+        "reasons": reasons,
+        "retrieved_schemas": structured_schema,
+        "llm_usage": reply["llm_usage"],
+    }
+    if reply["repaired"]:
+        output["repaired"] = True
+    return output
+
+
+def create_agent(vectorstore, api_key: str, model: str = "gpt-5-mini", top_k: int = 5):
+    llm = llm_pool.get_chat_model(api_key, model=model, temperature=0)
+
+    db_chain = DB_SELECT_PROMPT | llm
+
+    def database_selection_agent(user_query: str, on_token=None):
+        # similarity_search_with_score returns (Document, distance). Lower distance = closer.
+        with timing.phase("vector_search"):
+            relevant_docs = vectorstore.similarity_search_with_score(user_query, k=top_k)
+        with timing.phase("prompt_build"):
+            retrieved_schema = _format_retrieved(relevant_docs)
+        reply = parsing.invoke(
+            db_chain,
+            {"query": user_query, "retrieved_schema": retrieved_schema},
+            REPLY_SCHEMA,
+            on_token=on_token,
+        )
+        return _parse_selection(reply, user_query, relevant_docs)
+
+    return database_selection_agent
+
+
+def create_async_agent(
+    vectorstore, api_key: str, model: str = "gpt-5-mini", top_k: int = 5
+):
+    """Like `create_agent`, but the query embedding and the LLM call are awaited."""
+    llm = llm_pool.get_chat_model(api_key, model=model, temperature=0)
+
+    db_chain = DB_SELECT_PROMPT | llm
+
+    async def database_selection_agent(user_query: str, on_token=None):
+        with timing.phase("vector_search"):
+            relevant_docs = await vectorstore.asimilarity_search_with_score(
+                user_query, k=top_k
+            )
+        with timing.phase("prompt_build"):
+            retrieved_schema = _format_retrieved(relevant_docs)
+        reply = await parsing.ainvoke(
+            db_chain,
+            {"query": user_query, "retrieved_schema": retrieved_schema},
+            REPLY_SCHEMA,
+            on_token=on_token,
+        )
+        return _parse_selection(reply, user_query, relevant_docs)
 
     return database_selection_agent
 
 
+def search_many(vectorstore, queries, k: int = 5):
+    """
+    Retrieval for many queries at once: one embeddings request and one batched
+    FAISS search. Returns, per query, the same (Document, distance) list as
+    `similarity_search_with_score`.
+    """
+    if not queries:
+        return []
+    embeddings = vectorstore.embedding_function
+    # Query vectors are not written to the on-disk embedding cache
+    embeddings = getattr(embeddings, "underlying_embeddings", embeddings)
+    vectors = np.array(embeddings.embed_documents(list(queries)), dtype=np.float32)
+    if NORMALIZE_L2:
+        faiss.normalize_L2(vectors)
+    distances, indices = vectorstore.index.search(vectors, k)
+
+    results = []
+    for row_distances, row_indices in zip(distances, indices):
+        docs = []
+        for distance, i in zip(row_distances, row_indices):
+            if i == -1:
+                continue
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[i])
+            docs.append((doc, float(distance)))
+        results.append(docs)
+    return results
+
+
+def select_database(
+    api_key: str, user_query: str, relevant_docs, model: str = "gpt-5-mini"
+):
+    """Agent A's LLM step on already retrieved schemas (see `search_many`)."""
+    try:
+        db_chain = DB_SELECT_PROMPT | llm_pool.get_chat_model(
+            api_key, model=model, temperature=0
+        )
+        reply = parsing.invoke(
+            db_chain,
+            {"query": user_query, "retrieved_schema": _format_retrieved(relevant_docs)},
+            REPLY_SCHEMA,
+        )
+        parsed = _parse_selection(reply, user_query, relevant_docs)
+        if parsed.get("error"):
+            return {"error": f"Agent A failed: {parsed['error']}", "raw": parsed.get("raw")}
+        return parsed
+
+    except Exception as e:
+        return {"error": f"Agent A failed: {str(e)}"}
+
+
 # Entrypoint
 
 
 def run(
-    api_key: str, payload: dict, user_id: int, model: str = "gpt-5-mini", top_k: int = 5
+    api_key: str,
+    payload: dict,
+    user_id: int,
+    model: str = "gpt-5-mini",
+    top_k: int = 5,
+    on_token=None,
 ):
     """
     Agent A entrypoint.
@@ -160,23 +350,52 @@ def run(
     {
         "query": "Find all students ..."
     }
+    on_token(text, attempt), if given, receives the LLM reply as it streams.
     """
     try:
         user_query = payload.get("query")
         if not user_query:
             return {"error": "query is required"}
 
-        vectorstore = create_or_load_embeddings(api_key, user_id)
+        with timing.phase("schema_load"):
+            vectorstore = create_or_load_embeddings(api_key, user_id)
         agent = create_agent(vectorstore, api_key, model=model, top_k=top_k)
-        parsed = agent(user_query)
+        parsed = agent(user_query, on_token=on_token)
+        if parsed.get("error"):
+            return {"error": f"Agent A failed: {parsed['error']}", "raw": parsed.get("raw")}
 
         # Return the full result including retrieved schemas
-        return {
-            "query": user_query,
-            "database": parsed.get("database"),
-            "reasons": parsed.get("reasons", ""),
-            "retrieved_schemas": parsed.get("retrieved_schemas", []),
-        }
+        return parsed
+
+    except Exception as e:
+        return {"error": f"Agent A failed: {str(e)}"}
+
+
+async def arun(
+    api_key: str,
+    payload: dict,
+    user_id: int,
+    model: str = "gpt-5-mini",
+    top_k: int = 5,
+    on_token=None,
+):
+    """Async variant of `run` for the ASGI pipeline."""
+    try:
+        user_query = payload.get("query")
+        if not user_query:
+            return {"error": "query is required"}
+
+        # Loading/reconciling the index touches disk and takes locks
+        with timing.phase("schema_load"):
+            vectorstore = await sync_to_async(
+                create_or_load_embeddings, thread_sensitive=False
+            )(api_key, user_id)
+        agent = create_async_agent(vectorstore, api_key, model=model, top_k=top_k)
+        parsed = await agent(user_query, on_token=on_token)
+        if parsed.get("error"):
+            return {"error": f"Agent A failed: {parsed['error']}", "raw": parsed.get("raw")}
+
+        return parsed
 
     except Exception as e:
         return {"error": f"Agent A failed: {str(e)}"}
@@ -0,0 +1,178 @@
+"""ASGI variant of the agent pipeline endpoint.
+
+Same request body and SSE events as `AgentViewSet.create`, but served by an
+async generator: LLM calls and query embeddings are awaited, and only the
+blocking parts (index loading, schema lookups, SQL execution, ORM access) are
+offloaded to threads. Under an ASGI server one worker can keep many pipelines
+in flight. DRF views are sync-only, so JWT auth is done by hand here.
+"""
+
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from core.limit_rate import has_chat_quota
+from utils import sql_connector, timing
+from . import (
+    a_db_select,
+    b_table_select,
+    c_sql_generate,
+    pipeline,
+)
+from .views import HEARTBEAT_SECONDS, ClientDisconnected, get_api_key
+
+
+async def _run_sql(api_key, payload, user_id, on_rows=None):
+    return await sync_to_async(sql_connector.run_sql, thread_sensitive=False)(
+        api_key, payload, user_id, on_rows=on_rows
+    )
+
+
+# Pipeline agents (async entrypoints)
+ASYNC_AGENTS = [
+    ("a-db-select", a_db_select.arun),
+    ("b-table-select", b_table_select.arun),
+    ("c-sql-generate", c_sql_generate.arun),
+    ("d-sql-connector", _run_sql),
+]
+
+
+def _authenticate(request):
+    """Return the JWT-authenticated user, or None."""
+    try:
+        auth = JWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return None
+    return auth[0] if auth else None
+
+
+@csrf_exempt
+async def pipeline_stream(request):
+    """Run the full agent pipeline as an SSE stream (async)."""
+    if request.method != "POST":
+        return JsonResponse({"error": "Method not allowed"}, status=405)
+
+    user = await sync_to_async(_authenticate)(request)
+    if user is None or not user.is_authenticated:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided or are invalid."},
+            status=401,
+        )
+
+    try:
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "Request body must be JSON"}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({"error": "Request body must be a JSON object"}, status=400)
+
+    try:
+        if not await sync_to_async(has_chat_quota)(user):
+            return JsonResponse({"error": "Daily chat limit reached."}, status=429)
+    except Exception:
+        # fail-open, as in the sync endpoint
+        pass
+
+    api_key = await sync_to_async(get_api_key)(user)
+
+    async def event_stream():
+        run = pipeline.PipelineRun(user, api_key, data)
+        if not api_key:
+            for line in await sync_to_async(run.missing_key)():
+                yield line
+            return
+
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+        await sync_to_async(run.load_cache, thread_sensitive=False)()
+
+        for name, agent in ASYNC_AGENTS:
+            yield pipeline.sse({"status": "running", "agent": name, "time": pipeline.now_str()})
+            # Routing reads schema files, so decide off the event loop
+            stage = await sync_to_async(run.stage, thread_sensitive=False)(
+                name, agent, is_async=True
+            )
+            for event in stage.notices:
+                yield pipeline.sse(event)
+
+            # Partial events from the stage, then STAGE_DONE
+            events = asyncio.Queue(maxsize=getattr(settings, "SQL_STREAM_QUEUE_CHUNKS", 8))
+            columns_sent = []
+
+            def on_rows(columns, rows, name=name, events=events, columns_sent=columns_sent):
+                # Called from the SQL thread; blocks it while the client catches up
+                event = {"agent": name, "status": "rows", "rows": rows}
+                if not columns_sent:
+                    event["columns"] = columns
+                    columns_sent.append(True)
+                while True:
+                    if cancelled.is_set():
+                        raise ClientDisconnected("client disconnected")
+                    fut = asyncio.run_coroutine_threadsafe(events.put(event), loop)
+                    try:
+                        fut.result(timeout=1)
+                        return
+                    except TimeoutError:
+                        if not fut.cancel():
+                            return
+
+            relay = pipeline.TokenRelay(name, events.put) if stage.streams_tokens else None
+
+            async def run_stage(stage=stage, events=events, on_rows=on_rows, relay=relay):
+                try:
+                    # The task has its own context, so this timer is only seen here
+                    with timing.use(stage.timer):
+                        output = await stage.call(on_rows, relay)
+                except Exception as e:
+                    output = {"error": str(e)}
+                if relay is not None:
+                    pending = relay.flush()
+                    if pending is not None:
+                        await pending
+                await events.put(pipeline.STAGE_DONE)
+                return output
+
+            task = asyncio.ensure_future(run_stage())
+            try:
+                while True:
+                    try:
+                        event = await asyncio.wait_for(events.get(), HEARTBEAT_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield ":\n\n"
+                        continue
+                    if event is pipeline.STAGE_DONE:
+                        break
+                    yield pipeline.sse(event)
+            except BaseException:
+                # client disconnected (the ASGI handler cancels us) or shutdown
+                cancelled.set()
+                task.cancel()
+                raise
+
+            for line in run.finish_stage(stage, task.result()):
+                yield line
+            stop = await sync_to_async(run.stop_events)(stage)
+            if stop:
+                for line in stop:
+                    yield line
+                break
+
+        for line in await sync_to_async(run.finish)():
+            yield line
+        try:
+            await sync_to_async(run.save)()
+        except Exception:
+            pass
+
+    response = StreamingHttpResponse(event_stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # disable proxy buffering (important for SSE)
+    return response
@@ -1,32 +1,85 @@
 import json
-import os
-from langchain_openai import ChatOpenAI
+from asgiref.sync import sync_to_async
 from langchain.prompts import PromptTemplate
+from utils import llm_pool, schema_store, timing
 from utils.schema_builder import get_schema_dir
+from . import parsing
+
+
+# Instructions, then the per-database schema, then the query: requests against the
+# same database share the prompt prefix (provider-side prompt caching).
+LIST_TABLES_PROMPT = PromptTemplate(
+    input_variables=["user_query", "db_schema_json"],
+    template=(
+        "Given the selected database schema, return ONLY valid JSON with exactly these keys\n"
+        '  "relevant_tables": ["..."],\n'
+        '  "reasons": "..." \n\n'
+        "Do not wrap all_tables in an extra list. Do not include any text outside JSON.\n"
+        "DB schema JSON: {db_schema_json}\n"
+        "User query: {user_query}"
+    ),
+)
+
+
+# Keys the reply must contain (see agents/parsing.py)
+REPLY_SCHEMA = {("relevant_tables", "tables"): list}
 
 
 def create_chain(api_key: str):
-    llm = ChatOpenAI(model="gpt-5-mini", temperature=0, api_key=api_key)
-
-    list_tables_prompt = PromptTemplate(
-        input_variables=["user_query", "db_schema_json"],
-        template=(
-            "Given the selected database schema, return ONLY valid JSON with exactly these keys\n"
-            '  "relevant_tables": ["..."],\n'
-            '  "reasons": "..." \n\n'
-            "User query: {user_query}\n"
-            "DB schema JSON: {db_schema_json}\n"
-            "Do not wrap all_tables in an extra list. Do not include any text outside JSON."
-        ),
-    )
-    return list_tables_prompt | llm
-
-
-def run(api_key, payload: dict, user_id: int):
+    llm = llm_pool.get_chat_model(api_key, model="gpt-5-mini", temperature=0)
+    return LIST_TABLES_PROMPT | llm
+
+
+def _prepare(payload: dict, user_id: int):
+    """Validate the payload and build the prompt inputs. Returns (inputs, error)."""
+    user_query = payload.get("query")
+    db_name = payload.get("database")
+
+    if not user_query:
+        return None, {"error": "query is required"}
+    if not db_name:
+        return None, {"error": "database is required"}
+
+    # Look up the selected database in the per-user schema_ab index
+    with timing.phase("schema_load"):
+        schema_dir = get_schema_dir(user_id)
+        db_schema = schema_store.get_database_schema(schema_dir, db_name)
+    with timing.phase("prompt_build"):
+        db_schema_json = json.dumps(db_schema, ensure_ascii=False)
+    return {"user_query": user_query, "db_schema_json": db_schema_json}, None
+
+
+def _finish(reply: dict, payload: dict) -> dict:
+    if reply["error"]:
+        return {
+            "error": f"Agent B failed: invalid LLM output ({reply['error']})",
+            "raw": reply["raw"],
+        }
+    parsed = reply["data"]
+
+    # Return minimal fields: query, database, table(s), reasons
+    relevant_tables = parsed.get("relevant_tables") or parsed.get("tables")
+    reasons = parsed.get("reasons", "")
+
+    # Provide both keys for compatibility: `tables` (frontend/rendering) and `relevant_tables` (agent C)
+    output = {
+        "query": payload.get("query"),
+        "database": payload.get("database"),
+        "tables": relevant_tables,
+        "relevant_tables": relevant_tables,
+        "reasons": reasons,
+        "llm_usage": reply["llm_usage"],
+    }
+    if reply["repaired"]:
+        output["repaired"] = True
+    return output
+
+
+def run(api_key, payload: dict, user_id: int, on_token=None):
     """
     Agent B entrypoint.
-    Now accepts only the database name in the payload and will read the per-user schema file
-    to build the `db_schema_json` passed to the LLM.
+    Now accepts only the database name in the payload and will look it up in the per-user
+    schema index to build the `db_schema_json` passed to the LLM.
 
     Expected payload (from Agent A via views):
     {
@@ -36,65 +89,32 @@ def run(api_key, payload: dict, user_id: int):
     }
     """
     try:
-        user_query = payload.get("query")
-        db_name = payload.get("database")
+        inputs, error = _prepare(payload, user_id)
+        if error:
+            return error
 
-        if not user_query:
-            return {"error": "query is required"}
-        if not db_name:
-            return {"error": "database is required"}
+        reply = parsing.invoke(
+            create_chain(api_key), inputs, REPLY_SCHEMA, on_token=on_token
+        )
+        return _finish(reply, payload)
 
-        # Load schema_ab.jsonl for this user and pick entries for the selected database
-        schema_dir = get_schema_dir(user_id)
-        schema_file = os.path.join(schema_dir, "schema_ab.jsonl")
-        tables = []
-        columns = []
-        db_schema = {"tables": [], "columns": []}
-
-        if os.path.exists(schema_file):
-            with open(schema_file, "r", encoding="utf-8") as sf:
-                for line in sf:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        obj = json.loads(line)
-                    except Exception:
-                        continue
-                    if obj.get("database") == db_name:
-                        tables.append(obj.get("table"))
-                        cols = obj.get("columns", []) or []
-                        for c in cols:
-                            if c not in columns:
-                                columns.append(c)
-
-        db_schema["tables"] = tables
-        db_schema["columns"] = columns
-
-        chain = create_chain(api_key)
-        response = chain.invoke({
-            "user_query": user_query,
-            "db_schema_json": json.dumps(db_schema, ensure_ascii=False),
-        })
-        raw = response.content if hasattr(response, "content") else str(response)
-
-        try:
-            parsed = json.loads(raw)
-        except json.JSONDecodeError:
-            parsed = {"error": "invalid LLM output", "raw": raw}
-
-        # Return minimal fields: query, database, table(s), reasons
-        relevant_tables = parsed.get("relevant_tables", []) if isinstance(parsed, dict) else []
-        reasons = parsed.get("reasons", "") if isinstance(parsed, dict) else ""
-
-        # Provide both keys for compatibility: `tables` (frontend/rendering) and `relevant_tables` (agent C)
-        return {
-            "query": user_query,
-            "database": db_name,
-            "tables": relevant_tables,
-            "relevant_tables": relevant_tables,
-            "reasons": reasons,
-        }
+    except Exception as e:
+        return {"error": f"Agent B failed: {str(e)}"}
+
+
+async def arun(api_key, payload: dict, user_id: int, on_token=None):
+    """Async variant of `run` for the ASGI pipeline; awaits the LLM call."""
+    try:
+        inputs, error = await sync_to_async(_prepare, thread_sensitive=False)(
+            payload, user_id
+        )
+        if error:
+            return error
+
+        reply = await parsing.ainvoke(
+            create_chain(api_key), inputs, REPLY_SCHEMA, on_token=on_token
+        )
+        return _finish(reply, payload)
 
     except Exception as e:
-        return {"error": f"Agent B failed: {str(e)}"}
\ No newline at end of file
+        return {"error": f"Agent B failed: {str(e)}"}
@@ -0,0 +1,242 @@
+"""Batch pipeline: many questions for one user in a single request.
+
+Retrieval for Agent A is done up front for the whole batch: one embeddings
+request and one FAISS search (`a_db_select.search_many`). The questions then
+run through A-D on a pool of BATCH_CONCURRENCY threads shared by all batch
+requests, so batches never take the stage pool's threads from interactive
+(SSE) pipelines. A request runs at most its "concurrency" questions at once,
+which bounds the LLM calls in flight. Schema lookups for B and C come from the in-process schema_store
+caches, so each database is loaded once for the batch. Results are yielded
+in completion order, one dict per question, each carrying its index.
+"""
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from utils import sql_connector
+from utils.tokens import sum_llm_usage
+from . import (
+    a_db_select,
+    b_table_select,
+    c_sql_generate,
+    pipeline,
+    pipeline_cache,
+    router,
+)
+
+STAGES = ("a-db-select", "b-table-select", "c-sql-generate", "d-sql-connector")
+LIMIT_ERROR = "Daily chat limit reached"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Pool that runs batch questions, separate from `pipeline.get_executor()`."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=max(int(getattr(settings, "BATCH_CONCURRENCY", 8)), 1),
+                    thread_name_prefix="agent-batch",
+                )
+    return _executor
+
+
+def parse_questions(data: dict):
+    """
+    Read the request's "questions": strings or {"query": ..., "id": ...}
+    objects. Returns (questions, error).
+    """
+    items = data.get("questions")
+    if not isinstance(items, list) or not items:
+        return None, "questions must be a non-empty list"
+    max_questions = getattr(settings, "BATCH_MAX_QUESTIONS", 500)
+    if len(items) > max_questions:
+        return None, f"at most {max_questions} questions per batch"
+
+    questions = []
+    for index, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"query": item}
+        if not isinstance(item, dict) or not str(item.get("query") or "").strip():
+            return None, f"question {index} has no query"
+        questions.append({"index": index, "id": item.get("id"), "query": item["query"]})
+    return questions, None
+
+
+def _concurrency(requested) -> int:
+    limit = max(int(getattr(settings, "BATCH_CONCURRENCY", 8)), 1)
+    try:
+        return min(max(int(requested), 1), limit) if requested else limit
+    except (TypeError, ValueError):
+        return limit
+
+
+def _run_question(api_key, user, question, plan, options, stop):
+    """Run A-D for one question. Returns its result line."""
+    close_old_connections()
+    try:
+        query = question["query"]
+        line = {"index": question["index"], "id": question["id"], "query": query}
+        cached = plan.get("cached") or {}
+        outputs = {}
+        payload = {"query": query}
+
+        for name in STAGES:
+            # Cached and routed outputs made no LLM call and don't count as chats
+            skipped = True
+            if stop.is_set():
+                output = {"error": LIMIT_ERROR}
+            elif name in cached:
+                output = cached[name]
+            else:
+                routed = plan.get("routed_a") if name == "a-db-select" else None
+                if routed is None and options["routing"] and name == "b-table-select":
+                    routed = router.route(name, user.id, payload)
+                skipped = routed is not None
+                if routed is not None:
+                    output = routed["output"]
+                elif name == "a-db-select":
+                    if plan.get("error"):
+                        output = {"error": plan["error"]}
+                    else:
+                        output = a_db_select.select_database(
+                            api_key, query, plan["docs"], model=options["model"]
+                        )
+                elif name == "b-table-select":
+                    output = b_table_select.run(api_key, payload, user.id)
+                elif name == "c-sql-generate":
+                    output = c_sql_generate.run(api_key, payload, user.id)
+                else:
+                    output = sql_connector.run_sql(api_key, payload, user.id)
+
+            outputs[name] = output
+            if isinstance(output, dict) and output.get("error"):
+                line["error"] = output["error"]
+                line["agent"] = name
+                break
+            if not skipped and pipeline.count_stage_usage(user, output):
+                stop.set()
+            payload = output
+
+        line["outputs"] = outputs
+        if cached:
+            line["cached"] = True
+        elif options["use_cache"] and "error" not in line:
+            try:
+                pipeline_cache.store(
+                    user.id, api_key, query, options["model"], options["top_k"], outputs
+                )
+            except Exception:
+                pass
+        return line
+    finally:
+        close_old_connections()
+
+
+def _plan(api_key, user, questions, options):
+    """Cache hits, routed Agent A decisions and batched retrieval for every question."""
+    plans = [{} for _ in questions]
+    to_search = []
+    for question, plan in zip(questions, plans):
+        if options["use_cache"]:
+            try:
+                plan["cached"] = pipeline_cache.lookup(
+                    user.id,
+                    api_key,
+                    question["query"],
+                    options["model"],
+                    options["top_k"],
+                    similar=False,
+                )
+            except Exception:
+                plan["cached"] = None
+        if plan.get("cached"):
+            continue
+        if options["routing"]:
+            plan["routed_a"] = router.route(
+                "a-db-select", user.id, {"query": question["query"]}
+            )
+        if plan.get("routed_a") is None:
+            plan["query"] = question["query"]
+            to_search.append(plan)
+
+    if to_search:
+        try:
+            vectorstore = a_db_select.create_or_load_embeddings(api_key, user.id)
+            found = a_db_select.search_many(
+                vectorstore, [plan["query"] for plan in to_search], k=options["top_k"]
+            )
+            for plan, docs in zip(to_search, found):
+                plan["docs"] = docs
+        except Exception as e:
+            for plan in to_search:
+                plan["error"] = f"Agent A failed: {str(e)}"
+    return plans
+
+
+def run(api_key, user, questions, options):
+    """
+    Generator of result lines for `questions`, then a final
+    {"status": "finished", ...} summary. `options`: model, top_k, routing,
+    use_cache, concurrency.
+    """
+    stop = threading.Event()
+    plans = _plan(api_key, user, questions, options)
+    concurrency = _concurrency(options.get("concurrency"))
+    executor = get_executor()
+
+    work = iter(zip(questions, plans))
+    pending = set()
+    done_count = failed = 0
+    usages = []
+
+    def fill():
+        while len(pending) < concurrency:
+            item = next(work, None)
+            if item is None:
+                return
+            question, plan = item
+            pending.add(
+                executor.submit(_run_question, api_key, user, question, plan, options, stop)
+            )
+
+    try:
+        fill()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pending.discard(future)
+                try:
+                    line = future.result()
+                except Exception as e:
+                    line = {"error": str(e)}
+                done_count += 1
+                failed += 1 if line.get("error") else 0
+                usages.extend(
+                    output.get("llm_usage")
+                    for output in (line.get("outputs") or {}).values()
+                    if isinstance(output, dict) and not line.get("cached")
+                )
+                yield line
+            fill()
+    except GeneratorExit:
+        # Client went away: don't start the remaining questions
+        stop.set()
+        for future in pending:
+            future.cancel()
+        raise
+
+    yield {
+        "status": "finished",
+        "total": len(questions),
+        "succeeded": done_count - failed,
+        "failed": failed,
+        "llm_usage": sum_llm_usage(usages),
+        "usage": pipeline.build_usage_payload(user),
+    }
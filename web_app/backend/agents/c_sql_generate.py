@@ -1,32 +1,106 @@
 import json
-import os
-from langchain_openai import ChatOpenAI
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from langchain.prompts import PromptTemplate
+from utils import llm_pool, schema_prune, schema_store, timing
 from utils.schema_builder import get_schema_dir
+from . import parsing
+
+
+# Instructions, schema and selected tables first, the query last (longest shared
+# prompt prefix for provider-side prompt caching).
+PRODUCE_SQL_PROMPT = PromptTemplate(
+    input_variables=["user_query", "db_schema", "selected_tables"],
+    template=(
+        "Given the database schema and selected table names, "
+        "please be case insensitive, return ONLY valid JSON with exactly these keys\n"
+        '  "relevant_tables": ["..."],\n'
+        '  "SQL Code": "..."\n\n'
+        '  "reasons": "..." \n\n'
+        "The SQL should be structured and readable, using new lines and indentation as appropriate.\n"
+        "Do not wrap all_tables in an extra list. Do not include any text outside JSON.\n"
+        "Each schema line is table(column, ...); PK marks primary keys and "
+        "-> table.column marks foreign keys.\n"
+        "DB schema:\n{db_schema}\n"
+        "Selected tables: {selected_tables}\n"
+        "User query: {user_query}"
+    ),
+)
+
+
+# Keys the reply must contain (see agents/parsing.py)
+REPLY_SCHEMA = {("SQL Code", "SQL"): str}
 
 
 def create_chain(api_key: str):
-    llm = ChatOpenAI(model="gpt-5-mini", temperature=0, api_key=api_key)
-
-    produce_sql_prompt = PromptTemplate(
-        input_variables=["user_query", "db_schema_json", "selected_tables"],
-        template=(
-            "Given the selected database schema and selected table names, "
-            "please be case insensitive, return ONLY valid JSON with exactly these keys\n"
-            '  "relevant_tables": ["..."],\n'
-            '  "SQL Code": "..."\n\n'
-            '  "reasons": "..." \n\n'
-            "The SQL should be structured and readable, using new lines and indentation as appropriate.\n"
-            "User query: {user_query}\n"
-            "DB schema JSON: {db_schema_json}\n"
-            "Selected tables: {selected_tables}\n"
-            "Do not wrap all_tables in an extra list. Do not include any text outside JSON."
-        ),
-    )
-    return produce_sql_prompt | llm
-
-
-def run(api_key, payload: dict, user_id: int):
+    llm = llm_pool.get_chat_model(api_key, model="gpt-5-mini", temperature=0)
+    return PRODUCE_SQL_PROMPT | llm
+
+
+def _prepare(payload: dict, user_id: int):
+    """Validate the payload and build the prompt inputs. Returns (inputs, stats, error)."""
+    user_query = payload.get("query")
+    db_name = payload.get("database")
+    selected_tables = payload.get("relevant_tables") or payload.get("tables") or []
+
+    if not user_query:
+        return None, None, {"error": "query is required"}
+    if not db_name:
+        return None, None, {"error": "database is required"}
+    if not selected_tables:
+        return None, None, {"error": "relevant_tables is required"}
+
+    # Load only the selected database's schema_c shard for this user
+    with timing.phase("schema_load"):
+        schema_dir = get_schema_dir(user_id)
+        if schema_store.get_schema_c_manifest(schema_dir) is None:
+            return None, None, {"error": f"schema_c not found in {schema_dir}"}
+        db_schema_json = schema_store.load_schema_c(schema_dir, db_name) or {}
+
+    # Only the selected tables and their join paths, as compact text
+    with timing.phase("prompt_build"):
+        if getattr(settings, "SCHEMA_PRUNE_ENABLED", True):
+            db_schema, stats = schema_prune.compact_schema(
+                db_schema_json,
+                selected_tables,
+                # Counted once per schema version, not per request
+                full_tokens=schema_store.schema_c_tokens(schema_dir, db_name),
+            )
+        else:
+            db_schema, stats = json.dumps(db_schema_json, ensure_ascii=False), None
+
+    return {
+        "user_query": user_query,
+        "db_schema": db_schema,
+        "selected_tables": json.dumps(selected_tables, ensure_ascii=False),
+    }, stats, None
+
+
+def _finish(reply: dict, payload: dict, stats=None) -> dict:
+    if reply["error"]:
+        return {
+            "error": f"Agent C failed: invalid LLM output ({reply['error']})",
+            "raw": reply["raw"],
+        }
+    parsed = reply["data"]
+
+    selected_tables = payload.get("relevant_tables") or payload.get("tables") or []
+    merged = {
+        "query": payload.get("query"),
+        "database": payload.get("database"),
+        "relevant_tables": parsed.get("relevant_tables", selected_tables),
+        "SQL": parsed.get("SQL") or parsed.get("SQL Code"),
+        "reasons": parsed.get("reasons", payload.get("reasons", "")),
+        "llm_usage": reply["llm_usage"],
+    }
+    if stats:
+        merged["prompt_stats"] = stats
+    if reply["repaired"]:
+        merged["repaired"] = True
+    return merged
+
+
+def run(api_key, payload: dict, user_id: int, on_token=None):
     """
     Agent C entrypoint.
     Expected payload (from Agent B):
@@ -38,54 +112,32 @@ def run(api_key, payload: dict, user_id: int):
     }
     """
     try:
-        user_query = payload.get("query")
-        db_name = payload.get("database")
-        selected_tables = payload.get("relevant_tables") or payload.get("tables") or []
-
-        if not user_query:
-            return {"error": "query is required"}
-        if not db_name:
-            return {"error": "database is required"}
-        if not selected_tables:
-            return {"error": "relevant_tables is required"}
-
-        # Load schema_c.json for this user and pick entries for the selected database
-        schema_dir = get_schema_dir(user_id)
-        schema_file = os.path.join(schema_dir, "schema_c.json")
-
-        db_schema_json = {}
-        if os.path.exists(schema_file):
-            with open(schema_file, "r", encoding="utf-8") as f:
-                try:
-                    all_schema = json.load(f)
-                except Exception:
-                    all_schema = {}
-            db_schema_json = all_schema.get(db_name, {})
-        else:
-            return {"error": f"schema_c.json not found in {schema_dir}"}
-
-        chain = create_chain(api_key)
-        response = chain.invoke({
-            "user_query": user_query,
-            "db_schema_json": json.dumps(db_schema_json, ensure_ascii=False),
-            "selected_tables": json.dumps(selected_tables, ensure_ascii=False),
-        })
-
-        raw = response.content if hasattr(response, "content") else str(response)
-
-        try:
-            parsed = json.loads(raw)
-        except json.JSONDecodeError:
-            parsed = {"error": "invalid LLM output", "raw": raw}
-
-        merged = {
-            "query": user_query,
-            "database": db_name,
-            "relevant_tables": parsed.get("relevant_tables", selected_tables),
-            "SQL": parsed.get("SQL") or parsed.get("SQL Code"),
-            "reasons": parsed.get("reasons", payload.get("reasons", "")),
-        }
-        return merged
+        inputs, stats, error = _prepare(payload, user_id)
+        if error:
+            return error
+
+        reply = parsing.invoke(
+            create_chain(api_key), inputs, REPLY_SCHEMA, on_token=on_token
+        )
+        return _finish(reply, payload, stats)
+
+    except Exception as e:
+        return {"error": f"Agent C failed: {str(e)}"}
+
+
+async def arun(api_key, payload: dict, user_id: int, on_token=None):
+    """Async variant of `run` for the ASGI pipeline; awaits the LLM call."""
+    try:
+        inputs, stats, error = await sync_to_async(_prepare, thread_sensitive=False)(
+            payload, user_id
+        )
+        if error:
+            return error
+
+        reply = await parsing.ainvoke(
+            create_chain(api_key), inputs, REPLY_SCHEMA, on_token=on_token
+        )
+        return _finish(reply, payload, stats)
 
     except Exception as e:
         return {"error": f"Agent C failed: {str(e)}"}
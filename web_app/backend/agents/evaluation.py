@@ -0,0 +1,307 @@
+"""Offline evaluation of the agent pipeline against the Spider test set.
+
+The test set is loaded once and indexed by (db_id, question). Each question
+runs through Agents A-D on a worker pool. The predicted SQL is scored by
+execution accuracy: its result must equal the gold SQL's result on the same
+SQLite file, compared as a multiset unless the gold query has ORDER BY. Agent
+D still runs the predicted SQL (its time and errors are part of the run), but
+both queries are scored from a plain read-only connection (`run_uncapped`),
+so the pipeline's row caps can't turn a correct answer into a mismatch.
+Alongside accuracy, runs report latency percentiles, QPS and LLM token usage.
+
+`OracleChatModel` answers every agent prompt from the gold SQL, so the
+harness can run offline and reproducibly. Its answers are right by
+construction, so an oracle run is a throughput/plumbing benchmark only: it
+reports no accuracy, just how many gold queries came back intact through A-D.
+Accuracy is scored with a real model, which can be replayed offline from a
+cassette recorded once (utils/llm_cassette.py).
+"""
+
+import json
+import math
+import re
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from django.db import close_old_connections
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from utils import sql_connector
+from utils.tokens import count_tokens, sum_llm_usage
+from . import a_db_select, b_table_select, c_sql_generate
+
+_TABLE_RE = re.compile(r"\b(?:from|join)\s+([A-Za-z_]\w*)", re.IGNORECASE)
+
+# db_id of the question being evaluated in this context (read by OracleChatModel)
+_current_db = ContextVar("evaluation_db", default=None)
+
+
+def load_test_set(path) -> Dict[tuple, dict]:
+    """
+    Read a Spider-style JSON list (db_id, question, query) into
+    {(db_id, question): item}. The first item wins for duplicate pairs.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    index = {}
+    for item in data:
+        key = (item.get("db_id"), item.get("question"))
+        if all(key) and item.get("query"):
+            index.setdefault(key, item)
+    return index
+
+
+# Offline LLM
+
+
+def _question_in(prompt: str) -> Optional[str]:
+    # The query is the last line of every agent prompt (and of the repair prompt)
+    marker = "User query:"
+    at = prompt.rfind(marker)
+    if at == -1:
+        return None
+    lines = prompt[at + len(marker):].strip().splitlines()
+    return lines[0].strip() if lines else None
+
+
+def gold_tables(sql: str) -> List[str]:
+    """Tables named after FROM/JOIN in `sql`, in order of appearance."""
+    tables = []
+    for name in _TABLE_RE.findall(sql or ""):
+        if name not in tables:
+            tables.append(name)
+    return tables
+
+
+class OracleChatModel(BaseChatModel):
+    """
+    Chat model that answers Agent A/B/C prompts from the test set's gold SQL.
+    `answers` is keyed by (db_id, question); the db_id is that of the question
+    `evaluate_one` is running, since the same question may exist for several
+    databases.
+    """
+
+    answers: Dict[tuple, Any] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "oracle"
+
+    def _reply(self, prompt: str) -> str:
+        item = self.answers.get((_current_db.get(), _question_in(prompt)))
+        if item is None:
+            return "{}"
+        if "Selected tables:" in prompt:
+            return json.dumps({"SQL Code": item["query"], "reasons": "gold SQL"})
+        if "DB schema JSON:" in prompt:
+            return json.dumps(
+                {"relevant_tables": gold_tables(item["query"]), "reasons": "gold SQL"}
+            )
+        return json.dumps({"db_name": item["db_id"], "reasons": "gold SQL"})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = "\n".join(str(m.content) for m in messages)
+        reply = self._reply(prompt)
+        input_tokens, output_tokens = count_tokens(prompt), count_tokens(reply)
+        message = AIMessage(
+            content=reply,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+# Scoring
+
+
+def _row(values) -> tuple:
+    return tuple(round(v, 6) if isinstance(v, float) else v for v in values)
+
+
+def run_uncapped(db_path: str, sql: str) -> dict:
+    """
+    Run SQL for scoring on a plain read-only connection: no row caps, cost
+    guard or result cache. Returns a `run_sql`-shaped output.
+    """
+    if not db_path:
+        return {"error": "Database file not found"}
+    try:
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    except sqlite3.Error as e:
+        return {"error": str(e)}
+    try:
+        cur = conn.execute(sql)
+        columns = [d[0] for d in cur.description or ()]
+        return {"success": True, "result": [dict(zip(columns, row)) for row in cur]}
+    except sqlite3.Error as e:
+        return {"error": str(e)}
+    finally:
+        conn.close()
+
+
+def execution_match(predicted: dict, gold: dict, ordered: bool = False) -> bool:
+    """True if two `run_sql` outputs returned the same rows (multiset unless `ordered`)."""
+    if not predicted.get("success") or not gold.get("success"):
+        return False
+    pred_rows = [_row(r.values()) for r in predicted.get("result") or []]
+    gold_rows = [_row(r.values()) for r in gold.get("result") or []]
+    if ordered:
+        return pred_rows == gold_rows
+    return Counter(pred_rows) == Counter(gold_rows)
+
+
+def evaluate_one(
+    api_key: str,
+    user_id: int,
+    item: dict,
+    oracle: bool = False,
+    model: str = "gpt-5-mini",
+    top_k: int = 5,
+) -> dict:
+    """Run one test question through A-D and score it. Returns a result record."""
+    close_old_connections()
+    token = _current_db.set(item["db_id"])
+    try:
+        question, gold_sql = item["question"], item["query"]
+        record = {"db_id": item["db_id"], "question": question, "gold": gold_sql}
+        stage_seconds = {}
+        outputs = {}
+
+        def stage(name, fn, *args, **kwargs):
+            started = time.perf_counter()
+            output = fn(*args, **kwargs)
+            stage_seconds[name] = round(time.perf_counter() - started, 6)
+            outputs[name] = output
+            if isinstance(output, dict) and output.get("error"):
+                record.setdefault("error", output["error"])
+                record.setdefault("agent", name)
+                return None
+            return output
+
+        started = time.perf_counter()
+        b_out = c_out = d_out = None
+        if oracle:
+            # No embeddings offline: A chooses from the question alone
+            a_out = stage(
+                "a-db-select", a_db_select.select_database, api_key, question, [], model=model
+            )
+        else:
+            a_out = stage(
+                "a-db-select",
+                a_db_select.run,
+                api_key,
+                {"query": question},
+                user_id,
+                model=model,
+                top_k=top_k,
+            )
+        if a_out:
+            b_out = stage("b-table-select", b_table_select.run, api_key, a_out, user_id)
+        if b_out:
+            c_out = stage("c-sql-generate", c_sql_generate.run, api_key, b_out, user_id)
+        if c_out:
+            d_out = stage("d-sql-connector", sql_connector.run_sql, api_key, c_out, user_id)
+        record["latency"] = round(time.perf_counter() - started, 6)
+        record["stage_seconds"] = stage_seconds
+        record["database"] = (a_out or {}).get("database")
+        record["sql"] = (c_out or {}).get("SQL")
+        record["llm_usage"] = sum_llm_usage(
+            o.get("llm_usage") for o in outputs.values() if isinstance(o, dict)
+        )
+
+        db_path = sql_connector.get_db_path(user_id, item["db_id"])
+        gold = run_uncapped(db_path, gold_sql)
+        if gold.get("error"):
+            record["gold_error"] = gold["error"]
+        # Scored like the gold SQL; Agent D's output may be cut at its row cap
+        predicted = run_uncapped(db_path, record["sql"]) if d_out else None
+        record["match"] = bool(predicted) and execution_match(
+            predicted, gold, ordered="order by" in gold_sql.lower()
+        )
+        return record
+    finally:
+        _current_db.reset(token)
+        close_old_connections()
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list (0 for an empty one)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(p / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(records: List[dict], wall_seconds: float, oracle: bool = False) -> dict:
+    """
+    Accuracy, latency percentiles, throughput and token totals for a run. An
+    oracle run reports no accuracy (None), only `oracle_roundtrip`: the share of
+    gold queries that came back through A-D with the gold result.
+    """
+    scored = [r for r in records if not r.get("gold_error")]
+    latencies = sorted(r["latency"] for r in records if "latency" in r)
+    matched = round(sum(r["match"] for r in scored) / len(scored), 4) if scored else 0.0
+    database_matched = (
+        round(sum(r.get("database") == r.get("db_id") for r in records) / len(records), 4)
+        if records
+        else 0.0
+    )
+    return {
+        "questions": len(records),
+        "scored": len(scored),
+        "execution_accuracy": None if oracle else matched,
+        "database_accuracy": None if oracle else database_matched,
+        **({"oracle_roundtrip": matched} if oracle else {}),
+        "errors_by_agent": dict(Counter(r["agent"] for r in records if r.get("agent"))),
+        "latency_seconds": {
+            "mean": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+            **{f"p{p}": round(percentile(latencies, p), 4) for p in (50, 90, 95, 99)},
+            "max": round(latencies[-1], 4) if latencies else 0.0,
+        },
+        "wall_seconds": round(wall_seconds, 3),
+        "qps": round(len(records) / wall_seconds, 3) if wall_seconds else 0.0,
+        "llm_usage": sum_llm_usage(r.get("llm_usage") for r in records),
+    }
+
+
+def run_evaluation(
+    api_key: str,
+    user_id: int,
+    items: List[dict],
+    workers: int = 8,
+    oracle: bool = False,
+    model: str = "gpt-5-mini",
+    top_k: int = 5,
+    on_record=None,
+):
+    """
+    Evaluate `items` on a pool of `workers` threads. on_record(record) is
+    called as each finishes. Returns (records, summary).
+    """
+    records = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(
+        max_workers=max(workers, 1), thread_name_prefix="agent-eval"
+    ) as pool:
+        futures = [
+            pool.submit(evaluate_one, api_key, user_id, item, oracle, model, top_k)
+            for item in items
+        ]
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                record = {"error": str(e), "latency": 0.0, "match": False}
+            records.append(record)
+            if on_record is not None:
+                on_record(record)
+    return records, summarize(records, time.perf_counter() - started, oracle)
@@ -0,0 +1,170 @@
+"""Parse agent LLM replies into validated JSON, repairing bad replies once.
+
+Models sometimes wrap their JSON in code fences or surround it with prose.
+`extract_json` tolerates both. When a reply still cannot be used, the same
+stage asks the model to fix it, sending back the original prompt, the bad
+reply and the validation error (at most AGENT_REPAIR_RETRIES times). The
+other stages do not re-run.
+
+With `on_token`, replies are streamed and every text delta is passed on as
+it arrives: on_token(text, attempt), where attempt 0 is the first reply and
+1.. are repairs (a client should discard the text of earlier attempts).
+"""
+
+import inspect
+import json
+import re
+
+from django.conf import settings
+from langchain_core.messages import AIMessage, HumanMessage
+
+from utils import timing
+from utils.tokens import llm_usage, sum_llm_usage
+
+_FENCE_RE = re.compile(r"```[a-zA-Z]*\s*(.*?)```", re.DOTALL)
+_decoder = json.JSONDecoder()
+
+
+def response_text(response) -> str:
+    content = response.content if hasattr(response, "content") else response
+    if isinstance(content, list):
+        # content blocks: keep the text parts
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    return str(content)
+
+
+def extract_json(raw: str):
+    """First JSON object in `raw` (inside code fences, or after leading prose), or None."""
+    text = (raw or "").strip()
+    candidates = [m.group(1) for m in _FENCE_RE.finditer(text)] + [text]
+    for candidate in candidates:
+        start = candidate.find("{")
+        while start != -1:
+            try:
+                obj, _ = _decoder.raw_decode(candidate, start)
+            except ValueError:
+                obj = None
+            if isinstance(obj, dict):
+                return obj
+            start = candidate.find("{", start + 1)
+    return None
+
+
+def validate(parsed: dict, schema: dict):
+    """
+    Check `parsed` against `schema`: {key or (key, alias, ...): type}. Each entry
+    needs a non-empty value of that type under one of its names. Returns an
+    error message or None.
+    """
+    for names, expected in schema.items():
+        names = names if isinstance(names, tuple) else (names,)
+        value = next((parsed[n] for n in names if parsed.get(n) is not None), None)
+        if value is None:
+            return f'missing key "{names[0]}"'
+        if not isinstance(value, expected) or not value:
+            return f'"{names[0]}" must be a non-empty {expected.__name__}'
+        if expected is list and not all(isinstance(v, str) for v in value):
+            return f'"{names[0]}" must be a list of strings'
+    return None
+
+
+def _check(response, schema: dict):
+    with timing.phase("parse"):
+        raw = response_text(response)
+        parsed = extract_json(raw)
+        if parsed is None:
+            return raw, None, "the reply does not contain a JSON object"
+        return raw, parsed, validate(parsed, schema)
+
+
+def _repair_messages(chain, inputs: dict, raw: str, error: str, schema: dict):
+    keys = ", ".join(
+        f'"{names[0] if isinstance(names, tuple) else names}"' for names in schema
+    )
+    with timing.phase("prompt_build"):
+        messages = chain.first.invoke(inputs).to_messages()
+    return messages + [
+        AIMessage(content=raw),
+        HumanMessage(
+            content=(
+                f"Your reply could not be used: {error}. Reply again with only "
+                f"the JSON object (keys: {keys}), no code fences or other text."
+            )
+        ),
+    ]
+
+
+def _reply(raw, parsed, error, responses) -> dict:
+    return {
+        "data": parsed if error is None else None,
+        "raw": raw,
+        "error": error,
+        "repaired": len(responses) > 1 and error is None,
+        "llm_usage": sum_llm_usage(llm_usage(r) for r in responses),
+    }
+
+
+def _retries() -> int:
+    return max(int(getattr(settings, "AGENT_REPAIR_RETRIES", 1)), 0)
+
+
+def _call(runnable, value, on_token, attempt):
+    with timing.phase("llm_wait"):
+        if on_token is None:
+            return runnable.invoke(value)
+        response = None
+        for chunk in runnable.stream(value):
+            text = response_text(chunk)
+            if text:
+                on_token(text, attempt)
+            # chunks add up to the full message, usage_metadata included
+            response = chunk if response is None else response + chunk
+        return response
+
+
+async def _acall(runnable, value, on_token, attempt):
+    with timing.phase("llm_wait"):
+        if on_token is None:
+            return await runnable.ainvoke(value)
+        response = None
+        async for chunk in runnable.astream(value):
+            text = response_text(chunk)
+            if text:
+                # may be a coroutine: the async pipeline waits on a bounded queue
+                sent = on_token(text, attempt)
+                if inspect.isawaitable(sent):
+                    await sent
+            response = chunk if response is None else response + chunk
+        return response
+
+
+def invoke(chain, inputs: dict, schema: dict, on_token=None) -> dict:
+    """
+    Run a `prompt | llm` chain and parse its reply. Returns {"data": dict or
+    None, "raw", "error", "repaired", "llm_usage"}.
+    """
+    responses = [_call(chain, inputs, on_token, 0)]
+    raw, parsed, error = _check(responses[-1], schema)
+    for attempt in range(1, _retries() + 1):
+        if error is None:
+            break
+        messages = _repair_messages(chain, inputs, raw, error, schema)
+        responses.append(_call(chain.last, messages, on_token, attempt))
+        raw, parsed, error = _check(responses[-1], schema)
+    return _reply(raw, parsed, error, responses)
+
+
+async def ainvoke(chain, inputs: dict, schema: dict, on_token=None) -> dict:
+    """Async variant of `invoke`."""
+    responses = [await _acall(chain, inputs, on_token, 0)]
+    raw, parsed, error = _check(responses[-1], schema)
+    for attempt in range(1, _retries() + 1):
+        if error is None:
+            break
+        messages = _repair_messages(chain, inputs, raw, error, schema)
+        responses.append(await _acall(chain.last, messages, on_token, attempt))
+        raw, parsed, error = _check(responses[-1], schema)
+    return _reply(raw, parsed, error, responses)
@@ -0,0 +1,430 @@
+"""Execution helpers shared by the agent pipeline views.
+
+`PipelineRun` holds what the sync (views.py) and async (async_views.py)
+endpoints have in common: which function runs each stage (cached, routed,
+speculative or the agent), the events around it, usage counting and the
+final summary. The views only drive the stages on a thread pool or an event
+loop and forward their events.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from core.limit_rate import increment_user_chats
+from core.models import DailyUsage, Files, UserLimits
+from utils import metrics, timing
+from utils.tokens import sum_llm_usage
+from . import pipeline_cache, router, speculative
+
+# Put on a stage's event queue once the stage has finished
+STAGE_DONE = object()
+
+# Cache key prefix (per user) of the last pipeline result
+CACHE_KEY_PREFIX = "last_agent_result"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Shared, bounded pool that runs pipeline stages for every request."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "PIPELINE_STAGE_WORKERS", 32),
+                    thread_name_prefix="agent-stage",
+                )
+    return _executor
+
+
+def submit_stage(events, fn, *args, **kwargs):
+    """
+    Run `fn(*args, **kwargs)` on the shared pool and put STAGE_DONE on the
+    `events` queue when it finishes, so the stream wakes up immediately.
+    """
+    future = get_executor().submit(fn, *args, **kwargs)
+    future.add_done_callback(lambda _: events.put(STAGE_DONE))
+    return future
+
+
+class TokenRelay:
+    """
+    on_token callback for a streaming agent stage. Text deltas are batched into
+    {"agent", "status": "token", "delta", "attempt"} events, at most one per
+    AGENT_TOKEN_FLUSH_SECONDS, and handed to `put`. If `put` is a coroutine
+    function, calls return its awaitable. Call `flush()` when the stage ends.
+    """
+
+    def __init__(self, agent: str, put):
+        self.agent = agent
+        self.put = put
+        self.interval = getattr(settings, "AGENT_TOKEN_FLUSH_SECONDS", 0.05)
+        self.attempt = 0
+        self.buffer = []
+        self.last_flush = 0.0
+
+    def __call__(self, text: str, attempt: int = 0):
+        if attempt != self.attempt:
+            # text of an earlier attempt must not be merged into a repair
+            pending = self.flush()
+            self.attempt = attempt
+            self.buffer.append(text)
+            return pending
+        self.buffer.append(text)
+        if time.monotonic() - self.last_flush >= self.interval:
+            return self.flush()
+        return None
+
+    def flush(self):
+        if not self.buffer:
+            return None
+        event = {
+            "agent": self.agent,
+            "status": "token",
+            "delta": "".join(self.buffer),
+            "attempt": self.attempt,
+        }
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        return self.put(event)
+
+
+def build_usage_payload(user):
+    """Usage/limits snapshot sent at the end of a pipeline run, or None on failure."""
+    try:
+        today = timezone.now().date()
+        du, _ = DailyUsage.objects.get_or_create(
+            user=user, date=today, defaults={"chats_used": 0}
+        )
+
+        # compute used_bytes and limits for final payload
+        agg = Files.objects.filter(user=user).aggregate(total=Sum("size"))
+        used_bytes = int(agg.get("total") or 0)
+        limits, _ = UserLimits.objects.get_or_create(user=user)
+        GB = 1024**3
+        now = timezone.now()
+        next_day = (now + timezone.timedelta(days=1)).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        seconds_until_reset = int((next_day - now).total_seconds())
+        return {
+            "max_chats": limits.max_chats,
+            "max_gb": limits.max_gb_db,
+            "chats_used_today": du.chats_used,
+            "used_bytes": used_bytes,
+            "max_bytes": int(limits.max_gb_db) * GB,
+            "seconds_until_reset": seconds_until_reset,
+            "server_time": now.isoformat(),
+            "reset_time": next_day.isoformat(),
+        }
+    except Exception:
+        # avoid crashing the stream on usage tracking errors
+        return None
+
+
+def count_stage_usage(user, result) -> bool:
+    """
+    Count one chat for a stage that produced a non-error output. Returns True
+    when this pushed the user to their daily limit and the pipeline must stop.
+    """
+    try:
+        if isinstance(result, dict) and result.get("error"):
+            return False
+        new_count = increment_user_chats(user, amount=1)
+        try:
+            max_chats = getattr(user.userlimits, "max_chats", 0)
+        except Exception:
+            max_chats = 0
+        return bool(new_count is not None and max_chats and new_count >= max_chats)
+    except Exception:
+        # Do not break the stream if increment or limit-check fails
+        return False
+
+
+def summarize_llm_usage(stage_outputs: dict):
+    """Total LLM token usage (and cached-prompt ratio) of the stages that called a model."""
+    return sum_llm_usage(
+        output.get("llm_usage")
+        for output in stage_outputs.values()
+        if isinstance(output, dict)
+    )
+
+
+def stage_timing_event(agent: str, timer, output, source=None) -> dict:
+    """
+    The stage's {"agent", "status": "timing", "timing", "tokens"} event from its
+    StageTimer (utils/timing.py) and LLM usage; also records it in utils/metrics.
+    `source` is "cached" or "routed" when the agent did not run.
+    """
+    timing = timer.as_dict()
+    failed = isinstance(output, dict) and bool(output.get("error"))
+    usage = output.get("llm_usage") if isinstance(output, dict) else None
+
+    metrics.observe("agent_stage_seconds", timing["total"], agent=agent)
+    for phase, seconds in timing["phases"].items():
+        metrics.observe("agent_phase_seconds", seconds, agent=agent, phase=phase)
+    metrics.inc("agent_stage_total", agent=agent, outcome="error" if failed else source or "ok")
+
+    event = {"agent": agent, "status": "timing", "timing": timing}
+    if usage:
+        tokens = {
+            kind: usage.get(f"{kind}_tokens", 0) for kind in ("input", "cached", "output")
+        }
+        for kind, count in tokens.items():
+            if count:
+                metrics.inc("agent_llm_tokens_total", count, agent=agent, kind=kind)
+        event["tokens"] = tokens
+    return event
+
+
+def sse(payload) -> str:
+    """One SSE "data:" event."""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+def now_str():
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _constant(output, is_async):
+    """A stage function that returns `output` without calling the agent."""
+    if is_async:
+
+        async def func(*args, **kwargs):
+            return output
+
+    else:
+
+        def func(*args, **kwargs):
+            return output
+
+    return func
+
+
+class Stage:
+    """One agent stage of a run: the function to call and its timer."""
+
+    def __init__(self, run, name: str, agent, is_async: bool):
+        self.run = run
+        self.name = name
+        self.started_at = now_str()
+        # Monotonic stage timing, with phases reported from inside the agents
+        self.timer = timing.StageTimer()
+        # Events to send before the stage runs (e.g. the routing decision)
+        self.notices = []
+
+        # Replay a cached output instead of calling the agent
+        self.replayed = run.cached_outputs.get(name) if run.cached_outputs else None
+        self.routed = None
+        if self.replayed is None and run.routing and not (
+            run.speculative and name == "b-table-select"
+        ):
+            self.routed = router.route(name, run.user.id, run.result)
+
+        if self.replayed is not None:
+            self.func = _constant(self.replayed, is_async)
+        elif self.routed is not None:
+            self.notices.append(router.event(name, self.routed))
+            self.func = _constant(self.routed["output"], is_async)
+        elif run.speculative and name == "b-table-select":
+            self.func = run.aspeculate if is_async else run.speculate
+        elif run.speculation.get("c") is not None and name == "c-sql-generate":
+            # Already generated (and validated) during speculation
+            self.func = _constant(run.speculation["c"], is_async)
+        else:
+            self.func = agent
+
+        # Only a real LLM call (not a replayed/routed/speculative output) streams
+        self.streams_tokens = (
+            run.stream_tokens and self.func is agent and name != "d-sql-connector"
+        )
+
+    @property
+    def source(self):
+        """"cached" or "routed" when the agent did not run, else None."""
+        if self.replayed is not None:
+            return "cached"
+        return "routed" if self.routed is not None else None
+
+    def call(self, on_rows=None, on_token=None):
+        """Call the stage function (returns an awaitable for async stages)."""
+        run = self.run
+        args = (run.api_key, run.result, run.user.id)
+        kwargs = {"on_token": on_token} if on_token is not None else {}
+        # Pass parameters to agents that support them
+        if self.name == "a-db-select":
+            return self.func(*args, model=run.model, top_k=run.top_k, **kwargs)
+        if self.name == "d-sql-connector" and run.stream_rows:
+            return self.func(*args, on_rows=on_rows)
+        return self.func(*args, **kwargs)
+
+
+class PipelineRun:
+    """State of one A-D pipeline run for `user`, built from the request body."""
+
+    def __init__(self, user, api_key, data: dict):
+        self.user = user
+        self.api_key = api_key
+        # Each stage's input is the previous stage's output
+        self.result = data
+        self.started = time.perf_counter()
+
+        # Extract parameters from request data
+        self.model = data.get("model", "gpt-5-mini")
+        self.top_k = int(data.get("top_k", 5))
+        # Opt-in: stream SQL rows as columnar events instead of one big output
+        self.stream_rows = bool(data.get("stream_rows", False))
+        # Opt-out of replaying cached Agent A-C outputs for repeated questions
+        self.use_cache = not data.get("no_cache", False)
+        # Opt-in: run B+C for every close candidate database and keep the best valid SQL
+        self.speculative = bool(data.get("speculative", False))
+        # Skip Agent A/B when their answer is already known (agents/router.py)
+        self.routing = router.enabled(data)
+        # Opt-out: forward Agent A-C replies token by token as "token" events
+        self.stream_tokens = bool(data.get("stream_tokens", True))
+
+        self.query = data.get("query")
+        self.cached_outputs = None
+        self.stage_outputs = {}
+        self.stage_seconds = {}
+        self.speculation = {}
+        self.usage = None
+
+    def missing_key(self) -> list:
+        """Events for a run without an API key (and remember the error)."""
+        cache.set(f"{CACHE_KEY_PREFIX}:{self.user.id}", {"error": "Missing API key"}, None)
+        return [
+            sse({
+                "status": "error",
+                "agent": "bootstrap",
+                "error": "Missing API key. Please set your API key in profile settings.",
+                "time": now_str(),
+            }),
+            sse({"status": "finished", "time": now_str()}),
+        ]
+
+    def load_cache(self):
+        """Look up cached A-C outputs for this question."""
+        if not self.use_cache:
+            return
+        try:
+            self.cached_outputs = pipeline_cache.lookup(
+                self.user.id, self.api_key, self.query, self.model, self.top_k
+            )
+        except Exception:
+            self.cached_outputs = None
+
+    def speculate(self, api_key, payload, user_id):
+        self.speculation.update(speculative.run(api_key, payload, user_id))
+        return self.speculation["b"]
+
+    async def aspeculate(self, api_key, payload, user_id):
+        self.speculation.update(await speculative.arun(api_key, payload, user_id))
+        return self.speculation["b"]
+
+    def stage(self, name: str, agent, is_async: bool = False) -> Stage:
+        """Decide what runs for stage `name` (`agent` unless it can be skipped)."""
+        return Stage(self, name, agent, is_async)
+
+    def finish_stage(self, stage: Stage, output) -> list:
+        """Record a stage's output; returns its output and timing events."""
+        name = stage.name
+        self.result = output
+        self.stage_outputs[name] = output
+
+        lines = []
+        payload = {
+            "agent": name,
+            "output": output,
+            "started_at": stage.started_at,
+            "finished_at": now_str(),
+        }
+        if stage.replayed is not None:
+            payload["cached"] = True
+        if name == "b-table-select" and self.speculation.get("report"):
+            lines.append(sse({"agent": name, "status": "speculative", **self.speculation["report"]}))
+        with timing.use(stage.timer), timing.phase("serialization"):
+            lines.append(sse(payload))
+
+        stage.timer.stop()
+        timing_event = stage_timing_event(name, stage.timer, output, stage.source)
+        self.stage_seconds[name] = timing_event["timing"]["total"]
+        lines.append(sse(timing_event))
+        return lines
+
+    def stop_events(self, stage: Stage) -> list:
+        """
+        Count a stage that ran its agent towards the user's chats. Returns the error events that
+        end the run (daily limit reached or a failed stage), or [] to go on.
+        """
+        output = self.result
+        # Increment user's chat usage for each meaningful response emitted by an
+        # agent; cached and routed stages made no LLM call and are not counted.
+        if stage.source is None and count_stage_usage(self.user, output):
+            return [
+                sse({
+                    "status": "error",
+                    "agent": stage.name,
+                    "error": "Daily chat limit reached during run",
+                    "time": now_str(),
+                })
+            ]
+        if isinstance(output, dict) and output.get("error"):
+            return [sse({"status": "error", "agent": stage.name, "time": now_str()})]
+        return []
+
+    def finish(self) -> list:
+        """The closing usage and "finished" events."""
+        # Usage was incremented during the stream; only read it here
+        self.usage = build_usage_payload(self.user)
+        lines = []
+        if self.usage:
+            lines.append(sse({"usage": self.usage}))
+
+        finished = {"status": "finished", "time": now_str()}
+        llm_usage = summarize_llm_usage(self.stage_outputs)
+        if llm_usage:
+            finished["llm_usage"] = llm_usage
+        finished["timing"] = {
+            "total": round(time.perf_counter() - self.started, 6),
+            "stages": self.stage_seconds,
+        }
+        lines.append(sse(finished))
+        return lines
+
+    def save(self):
+        """Cache the stage outputs and the last result (for GET /api/agents/)."""
+        # Remember the LLM stage outputs for the next identical question, but
+        # only once their SQL has run; failed SQL must reach the LLM again
+        sql_output = self.stage_outputs.get("d-sql-connector")
+        ran = isinstance(sql_output, dict) and not sql_output.get("error")
+        if self.use_cache and not self.cached_outputs and ran:
+            try:
+                pipeline_cache.store(
+                    self.user.id,
+                    self.api_key,
+                    self.query,
+                    self.model,
+                    self.top_k,
+                    self.stage_outputs,
+                )
+            except Exception:
+                pass
+
+        key = f"{CACHE_KEY_PREFIX}:{self.user.id}"
+        try:
+            cache.set(key, {"result": self.result, "usage": self.usage}, None)
+        except Exception:
+            try:
+                cache.set(key, self.result, None)
+            except Exception:
+                pass
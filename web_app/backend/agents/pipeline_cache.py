@@ -0,0 +1,157 @@
+"""Per-user cache of pipeline stage outputs (Agents A-C).
+
+A repeated question against unchanged schemas replays the cached outputs of
+the LLM stages instead of paying for three LLM calls; the SQL stage still
+runs live. Entries are keyed by (user, normalized query, model, top_k) and
+remember the schema version they were built against, so any schema sync
+invalidates them. With PIPELINE_CACHE_SIMILARITY set, a question whose
+embedding is at least that cosine-similar to a cached one is also a hit.
+"""
+
+import json
+import math
+import re
+import time
+
+from django.conf import settings
+
+from utils import llm_pool, schema_store
+from utils.lru import ByteLRU
+from utils.schema_builder import get_schema_dir
+
+# Stages whose outputs are cached and replayed
+CACHED_STAGES = ("a-db-select", "b-table-select", "c-sql-generate")
+
+_cache = ByteLRU(getattr(settings, "PIPELINE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation."""
+    text = re.sub(r"\s+", " ", (query or "").strip().casefold())
+    return text.rstrip(" ?.!;")
+
+
+def _enabled() -> bool:
+    return bool(getattr(settings, "PIPELINE_CACHE_ENABLED", True))
+
+
+def _fresh(entry, version) -> bool:
+    ttl = getattr(settings, "PIPELINE_CACHE_TTL_SECONDS", 24 * 3600)
+    return entry["version"] == version and (
+        not ttl or time.time() - entry["created_at"] <= ttl
+    )
+
+
+def _embed(api_key: str, query: str):
+    try:
+        return llm_pool.get_embeddings(api_key).embed_query(query)
+    except Exception:
+        return None
+
+
+def _cosine(a, b) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _replay(entry, query: str) -> dict:
+    # Copies, re-labelled with the question actually asked
+    outputs = json.loads(entry["outputs"])
+    for output in outputs.values():
+        output["query"] = query
+    return outputs
+
+
+def lookup(
+    user_id: int, api_key: str, query: str, model: str, top_k: int, similar: bool = True
+):
+    """
+    Return { stage name: output } for a cached run of `query`, or None.
+    Exact matches are tried first, then (if enabled and `similar`) the most
+    similar cached question above PIPELINE_CACHE_SIMILARITY.
+    """
+    if not _enabled() or not query:
+        return None
+    version = schema_store.schema_version(get_schema_dir(user_id))
+    if version is None:
+        return None
+
+    key = (user_id, normalize_query(query), model, top_k)
+    entry = _cache.get(key)
+    if entry is not None:
+        if _fresh(entry, version):
+            return _replay(entry, query)
+        _cache.pop(key)
+
+    threshold = getattr(settings, "PIPELINE_CACHE_SIMILARITY", None)
+    if not threshold or not similar:
+        return None
+    candidates = _cache.items_where(
+        lambda k: k[0] == user_id and k[2] == model and k[3] == top_k
+    )
+    candidates = [
+        (k, e) for k, e in candidates if e.get("embedding") and _fresh(e, version)
+    ]
+    if not candidates:
+        return None
+    vector = _embed(api_key, query)
+    if vector is None:
+        return None
+
+    best_key, best_score = None, threshold
+    for k, e in candidates:
+        score = _cosine(vector, e["embedding"])
+        if score >= best_score:
+            best_key, best_score = k, score
+    if best_key is None:
+        return None
+    entry = _cache.get(best_key)
+    return _replay(entry, query) if entry is not None else None
+
+
+def store(user_id: int, api_key: str, query: str, model: str, top_k: int, outputs: dict):
+    """
+    Cache the outputs of a run in which every cached stage succeeded and the
+    generated SQL ran without error; SQL that failed is not replayed.
+    """
+    if not _enabled() or not query:
+        return False
+    if any(
+        not isinstance(outputs.get(name), dict) or outputs[name].get("error")
+        for name in CACHED_STAGES + ("d-sql-connector",)
+    ):
+        return False
+    version = schema_store.schema_version(get_schema_dir(user_id))
+    if version is None:
+        return False
+
+    embedding = None
+    if getattr(settings, "PIPELINE_CACHE_SIMILARITY", None):
+        embedding = _embed(api_key, query)
+
+    # Token usage belongs to the original run; a replay costs nothing
+    serialized = json.dumps(
+        {
+            name: {k: v for k, v in outputs[name].items() if k != "llm_usage"}
+            for name in CACHED_STAGES
+        },
+        ensure_ascii=False,
+    )
+    entry = {
+        "version": version,
+        "created_at": time.time(),
+        "outputs": serialized,
+        "embedding": embedding,
+    }
+    nbytes = len(serialized) * 2 + len(embedding or ()) * 8 + 256
+    return _cache.put((user_id, normalize_query(query), model, top_k), entry, nbytes)
+
+
+def invalidate_user(user_id: int):
+    """Drop every cached run of one user (e.g. after their schemas changed)."""
+    return _cache.pop_where(lambda k: k[0] == user_id)
+
+
+def clear():
+    _cache.clear()
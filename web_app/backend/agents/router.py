@@ -0,0 +1,104 @@
+"""Adaptive routing: skip LLM stages whose answer is already known.
+
+- Agent A is skipped when the user has exactly one database.
+- Agent B is skipped when the chosen database is small (few tables and a short
+  schema) and Agent A's retrieval agrees with the choice; every table is then
+  passed to Agent C, best retrieval scores first.
+Decisions are reported in the SSE stream by the pipeline views.
+"""
+
+import json
+
+from django.conf import settings
+
+from utils import schema_store
+from utils.schema_builder import get_schema_dir
+from utils.tokens import count_tokens
+
+
+def enabled(request_data: dict) -> bool:
+    return bool(
+        request_data.get("adaptive", getattr(settings, "ROUTER_ENABLED", False))
+    )
+
+
+def _route_a(user_id: int, payload: dict):
+    manifest = schema_store.get_schema_c_manifest(get_schema_dir(user_id)) or {}
+    if len(manifest) != 1 or not payload.get("query"):
+        return None
+    (db_name,) = manifest
+    return {
+        "reason": "only_database",
+        "output": {
+            "query": payload.get("query"),
+            "database": db_name,
+            "reasons": "Skipped database selection: this is the only uploaded database.",
+            "retrieved_schemas": [],
+        },
+    }
+
+
+def _route_b(user_id: int, payload: dict):
+    db_name = payload.get("database")
+    if not db_name or not payload.get("query"):
+        return None
+
+    entries = schema_store.get_table_entries(get_schema_dir(user_id), db_name) or []
+    if not entries:
+        return None
+    max_tables = getattr(settings, "ROUTER_SKIP_B_MAX_TABLES", 5)
+    if len(entries) > max_tables:
+        return None
+    schema_tokens = count_tokens(json.dumps(entries, ensure_ascii=False))
+    if schema_tokens > getattr(settings, "ROUTER_SKIP_B_MAX_TOKENS", 1500):
+        return None
+
+    # Retrieval must have surfaced the chosen database (skipped A has no retrieval)
+    scores = {}
+    retrieved = payload.get("retrieved_schemas") or []
+    for schema in retrieved:
+        if schema.get("database") == db_name and schema.get("table"):
+            table = schema["table"]
+            scores[table] = max(scores.get(table, 0.0), float(schema.get("similarity") or 0.0))
+    if retrieved and not scores:
+        return None
+
+    order = {e["table"]: i for i, e in enumerate(entries)}
+    tables = sorted(order, key=lambda t: (-scores.get(t, 0.0), order[t]))
+    return {
+        "reason": "small_database",
+        "tables": len(tables),
+        "schema_tokens": schema_tokens,
+        "output": {
+            "query": payload.get("query"),
+            "database": db_name,
+            "tables": tables,
+            "relevant_tables": tables,
+            "reasons": (
+                f"Skipped table selection: '{db_name}' has {len(tables)} tables "
+                f"(~{schema_tokens} schema tokens), so all of them are passed on."
+            ),
+        },
+    }
+
+
+def route(stage: str, user_id: int, payload: dict):
+    """
+    Decide whether `stage` can be skipped for this payload. Returns None (run
+    the agent) or {"reason": ..., "output": <the stage's output>, ...}.
+    """
+    try:
+        if stage == "a-db-select":
+            return _route_a(user_id, payload)
+        if stage == "b-table-select":
+            return _route_b(user_id, payload)
+    except Exception:
+        # Routing is an optimization; never fail the pipeline over it
+        return None
+    return None
+
+
+def event(stage: str, decision: dict) -> dict:
+    """SSE payload announcing a skipped stage (no `output` key)."""
+    details = {k: v for k, v in decision.items() if k != "output"}
+    return {"agent": stage, "status": "routed", "skipped": True, **details}
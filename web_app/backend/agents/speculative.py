@@ -0,0 +1,158 @@
+"""Speculative execution of Agents B and C over several candidate databases.
+
+When Agent A's retrieved schemas score several databases about equally, the
+pick is a coin toss. In speculative mode B+C run concurrently for the top
+candidates (A's choice first), each generated query is validated with
+EXPLAIN, and the best-ranked candidate whose SQL validates wins. Costs extra
+tokens; saves a failed pipeline on ambiguous questions.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from utils import sql_connector
+from . import b_table_select, c_sql_generate
+
+# Separate from the stage pool: a stage waits on these, so sharing could deadlock
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "SPECULATIVE_WORKERS", 16),
+                    thread_name_prefix="agent-speculative",
+                )
+    return _executor
+
+
+def candidate_databases(a_output: dict) -> list:
+    """
+    Databases worth trying for an Agent A output: A's choice, then others whose
+    best retrieved similarity is within SPECULATIVE_SCORE_MARGIN of the top one,
+    at most SPECULATIVE_MAX_CANDIDATES in total.
+    """
+    max_candidates = max(getattr(settings, "SPECULATIVE_MAX_CANDIDATES", 3), 1)
+    margin = getattr(settings, "SPECULATIVE_SCORE_MARGIN", 0.05)
+    chosen = a_output.get("database")
+
+    best = {}
+    for schema in a_output.get("retrieved_schemas") or []:
+        db = schema.get("database")
+        if db:
+            best[db] = max(best.get(db, 0.0), float(schema.get("similarity") or 0.0))
+    if not best:
+        return [chosen] if chosen else []
+
+    top = max(best.values())
+    close = [db for db in sorted(best, key=lambda d: -best[d]) if top - best[db] <= margin]
+    candidates = ([chosen] if chosen else []) + [db for db in close if db != chosen]
+    return candidates[:max_candidates]
+
+
+def _validate(user_id: int, c_output: dict):
+    """None if C produced SQL that compiles against the database, else an error string."""
+    if not isinstance(c_output, dict) or c_output.get("error"):
+        return (c_output or {}).get("error") or "no output"
+    return sql_connector.validate_sql(user_id, c_output.get("database"), c_output.get("SQL"))
+
+
+def _run_candidate(api_key, payload, user_id, db_name):
+    close_old_connections()
+    try:
+        b_output = b_table_select.run(api_key, dict(payload, database=db_name), user_id)
+        if b_output.get("error"):
+            return b_output, None, b_output["error"]
+        c_output = c_sql_generate.run(api_key, b_output, user_id)
+        return b_output, c_output, _validate(user_id, c_output)
+    finally:
+        close_old_connections()
+
+
+def _outcome(candidates, results, winner, errors):
+    b_output, c_output, _ = results[winner]
+    return {
+        "b": b_output,
+        "c": c_output,
+        "report": {
+            "candidates": candidates,
+            "selected": candidates[winner],
+            "validated": candidates[winner] not in errors,
+            "errors": errors,
+        },
+    }
+
+
+def run(api_key, a_output: dict, user_id: int) -> dict:
+    """
+    Run B (+C) for each candidate database of `a_output`. Returns
+    {"b": output, "c": output or None, "report": {...} or None}; with a single
+    candidate only B runs and C is left to the normal pipeline.
+    """
+    candidates = candidate_databases(a_output)
+    if len(candidates) < 2:
+        return {"b": b_table_select.run(api_key, a_output, user_id), "c": None, "report": None}
+
+    pool = _get_executor()
+    futures = [
+        pool.submit(_run_candidate, api_key, a_output, user_id, db) for db in candidates
+    ]
+    results, errors = [], {}
+    # Rank order: stop at the first candidate that validates
+    for index, future in enumerate(futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(({"error": str(e)}, None, str(e)))
+        error = results[-1][2]
+        if error is None:
+            return _outcome(candidates, results, index, errors)
+        errors[candidates[index]] = error
+    # Nothing validated: keep A's choice so the pipeline reports its error as usual
+    return _outcome(candidates, results, 0, errors)
+
+
+async def _arun_candidate(api_key, payload, user_id, db_name):
+    b_output = await b_table_select.arun(api_key, dict(payload, database=db_name), user_id)
+    if b_output.get("error"):
+        return b_output, None, b_output["error"]
+    c_output = await c_sql_generate.arun(api_key, b_output, user_id)
+    error = await sync_to_async(_validate, thread_sensitive=False)(user_id, c_output)
+    return b_output, c_output, error
+
+
+async def arun(api_key, a_output: dict, user_id: int) -> dict:
+    """Async variant of `run` for the ASGI pipeline."""
+    candidates = candidate_databases(a_output)
+    if len(candidates) < 2:
+        b_output = await b_table_select.arun(api_key, a_output, user_id)
+        return {"b": b_output, "c": None, "report": None}
+
+    tasks = [
+        asyncio.ensure_future(_arun_candidate(api_key, a_output, user_id, db))
+        for db in candidates
+    ]
+    results, errors = [], {}
+    try:
+        for index, task in enumerate(tasks):
+            try:
+                results.append(await task)
+            except Exception as e:
+                results.append(({"error": str(e)}, None, str(e)))
+            error = results[-1][2]
+            if error is None:
+                return _outcome(candidates, results, index, errors)
+            errors[candidates[index]] = error
+        return _outcome(candidates, results, 0, errors)
+    finally:
+        for task in tasks:
+            task.cancel()
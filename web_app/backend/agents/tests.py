@@ -0,0 +1,165 @@
+"""Tests for the agent pipeline helpers. Run with `python manage.py test agents.tests`."""
+
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+from langchain_core.embeddings import Embeddings
+
+from utils import llm_pool, vectorstore_cache
+from . import a_db_select, pipeline, pipeline_cache
+
+QUERY = "How many singers are there?"
+OUTPUTS = {
+    "a-db-select": {"query": QUERY, "database": "concert_singer"},
+    "b-table-select": {"query": QUERY, "database": "concert_singer", "tables": ["singer"]},
+    "c-sql-generate": {"query": QUERY, "database": "concert_singer", "SQL": "SELECT count(*) FROM singer"},
+}
+SQL_OK = {"success": True, "result": [{"count(*)": 6}], "row_count": 1}
+SQL_FAILED = {"error": "no such table: singer"}
+
+
+class PipelineCacheStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media,
+            PIPELINE_CACHE_ENABLED=True,
+            PIPELINE_CACHE_SIMILARITY=None,
+        )
+        self.settings_override.enable()
+        self.user_id = 4242
+        schema_dir = os.path.join(self.media, str(self.user_id), "schema")
+        os.makedirs(schema_dir)
+        with open(os.path.join(schema_dir, "schema_ab.jsonl"), "w", encoding="utf-8") as f:
+            f.write('{"database": "concert_singer", "table": "singer"}\n')
+        pipeline_cache.invalidate_user(self.user_id)
+
+    def tearDown(self):
+        pipeline_cache.invalidate_user(self.user_id)
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def lookup(self):
+        return pipeline_cache.lookup(self.user_id, "key", QUERY, "gpt-5-mini", 5)
+
+    def test_run_with_working_sql_is_cached(self):
+        outputs = {**OUTPUTS, "d-sql-connector": SQL_OK}
+        self.assertTrue(
+            pipeline_cache.store(self.user_id, "key", QUERY, "gpt-5-mini", 5, outputs)
+        )
+        self.assertEqual(self.lookup()["c-sql-generate"]["SQL"], "SELECT count(*) FROM singer")
+
+    def test_run_with_failed_sql_is_not_cached(self):
+        outputs = {**OUTPUTS, "d-sql-connector": SQL_FAILED}
+        self.assertFalse(
+            pipeline_cache.store(self.user_id, "key", QUERY, "gpt-5-mini", 5, outputs)
+        )
+        self.assertIsNone(self.lookup())
+
+    def test_run_without_sql_stage_is_not_cached(self):
+        self.assertFalse(
+            pipeline_cache.store(self.user_id, "key", QUERY, "gpt-5-mini", 5, dict(OUTPUTS))
+        )
+        self.assertIsNone(self.lookup())
+
+    def test_pipeline_run_does_not_cache_failed_sql(self):
+        user = SimpleNamespace(id=self.user_id)
+        run = pipeline.PipelineRun(user, "key", {"query": QUERY})
+        run.stage_outputs = {**OUTPUTS, "d-sql-connector": SQL_FAILED}
+        run.result = SQL_FAILED
+        run.save()
+        self.assertIsNone(self.lookup())
+
+        run.stage_outputs["d-sql-connector"] = SQL_OK
+        run.save()
+        self.assertIsNotNone(self.lookup())
+
+
+class CountingEmbeddings(Embeddings):
+    """Deterministic offline embeddings that record every text they embed."""
+
+    def __init__(self):
+        self.documents = []
+        self.queries = []
+
+    def _vector(self, text):
+        return [float(len(text)), float(sum(map(ord, text)) % 997), float(text.count(" "))]
+
+    def embed_documents(self, texts):
+        self.documents.extend(texts)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return self._vector(text)
+
+
+class SchemaEmbeddingsTests(SimpleTestCase):
+    LINES = [
+        '{"database": "alpha", "table": "a1", "columns": ["id"]}',
+        '{"database": "alpha", "table": "a2", "columns": ["id", "name"]}',
+        '{"database": "beta", "table": "b1", "columns": ["id"]}',
+    ]
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media)
+        self.settings_override.enable()
+        self.embeddings = CountingEmbeddings()
+        patcher = mock.patch.object(
+            llm_pool, "get_embeddings", lambda api_key, model=None: self.embeddings
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user_id = 4243
+        vectorstore_cache.clear()
+        self.write_schema(self.LINES)
+
+    def tearDown(self):
+        vectorstore_cache.clear()
+        self.settings_override.disable()
+        shutil.rmtree(self.media, ignore_errors=True)
+
+    def write_schema(self, lines):
+        with open(a_db_select.get_user_schema_file(self.user_id), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def build(self):
+        """Load the index as a fresh process would (nothing cached in memory)."""
+        vectorstore_cache.clear()
+        self.embeddings.documents.clear()
+        return a_db_select.create_or_load_embeddings("key", self.user_id)
+
+    def test_first_build_embeds_every_line(self):
+        vectorstore = self.build()
+        self.assertEqual(sorted(self.embeddings.documents), sorted(self.LINES))
+        self.assertEqual(vectorstore.index.ntotal, 3)
+
+    def test_unchanged_schema_makes_no_embed_calls(self):
+        self.build()
+        # Reconciling the saved index against unchanged lines
+        self.assertEqual(self.build().index.ntotal, 3)
+        self.assertEqual(self.embeddings.documents, [])
+
+        # Rebuilding the index from scratch uses the on-disk embedding cache
+        shutil.rmtree(a_db_select.get_user_embeddings_folder(self.user_id))
+        self.assertEqual(self.build().index.ntotal, 3)
+        self.assertEqual(self.embeddings.documents, [])
+
+    def test_only_changed_database_is_reembedded(self):
+        self.build()
+        changed = '{"database": "beta", "table": "b1", "columns": ["id", "total"]}'
+        self.write_schema(self.LINES[:2] + [changed])
+
+        vectorstore = self.build()
+        self.assertEqual(self.embeddings.documents, [changed])
+        self.assertEqual(vectorstore.index.ntotal, 3)
+        stored = {
+            vectorstore.docstore.search(doc_id).page_content
+            for doc_id in vectorstore.index_to_docstore_id.values()
+        }
+        self.assertEqual(stored, set(self.LINES[:2] + [changed]))
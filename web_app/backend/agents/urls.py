@@ -1,7 +1,12 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
+from .async_views import pipeline_stream
 from .views import AgentViewSet
 
 router = DefaultRouter()
 router.register(r"", AgentViewSet, basename="agents")
 
-urlpatterns = router.urls
+urlpatterns = [
+    # Async (ASGI) pipeline; same body and SSE events as POST /api/agents/
+    path("async/", pipeline_stream, name="agents-async"),
+] + router.urls
@@ -4,19 +4,25 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 import json
+from django.conf import settings
 from django.core.cache import cache
-from datetime import datetime
+from django.db import close_old_connections
 
 from core.models import APIKeys
 from utils import sql_connector
-from . import a_db_select, b_table_select, c_sql_generate
+from . import (
+    a_db_select,
+    b_table_select,
+    batch,
+    c_sql_generate,
+    pipeline,
+    router,
+)
+from utils import schema_store, timing
 from utils.schema_builder import get_schema_dir
-import os
+import queue
 import threading
-import time
-from django.utils import timezone
-from core.models import DailyUsage
-from core.limit_rate import has_chat_quota, increment_user_chats
+from core.limit_rate import has_chat_quota
 
 # Pipeline agents
 AGENTS = [
@@ -26,8 +32,12 @@ AGENTS = [
     ("d-sql-connector", sql_connector.run_sql),
 ]
 
-# Cache key prefix (per user)
-CACHE_KEY_PREFIX = "last_agent_result"
+# Seconds between SSE keepalive comments while an agent is working
+HEARTBEAT_SECONDS = 0.8
+
+
+class ClientDisconnected(Exception):
+    pass
 
 
 def get_api_key(user):
@@ -58,171 +68,86 @@ class AgentViewSet(viewsets.ViewSet):
             # (fail-open to avoid denying service on incidental errors).
             pass
 
-        def now_str():
-            return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-
         def event_stream():
-            result = request.data  # initial input (dict from client)
-
-            # Extract parameters from request data
-            model = result.get("model", "gpt-5-mini")
-            top_k = int(result.get("top_k", 5))
-            include_reasons = result.get("include_reasons", True)
-            include_process = result.get("include_process", True)
+            run = pipeline.PipelineRun(request.user, api_key, request.data)
 
             # Ensure API key exists before running any agent that calls LLMs
             if not api_key:
-                payload = {
-                    "status": "error",
-                    "agent": "bootstrap",
-                    "error": "Missing API key. Please set your API key in profile settings.",
-                    "time": now_str(),
-                }
-                yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
-                yield f"data: {json.dumps({'status': 'finished', 'time': now_str()}, ensure_ascii=False)}\n\n"
-                cache.set(
-                    f"{CACHE_KEY_PREFIX}:{request.user.id}",
-                    {"error": "Missing API key"},
-                    None,
-                )
+                yield from run.missing_key()
                 return
 
-            for name, func in AGENTS:
+            run.load_cache()
+            for name, agent in AGENTS:
                 # Announce agent start
-                yield f"data: {json.dumps({'status': 'running', 'agent': name, 'time': now_str()}, ensure_ascii=False)}\n\n"
+                yield pipeline.sse({"status": "running", "agent": name, "time": pipeline.now_str()})
+                stage = run.stage(name, agent)
+                yield from (pipeline.sse(event) for event in stage.notices)
 
-                # Run agent in background thread so we can emit heartbeats while it works
-                start_time = now_str()
+                # Run agent on the shared stage pool so we can emit heartbeats while it works
                 result_container = {}
-
-                def target():
+                # Partial events produced while the agent runs, then STAGE_DONE
+                events = queue.Queue()
+                # Row chunks in flight to the client (backpressure for streamed results)
+                row_slots = threading.Semaphore(
+                    getattr(settings, "SQL_STREAM_QUEUE_CHUNKS", 8)
+                )
+                cancelled = threading.Event()
+
+                def on_rows(columns, rows, name=name, events=events, cancelled=cancelled):
+                    event = {"agent": name, "status": "rows", "rows": rows}
+                    if not result_container.get("columns_sent"):
+                        event["columns"] = columns
+                        result_container["columns_sent"] = True
+                    while not row_slots.acquire(timeout=1):
+                        if cancelled.is_set():
+                            raise ClientDisconnected("client disconnected")
+                    events.put(event)
+
+                relay = pipeline.TokenRelay(name, events.put) if stage.streams_tokens else None
+
+                def target(stage=stage, on_rows=on_rows, relay=relay):
+                    # Pool threads are long-lived; don't keep stale DB connections around
+                    close_old_connections()
                     try:
-                        # Pass parameters to agents that support them
-                        if name == "a-db-select":
-                            result_container["result"] = func(
-                                api_key,
-                                result,
-                                request.user.id,
-                                model=model,
-                                top_k=top_k,
-                            )
-                        else:
-                            result_container["result"] = func(
-                                api_key, result, request.user.id
-                            )
+                        with timing.use(stage.timer):
+                            result_container["result"] = stage.call(on_rows, relay)
                     except Exception as e:
                         result_container["result"] = {"error": str(e)}
+                    finally:
+                        if relay is not None:
+                            relay.flush()
+                        close_old_connections()
 
-                t = threading.Thread(target=target, daemon=True)
-                t.start()
+                pipeline.submit_stage(events, target)
 
-                # While the agent thread is running, emit lightweight comments as keepalive
-                # (colon-prefixed lines are SSE comments and act as heartbeats)
-                while t.is_alive():
-                    try:
-                        yield ":\n\n"
-                        time.sleep(0.8)
-                    except GeneratorExit:
-                        # client disconnected
-                        return
-
-                # Agent finished
-                end_time = now_str()
-                result = result_container.get("result")
-
-                payload = {
-                    "agent": name,
-                    "output": result,
-                    "started_at": start_time,
-                    "finished_at": end_time,
-                }
-                yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
-
-                # Increment user's chat usage for each meaningful response emitted by an agent.
+                # Forward the agent's partial events as they arrive; when idle, emit
+                # lightweight comments as keepalive (colon-prefixed lines are SSE comments)
                 try:
-                    # Only increment when the agent produced a non-error output
-                    if not (isinstance(result, dict) and result.get("error")):
-                        new_count = increment_user_chats(request.user, amount=1)
+                    while True:
                         try:
-                            # read user's limit
-                            max_chats = getattr(request.user.userlimits, "max_chats", 0)
-                        except Exception:
-                            max_chats = 0
-
-                        # If user reached or exceeded their limit as a result of this increment,
-                        # emit an error event and stop the pipeline to prevent further work.
-                        if (
-                            new_count is not None
-                            and max_chats
-                            and new_count >= max_chats
-                        ):
-                            yield f"data: {json.dumps({'status': 'error', 'agent': name, 'error': 'Daily chat limit reached during run', 'time': now_str()}, ensure_ascii=False)}\n\n"
+                            event = events.get(timeout=HEARTBEAT_SECONDS)
+                        except queue.Empty:
+                            yield ":\n\n"
+                            continue
+                        if event is pipeline.STAGE_DONE:
                             break
-                except Exception:
-                    # Do not break the stream if increment or limit-check fails
-                    pass
-
-                # Stop pipeline if error returned
-                if isinstance(result, dict) and result.get("error"):
-                    yield f"data: {json.dumps({'status': 'error', 'agent': name, 'time': now_str()}, ensure_ascii=False)}\n\n"
+                        yield pipeline.sse(event)
+                        if event.get("status") == "rows":
+                            row_slots.release()
+                except GeneratorExit:
+                    # client disconnected; unblock and stop a streaming agent
+                    cancelled.set()
+                    return
+
+                yield from run.finish_stage(stage, result_container.get("result"))
+                # A failed stage, or reaching the daily chat limit, ends the run
+                stop = run.stop_events(stage)
+                if stop:
+                    yield from stop
                     break
 
-            # Pipeline finished
-            # Build final usage payload (do not mutate usage here; increments occurred during the stream)
-            final_usage_payload = None
-            try:
-                today = timezone.now().date()
-                du, _ = DailyUsage.objects.get_or_create(
-                    user=request.user, date=today, defaults={"chats_used": 0}
-                )
-
-                # compute used_bytes and limits for final payload
-                from core.models import Files, UserLimits
-                from django.db.models import Sum
-
-                agg = Files.objects.filter(user=request.user).aggregate(
-                    total=Sum("size")
-                )
-                used_bytes = int(agg.get("total") or 0)
-                limits, _ = UserLimits.objects.get_or_create(user=request.user)
-                GB = 1024**3
-                now = timezone.now()
-                next_day = (now + timezone.timedelta(days=1)).replace(
-                    hour=0, minute=0, second=0, microsecond=0
-                )
-                seconds_until_reset = int((next_day - now).total_seconds())
-                final_usage_payload = {
-                    "max_chats": limits.max_chats,
-                    "max_gb": limits.max_gb_db,
-                    "chats_used_today": du.chats_used,
-                    "used_bytes": used_bytes,
-                    "max_bytes": int(limits.max_gb_db) * GB,
-                    "seconds_until_reset": seconds_until_reset,
-                    "server_time": now.isoformat(),
-                    "reset_time": next_day.isoformat(),
-                }
-            except Exception:
-                # avoid crashing the stream on usage tracking errors
-                final_usage_payload = None
-
-            # Emit final usage payload (if available) so clients can update UI immediately
-            try:
-                if final_usage_payload:
-                    yield f"data: {json.dumps({'usage': final_usage_payload}, ensure_ascii=False)}\n\n"
-            except Exception:
-                pass
-
-            yield f"data: {json.dumps({'status': 'finished', 'time': now_str()}, ensure_ascii=False)}\n\n"
-
-            # Save last result to per-user cache including usage so GET /api/agents/ returns both
-            try:
-                cache_value = {"result": result, "usage": final_usage_payload}
-                cache.set(f"{CACHE_KEY_PREFIX}:{request.user.id}", cache_value, None)
-            except Exception:
-                try:
-                    cache.set(f"{CACHE_KEY_PREFIX}:{request.user.id}", result, None)
-                except Exception:
-                    pass
+            yield from run.finish()
+            run.save()
 
         response = StreamingHttpResponse(
             event_stream(), content_type="text/event-stream"
@@ -233,9 +158,48 @@ class AgentViewSet(viewsets.ViewSet):
         )
         return response
 
+    @action(detail=False, methods=["post"], url_path="batch")
+    def run_batch(self, request):
+        """Run the pipeline for many questions; results stream back as NDJSON lines."""
+        questions, error = batch.parse_questions(request.data)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        api_key = get_api_key(request.user)
+        if not api_key:
+            return Response(
+                {"error": "Missing API key. Please set your API key in profile settings."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            if not has_chat_quota(request.user):
+                return Response(
+                    {"error": "Daily chat limit reached."},
+                    status=status.HTTP_429_TOO_MANY_REQUESTS,
+                )
+        except Exception:
+            # fail-open, as in create()
+            pass
+
+        options = {
+            "model": request.data.get("model", "gpt-5-mini"),
+            "top_k": int(request.data.get("top_k", 5)),
+            "routing": router.enabled(request.data),
+            "use_cache": not request.data.get("no_cache", False),
+            "concurrency": request.data.get("concurrency"),
+        }
+        lines = batch.run(api_key, request.user, questions, options)
+        response = StreamingHttpResponse(
+            (json.dumps(line, ensure_ascii=False) + "\n" for line in lines),
+            content_type="application/x-ndjson",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
     def list(self, request):
         """Return the last cached pipeline result for this user."""
-        data = cache.get(f"{CACHE_KEY_PREFIX}:{request.user.id}")
+        data = cache.get(f"{pipeline.CACHE_KEY_PREFIX}:{request.user.id}")
         if not data:
             return Response(
                 {"status": "no previous result"}, status=status.HTTP_404_NOT_FOUND
@@ -245,7 +209,7 @@ class AgentViewSet(viewsets.ViewSet):
     @action(detail=False, methods=["delete"], url_path="cache")
     def clear_cache(self, request):
         """Clear last cached agent result for this user."""
-        cache.delete(f"{CACHE_KEY_PREFIX}:{request.user.id}")
+        cache.delete(f"{pipeline.CACHE_KEY_PREFIX}:{request.user.id}")
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -259,9 +223,11 @@ class AgentViewSet(viewsets.ViewSet):
             schema_dir = get_schema_dir(request.user.id)
 
             if schema_type == "ab":
-                # Return summarised schema (schema_ab.jsonl) filtered by database
-                schema_file = os.path.join(schema_dir, "schema_ab.jsonl")
-                if not os.path.exists(schema_file):
+                # Return summarised schema (schema_ab) for the database via its index
+                filtered_schemas = schema_store.get_table_entries(
+                    schema_dir, database_name
+                )
+                if filtered_schemas is None:
                     return Response(
                         {
                             "error": "Schema file not found. Please upload databases first."
@@ -269,19 +235,6 @@ class AgentViewSet(viewsets.ViewSet):
                         status=status.HTTP_404_NOT_FOUND,
                     )
 
-                filtered_schemas = []
-                with open(schema_file, "r", encoding="utf-8") as f:
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            schema_obj = json.loads(line)
-                            if schema_obj.get("database") == database_name:
-                                filtered_schemas.append(schema_obj)
-                        except json.JSONDecodeError:
-                            continue
-
                 return Response(
                     {
                         "database": database_name,
@@ -291,9 +244,8 @@ class AgentViewSet(viewsets.ViewSet):
                 )
 
             elif schema_type == "c":
-                # Return full schema (schema_c.json) for specific database
-                schema_file = os.path.join(schema_dir, "schema_c.json")
-                if not os.path.exists(schema_file):
+                # Return full schema (schema_c shard) for specific database
+                if schema_store.get_schema_c_manifest(schema_dir) is None:
                     return Response(
                         {
                             "error": "Schema file not found. Please upload databases first."
@@ -301,10 +253,8 @@ class AgentViewSet(viewsets.ViewSet):
                         status=status.HTTP_404_NOT_FOUND,
                     )
 
-                with open(schema_file, "r", encoding="utf-8") as f:
-                    all_schema = json.load(f)
-
-                if database_name not in all_schema:
+                db_schema = schema_store.load_schema_c(schema_dir, database_name)
+                if db_schema is None:
                     return Response(
                         {"error": f"Database '{database_name}' not found in schema"},
                         status=status.HTTP_404_NOT_FOUND,
@@ -314,7 +264,7 @@ class AgentViewSet(viewsets.ViewSet):
                     {
                         "database": database_name,
                         "schema_type": "full",
-                        "schema": all_schema[database_name],
+                        "schema": db_schema,
                     }
                 )
             else:
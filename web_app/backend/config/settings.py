@@ -2,6 +2,7 @@
 Django settings for backend project.
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -24,6 +25,112 @@ MEDIA_URL = "/media/"
 # Initialize the API key for model access
 API_KEY = None
 
+# Upper bound on memory held by the per-user FAISS vectorstore cache (Agent A)
+VECTORSTORE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Worker threads for background schema/embedding jobs (core/jobs.py); 0 runs them inline
+SCHEMA_JOB_WORKERS = 2
+# Pending/running jobs with no progress for this long are marked failed
+SCHEMA_JOB_STALE_SECONDS = 3600
+# Attempts for a job status write that still finds the database locked
+SCHEMA_JOB_DB_RETRIES = 5
+
+# Upper bound on parsed per-database schema lookups kept in memory (utils/schema_store.py)
+SCHEMA_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Threads shared by all requests for running agent pipeline stages (agents/pipeline.py)
+PIPELINE_STAGE_WORKERS = 32
+
+# Replay of cached Agent A-C outputs for repeated questions (agents/pipeline_cache.py).
+# Set PIPELINE_CACHE_SIMILARITY (cosine, e.g. 0.97) to also match near-identical questions.
+PIPELINE_CACHE_ENABLED = True
+PIPELINE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+PIPELINE_CACHE_TTL_SECONDS = 24 * 3600
+PIPELINE_CACHE_SIMILARITY = None
+
+# Adaptive routing (agents/router.py): skip Agent A for users with one database and
+# Agent B for small databases. Off by default; requests can opt in with "adaptive": true.
+ROUTER_ENABLED = False
+ROUTER_SKIP_B_MAX_TABLES = 5
+ROUTER_SKIP_B_MAX_TOKENS = 1500
+
+# Agent C prompts carry only the selected tables and their FK join paths as compact
+# text (utils/schema_prune.py), cut down further past SCHEMA_PRUNE_MAX_TOKENS
+SCHEMA_PRUNE_ENABLED = True
+SCHEMA_PRUNE_MAX_TOKENS = 3000
+SCHEMA_PRUNE_MAX_JOIN_HOPS = 3
+
+# A malformed agent reply is sent back to the model for repair this many times before
+# the stage fails (agents/parsing.py); only that stage is retried
+AGENT_REPAIR_RETRIES = 1
+
+# Streamed Agent A-C replies are sent as "token" SSE events, batched to at most one
+# event per stage every AGENT_TOKEN_FLUSH_SECONDS
+AGENT_TOKEN_FLUSH_SECONDS = 0.05
+
+# Batch endpoint (POST /api/agents/batch/, agents/batch.py): questions per request and
+# how many of them run through the pipeline at once (also the size of the batch
+# thread pool, which is kept apart from PIPELINE_STAGE_WORKERS)
+BATCH_MAX_QUESTIONS = 500
+BATCH_CONCURRENCY = 8
+
+# Speculative B+C over close candidate databases (agents/speculative.py), opt-in per
+# request with "speculative": true. Margin is in Agent A similarity units (0-1).
+SPECULATIVE_MAX_CANDIDATES = 3
+SPECULATIVE_SCORE_MARGIN = 0.05
+SPECULATIVE_WORKERS = 16
+
+# Per-stage timing (utils/timing.py) is sent as "timing" SSE events and aggregated,
+# with LLM token counts, for Prometheus at GET /metrics. Only staff users and these
+# client addresses (REMOTE_ADDR; IPs or networks such as "10.0.0.0/8") may read it
+METRICS_ENABLED = True
+METRICS_ALLOWED_IPS = ["127.0.0.1", "::1"]
+
+# Read-only SQLite connection pool for query execution (utils/sqlite_pool.py)
+SQL_POOL_MAX_DATABASES = 64
+SQL_POOL_MAX_PER_DATABASE = 4
+SQL_POOL_IDLE_SECONDS = 300
+SQL_POOL_MMAP_SIZE = 64 * 1024 * 1024
+SQL_POOL_CACHE_SIZE_KIB = 16 * 1024
+SQL_PATH_CACHE_MAX_BYTES = 1024 * 1024
+# Cost guard for generated SQL (utils/sql_guard.py): plans with huge full scans or
+# cartesian products are refused, and execution is stopped past these budgets
+SQL_GUARD_ENABLED = True
+SQL_GUARD_TIMEOUT_SECONDS = 10
+SQL_GUARD_MAX_VM_STEPS = 1_000_000_000
+SQL_GUARD_PROGRESS_INTERVAL = 1000
+SQL_GUARD_MAX_SCAN_ROWS = 20_000_000
+SQL_GUARD_MAX_JOIN_ROWS = 100_000_000
+# Cached SELECT results, keyed by database file version (utils/sql_connector.py)
+SQL_RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Query results are fetched in chunks and capped; past the cap they are marked
+# truncated. SQL_STREAM_* apply when the client asks for streamed rows.
+SQL_RESULT_CHUNK_ROWS = 500
+SQL_RESULT_MAX_ROWS = 10000
+SQL_RESULT_MAX_BYTES = 16 * 1024 * 1024
+SQL_STREAM_MAX_ROWS = 1000000
+SQL_STREAM_MAX_BYTES = 512 * 1024 * 1024
+# Row chunks buffered per streaming response before the query waits for the client
+SQL_STREAM_QUEUE_CHUNKS = 8
+
+# Shared LLM clients (utils/llm_pool.py). OPENAI_BASE_URL points the agents at any
+# OpenAI-compatible server, e.g. a local stub when testing.
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+LLM_POOL_MAX_SIZE = 64
+LLM_HTTP_MAX_CONNECTIONS = 50
+LLM_HTTP_MAX_KEEPALIVE = 20
+LLM_HTTP_KEEPALIVE_EXPIRY = 60
+LLM_HTTP_TIMEOUT = 120
+# Record/replay of LLM and embedding HTTP calls for offline benchmarks
+# (utils/llm_cassette.py): "record" replays known requests and records the rest,
+# "replay" never calls the API. Replays wait LLM_CASSETTE_LATENCY_SCALE x the
+# recorded time plus LLM_CASSETTE_LATENCY_SECONDS (0 measures only our overhead).
+LLM_CASSETTE_MODE = os.environ.get("LLM_CASSETTE_MODE") or None
+LLM_CASSETTE_PATH = BASE_DIR / "cassettes" / "llm.jsonl"
+LLM_CASSETTE_LATENCY_SCALE = 0.0
+LLM_CASSETTE_LATENCY_SECONDS = 0.0
+
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = "django-insecure-49i2wzh&d2(tzgcv60g@6tm)234od!3wduo*i)8$9815kwbx7)"
 
@@ -94,6 +201,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Background schema jobs write here while requests do too: wait for the
+        # write lock instead of failing with "database is locked" right away
+        "OPTIONS": {"timeout": 20},
     }
 }
 
@@ -9,7 +9,7 @@ from drf_spectacular.views import (
     SpectacularRedocView,
 )
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import api_root
+from .views import api_root, metrics
 
 urlpatterns = [
     path("", RedirectView.as_view(url="/admin/", permanent=True)),
@@ -19,6 +19,9 @@ urlpatterns = [
     path("api/core/", include("core.urls")),
     path("api/agents/", include("agents.urls")),
 
+    # Prometheus scrape target (utils/metrics.py)
+    path("metrics", metrics, name="metrics"),
+
     # JWT endpoints
     path("api/token/", TokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
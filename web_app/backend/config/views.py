@@ -1,12 +1,51 @@
+import ipaddress
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 
+from utils import metrics as pipeline_metrics
+
 @api_view(["GET"])
 def api_root(request, format=None):
     return Response({
         "files-list": reverse("files-list", request=request, format=format),
         "apikeys": reverse("apikeys-list", request=request, format=format),
+        "jobs": reverse("jobs-list", request=request, format=format),
         "agents": reverse("agents-list", request=request, format=format),
+        "agents_async": reverse("agents-async", request=request, format=format),
         "schema": reverse("schema", request=request, format=format),
     })
+
+
+def _metrics_allowed(request) -> bool:
+    """Staff users, or clients whose address is in METRICS_ALLOWED_IPS (IPs or networks)."""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated and user.is_staff:
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    for allowed in getattr(settings, "METRICS_ALLOWED_IPS", ["127.0.0.1", "::1"]):
+        try:
+            if address in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+
+@require_GET
+def metrics(request):
+    """Pipeline stage timings and token counts for Prometheus (utils/metrics.py)."""
+    if not getattr(settings, "METRICS_ENABLED", True):
+        raise Http404("Metrics are disabled")
+    if not _metrics_allowed(request):
+        return HttpResponseForbidden("Metrics are only served to allowed addresses")
+    return HttpResponse(
+        pipeline_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Files, Chats, APIKeys, UserLimits, DailyUsage
+from .models import Files, Chats, APIKeys, UserLimits, DailyUsage, SchemaJob
 
 
 @admin.register(Files)
@@ -28,3 +28,10 @@ class DailyUsageAdmin(admin.ModelAdmin):
 	list_display = ("user", "date", "chats_used")
 	list_filter = ("date",)
 	search_fields = ("user__username",)
+
+
+@admin.register(SchemaJob)
+class SchemaJobAdmin(admin.ModelAdmin):
+	list_display = ("id", "user", "status", "stage", "progress", "created_at")
+	list_filter = ("status",)
+	search_fields = ("user__username",)
@@ -0,0 +1,15 @@
+from rest_framework import viewsets
+from rest_framework.permissions import IsAuthenticated
+
+from .models import SchemaJob
+from .serializers import SchemaJobSerializer
+
+
+class SchemaJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """GET: list the user's background schema/embedding jobs, or one job's progress."""
+
+    permission_classes = [IsAuthenticated]
+    serializer_class = SchemaJobSerializer
+
+    def get_queryset(self):
+        return SchemaJob.objects.filter(user=self.request.user)
@@ -1,25 +1,22 @@
-import json
 import re
 import os
 import zipfile
 from django.core.files import File
 from django.utils.text import get_valid_filename
-from django.conf import settings
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
 from django.http import FileResponse
 
-from utils import schema_builder
-
 from django.utils import timezone
 from datetime import date
 
 from .models import Files, DailyUsage, UserLimits
 from django.db import IntegrityError
-from .serializers import FilesSerializer
+from .serializers import FilesSerializer, SchemaJobSerializer
 from .limit_rate import GBLimitMixin
+from .jobs import enqueue_schema_sync
 from django.db.models import Sum
 
 SQLITE_EXTENSIONS = [f".sqlite{i}" for i in range(7)] + [".sqlite"]
@@ -143,21 +140,9 @@ class FilesViewSet(GBLimitMixin, viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            user_files = Files.objects.filter(user=user)
-            sql_file_paths = {
-                f.database: f.file.path
-                for f in user_files
-                if f.file and os.path.isfile(f.file.path)
-            }
-            sql_file_paths_json = json.dumps(sql_file_paths, ensure_ascii=False)
-
-            schema_dir = os.path.join(settings.MEDIA_ROOT, str(user.id), "schema")
-            os.makedirs(schema_dir, exist_ok=True)
-            print("SQL file paths:", sql_file_paths)
-            print("Schema dir:", schema_dir)
-
-            schema_builder.build_schema_ab(sql_file_paths_json, schema_dir)
-            schema_builder.build_schema_c(sql_file_paths_json, schema_dir)
+            # Schemas and embeddings are built in the background; only new/replaced
+            # databases are extracted. Clients can poll /api/core/jobs/<id>/.
+            job = enqueue_schema_sync(user)
 
             # After successful import, update storage cache so frontend can sync immediately
             try:
@@ -190,7 +175,7 @@ class FilesViewSet(GBLimitMixin, viewsets.ModelViewSet):
             except Exception:
                 payload = None
 
-            response_body = {"saved": saved}
+            response_body = {"saved": saved, "job": SchemaJobSerializer(job).data}
             if payload:
                 # storage endpoints return a compact storage payload
                 response_body["storage"] = payload
@@ -249,22 +234,8 @@ class FilesViewSet(GBLimitMixin, viewsets.ModelViewSet):
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 )
 
-            # Generate schemas for all uploaded databases
-            user_files = Files.objects.filter(user=user)
-            sql_file_paths = {
-                f.database: f.file.path
-                for f in user_files
-                if f.file and os.path.isfile(f.file.path)
-            }
-            sql_file_paths_json = json.dumps(sql_file_paths, ensure_ascii=False)
-
-            schema_dir = os.path.join(settings.MEDIA_ROOT, str(user.id), "schema")
-            os.makedirs(schema_dir, exist_ok=True)
-            print("SQL file paths:", sql_file_paths)
-            print("Schema dir:", schema_dir)
-
-            schema_builder.build_schema_ab(sql_file_paths_json, schema_dir)
-            schema_builder.build_schema_c(sql_file_paths_json, schema_dir)
+            # Generate schemas for the newly uploaded databases in the background
+            job = enqueue_schema_sync(user)
 
             # Update storage cache
             try:
@@ -298,6 +269,7 @@ class FilesViewSet(GBLimitMixin, viewsets.ModelViewSet):
                 "saved": saved,
                 "count": len(saved),
                 "message": f"Successfully uploaded {len(saved)} Spider databases",
+                "job": SchemaJobSerializer(job).data,
             }
             if payload:
                 response_body["storage"] = payload
@@ -318,6 +290,7 @@ class FilesViewSet(GBLimitMixin, viewsets.ModelViewSet):
                 if f.file and f.file.path and os.path.isfile(f.file.path):
                     os.remove(f.file.path)
             files.delete()
+            job = enqueue_schema_sync(user)
             # update usage cache after clearing
             try:
                 today = timezone.now().date()
@@ -353,7 +326,7 @@ class FilesViewSet(GBLimitMixin, viewsets.ModelViewSet):
             except Exception:
                 payload = None
 
-            resp = {"status": "All files deleted."}
+            resp = {"status": "All files deleted.", "job": SchemaJobSerializer(job).data}
             if payload:
                 resp["storage"] = payload
             return Response(resp, status=200)
@@ -404,6 +377,7 @@ class FilesViewSet(GBLimitMixin, viewsets.ModelViewSet):
             ):
                 os.remove(instance.file.path)
             instance.delete()
+            job = enqueue_schema_sync(user)
 
             # compute storage payload
             agg = Files.objects.filter(user=user).aggregate(total=Sum("size"))
@@ -416,7 +390,11 @@ class FilesViewSet(GBLimitMixin, viewsets.ModelViewSet):
                 "used_gb": float(used_gb),
             }
 
-            resp = {"status": "deleted", "storage": payload}
+            resp = {
+                "status": "deleted",
+                "storage": payload,
+                "job": SchemaJobSerializer(job).data,
+            }
             return Response(resp, status=200)
         except Exception as e:
             return Response({"error": str(e)}, status=500)
@@ -0,0 +1,201 @@
+"""Background schema/embedding builds.
+
+Uploads and deletions enqueue a SchemaJob and return immediately. A small
+thread pool then syncs the user's schemas (utils.schema_builder.sync_schemas)
+and builds/reconciles the FAISS index so the first chat does not pay for it.
+Job state lives in the database so clients can poll /api/core/jobs/.
+"""
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections
+from django.utils import timezone
+
+from utils import schema_builder
+from .models import APIKeys, Files, SchemaJob
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Jobs of one user run one at a time; a job still waiting for the lock is
+# reused by later requests, since it will pick up their files anyway.
+_user_locks = {}
+_pending = {}  # user_id -> job id queued but not started
+_active = set()  # job ids queued or running in this process
+_state_lock = threading.Lock()
+
+# Share of the progress bar given to schema extraction (the rest is embeddings)
+_SCHEMA_SHARE = 0.7
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, "SCHEMA_JOB_WORKERS", 2),
+                    thread_name_prefix="schema-job",
+                )
+    return _executor
+
+
+def sync_user_schemas(user, on_progress=None):
+    """Incrementally update the user's schema artifacts to match their uploaded files."""
+    user_files = Files.objects.filter(user=user)
+    sql_file_paths = {
+        f.database: f.file.path
+        for f in user_files
+        if f.file and os.path.isfile(f.file.path)
+    }
+    schema_dir = os.path.join(settings.MEDIA_ROOT, str(user.id), "schema")
+    os.makedirs(schema_dir, exist_ok=True)
+
+    summary = schema_builder.sync_schemas(sql_file_paths, schema_dir, on_progress)
+    changes = {k: v for k, v in summary.items() if v}
+    logger.info("Schema sync for user %s: %s", user.id, changes)
+    return summary
+
+
+def _retry_locked(fn, *args, **kwargs):
+    """
+    Call `fn`, retrying a few times while SQLite reports "database is locked".
+    Job writes race with request threads on the default database, and the
+    connection's own busy timeout (DATABASES OPTIONS) can still run out.
+    """
+    attempts = max(int(getattr(settings, "SCHEMA_JOB_DB_RETRIES", 5)), 1)
+    for attempt in range(attempts):
+        try:
+            return fn(*args, **kwargs)
+        except OperationalError as e:
+            if "locked" not in str(e) or attempt == attempts - 1:
+                raise
+            time.sleep(0.2 * (2**attempt))
+
+
+def _update(job_id, **fields):
+    # queryset.update() skips auto_now, so bump updated_at explicitly
+    _retry_locked(
+        SchemaJob.objects.filter(pk=job_id).update, updated_at=timezone.now(), **fields
+    )
+
+
+def _build_embeddings(user_id):
+    """Build/reconcile the user's FAISS index. Returns a short status string."""
+    from agents import a_db_select
+
+    api_key = (
+        APIKeys.objects.filter(user_id=user_id).values_list("api_key", flat=True).first()
+    )
+    if not api_key:
+        return "skipped: no API key"
+    schema_file = a_db_select.get_user_schema_file(user_id)
+    if not os.path.exists(schema_file) or not a_db_select.load_processed_schema(schema_file):
+        return "skipped: no schema"
+    a_db_select.create_or_load_embeddings(api_key, user_id)
+    return "ready"
+
+
+def _run(job_id, user_id):
+    with _state_lock:
+        lock = _user_locks.setdefault(user_id, threading.Lock())
+    try:
+        with lock:
+            with _state_lock:
+                if _pending.get(user_id) == job_id:
+                    del _pending[user_id]
+
+            _update(job_id, status=SchemaJob.STATUS_RUNNING, stage="schema", progress=0.0)
+
+            def on_progress(done, total):
+                _update(job_id, progress=round(_SCHEMA_SHARE * done / max(total, 1), 3))
+
+            job = SchemaJob.objects.select_related("user").get(pk=job_id)
+            summary = sync_user_schemas(job.user, on_progress)
+            if summary.get("added") or summary.get("updated") or summary.get("removed"):
+                # Cached pipeline answers were built against the old schemas
+                from agents import pipeline_cache
+
+                pipeline_cache.invalidate_user(user_id)
+
+            _update(job_id, stage="embeddings", progress=_SCHEMA_SHARE, detail=summary)
+            summary["embeddings"] = _build_embeddings(user_id)
+
+            _update(
+                job_id,
+                status=SchemaJob.STATUS_SUCCEEDED,
+                stage="done",
+                progress=1.0,
+                detail=summary,
+            )
+    except Exception as e:
+        logger.exception("Schema job %s for user %s failed", job_id, user_id)
+        try:
+            _update(job_id, status=SchemaJob.STATUS_FAILED, error=str(e))
+        except Exception:
+            logger.exception("Could not mark schema job %s as failed", job_id)
+    finally:
+        with _state_lock:
+            _active.discard(job_id)
+
+
+def _run_in_worker(job_id, user_id):
+    # Worker threads own their DB connections; don't leak them between jobs
+    close_old_connections()
+    try:
+        _run(job_id, user_id)
+    finally:
+        close_old_connections()
+
+
+def _fail_interrupted(user):
+    # Jobs left pending/running by a dead process will never finish. Only jobs
+    # that have not reported progress for a while are touched, so jobs owned
+    # by other live worker processes are left alone.
+    with _state_lock:
+        active = set(_active)
+    stale_before = timezone.now() - timedelta(
+        seconds=getattr(settings, "SCHEMA_JOB_STALE_SECONDS", 3600)
+    )
+    SchemaJob.objects.filter(
+        user=user,
+        status__in=[SchemaJob.STATUS_PENDING, SchemaJob.STATUS_RUNNING],
+        updated_at__lt=stale_before,
+    ).exclude(pk__in=active).update(
+        status=SchemaJob.STATUS_FAILED, error="Interrupted (server restarted?)"
+    )
+
+
+def enqueue_schema_sync(user) -> SchemaJob:
+    """Queue a schema + embedding build for `user` and return its SchemaJob."""
+    _fail_interrupted(user)
+
+    with _state_lock:
+        pending_id = _pending.get(user.id)
+    if pending_id is not None:
+        job = SchemaJob.objects.filter(pk=pending_id).first()
+        if job is not None and job.status == SchemaJob.STATUS_PENDING:
+            return job
+
+    job = _retry_locked(SchemaJob.objects.create, user=user)
+    if getattr(settings, "SCHEMA_JOB_WORKERS", 2) <= 0:
+        # Synchronous mode (e.g. management commands and debugging)
+        with _state_lock:
+            _active.add(job.pk)
+        _run(job.pk, user.id)
+        job.refresh_from_db()
+        return job
+
+    with _state_lock:
+        _pending[user.id] = job.pk
+        _active.add(job.pk)
+    _get_executor().submit(_run_in_worker, job.pk, user.id)
+    return job
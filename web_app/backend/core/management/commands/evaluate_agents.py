@@ -0,0 +1,195 @@
+from django.core.management.base import BaseCommand, CommandError
+import json
+from django.conf import settings
+from core.models import APIKeys, Files
+from agents import evaluation
+from utils import llm_pool
+
+# data/test/spider_query_answers.json, written by scripts/load_test_data.py
+DEFAULT_DATA_FILE = (
+    settings.BASE_DIR.parent.parent / "data" / "test" / "spider_query_answers.json"
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Evaluate the agent pipeline on the Spider test set: execution accuracy, "
+        "latency percentiles, QPS and token usage"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user-id",
+            type=int,
+            default=1,
+            help="User whose uploaded databases are the Spider databases",
+        )
+        parser.add_argument(
+            "--data-file",
+            type=str,
+            default=str(DEFAULT_DATA_FILE),
+            help="Spider-style JSON list with db_id, question and query",
+        )
+        parser.add_argument(
+            "--db", action="append", help="Only these db_ids (repeatable)"
+        )
+        parser.add_argument(
+            "--offset", type=int, default=0, help="Skip this many questions"
+        )
+        parser.add_argument(
+            "--limit", type=int, default=100, help="Questions to evaluate (0 = all)"
+        )
+        parser.add_argument(
+            "--workers", type=int, default=8, help="Questions run concurrently"
+        )
+        parser.add_argument(
+            "--llm",
+            choices=["openai", "oracle"],
+            default="openai",
+            help="'oracle' answers from the gold SQL: an offline throughput/plumbing "
+            "benchmark that reports no accuracy",
+        )
+        parser.add_argument(
+            "--cassette",
+            choices=["record", "replay"],
+            help="Record OpenAI calls to, or replay them from, LLM_CASSETTE_PATH",
+        )
+        parser.add_argument(
+            "--cassette-path", type=str, help="Cassette file (default LLM_CASSETTE_PATH)"
+        )
+        parser.add_argument("--model", type=str, default="gpt-5-mini")
+        parser.add_argument("--top-k", type=int, default=5)
+        parser.add_argument(
+            "--output", type=str, help="Write one JSON record per question here"
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Print the summary as JSON"
+        )
+
+    def handle(self, *args, **options):
+        user_id = options["user_id"]
+        oracle = options["llm"] == "oracle"
+        cassette = options["cassette"]
+        if cassette and oracle:
+            raise CommandError("--cassette needs --llm openai")
+
+        try:
+            index = evaluation.load_test_set(options["data_file"])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot load test set {options['data_file']}: {e}")
+
+        # Only questions whose database this user has uploaded
+        available = set(
+            Files.objects.filter(user_id=user_id).values_list("database", flat=True)
+        )
+        wanted = set(options["db"] or available) & available
+        items = [item for (db_id, _), item in index.items() if db_id in wanted]
+        items = items[options["offset"]:]
+        if options["limit"]:
+            items = items[: options["limit"]]
+        if not items:
+            raise CommandError(
+                f"No test questions for user {user_id}'s databases; "
+                "upload the Spider databases first."
+            )
+
+        if oracle:
+            api_key = "oracle"
+            answers = {(item["db_id"], item["question"]): item for item in items}
+            llm_pool.set_chat_model_factory(
+                lambda *_: evaluation.OracleChatModel(answers=answers)
+            )
+        else:
+            api_key = (
+                APIKeys.objects.filter(user_id=user_id)
+                .values_list("api_key", flat=True)
+                .first()
+            )
+            if not api_key and cassette == "replay":
+                # Cassette entries are not keyed by the API key
+                api_key = "replay"
+            if not api_key:
+                raise CommandError(f"User {user_id} has no API key set.")
+            if cassette:
+                saved = (settings.LLM_CASSETTE_MODE, settings.LLM_CASSETTE_PATH)
+                settings.LLM_CASSETTE_MODE = cassette
+                if options["cassette_path"]:
+                    settings.LLM_CASSETTE_PATH = options["cassette_path"]
+                llm_pool.reset_http_clients()
+
+        databases = len({item["db_id"] for item in items})
+        llm = f"{cassette} cassette" if cassette else f"{options['llm']} LLM"
+        self.stdout.write(
+            f"🧪 Evaluating {len(items)} questions over {databases} databases "
+            f"({llm}, {options['workers']} workers)"
+        )
+
+        output = None
+        if options["output"]:
+            output = open(options["output"], "w", encoding="utf-8")
+        done = [0]
+
+        def on_record(record):
+            done[0] += 1
+            if output:
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if done[0] % 25 == 0 or done[0] == len(items):
+                self.stdout.write(f"  {done[0]}/{len(items)} done")
+
+        try:
+            _, summary = evaluation.run_evaluation(
+                api_key,
+                user_id,
+                items,
+                workers=options["workers"],
+                oracle=oracle,
+                model=options["model"],
+                top_k=options["top_k"],
+                on_record=on_record,
+            )
+        finally:
+            if output:
+                output.close()
+            if oracle:
+                llm_pool.set_chat_model_factory(None)
+            if cassette:
+                settings.LLM_CASSETTE_MODE, settings.LLM_CASSETTE_PATH = saved
+                llm_pool.reset_http_clients()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        latency = summary["latency_seconds"]
+        usage = summary["llm_usage"] or {}
+        self.stdout.write("=" * 50)
+        if oracle:
+            # The oracle's answers are the gold SQL, so accuracy would be ~100% by construction
+            self.stdout.write(
+                "Accuracy:           n/a (oracle LLM; throughput/plumbing benchmark only)"
+            )
+            self.stdout.write(
+                f"Gold round-trip:    {summary['oracle_roundtrip']:.2%} "
+                f"({summary['scored']} scored of {summary['questions']})"
+            )
+        else:
+            self.stdout.write(
+                f"Execution accuracy: {summary['execution_accuracy']:.2%} "
+                f"({summary['scored']} scored of {summary['questions']})"
+            )
+            self.stdout.write(f"Database accuracy:  {summary['database_accuracy']:.2%}")
+        self.stdout.write(
+            "Latency (s):        "
+            + ", ".join(f"{k} {v:.3f}" for k, v in latency.items())
+        )
+        self.stdout.write(
+            f"Throughput:         {summary['qps']:.2f} questions/s "
+            f"over {summary['wall_seconds']:.2f}s"
+        )
+        self.stdout.write(
+            f"Tokens:             {usage.get('input_tokens', 0)} in "
+            f"({usage.get('cached_tokens', 0)} cached), {usage.get('output_tokens', 0)} out"
+        )
+        if summary["errors_by_agent"]:
+            self.stdout.write(f"Errors by agent:    {summary['errors_by_agent']}")
+
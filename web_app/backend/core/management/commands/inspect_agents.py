@@ -3,6 +3,7 @@ import json
 import os
 from django.conf import settings
 from core.models import Files
+from utils import schema_store
 
 class Command(BaseCommand):
     help = 'Inspect agent inputs and outputs without running them'
@@ -27,11 +28,15 @@ class Command(BaseCommand):
         # Check schema files
         schema_dir = os.path.join(settings.MEDIA_ROOT, str(user_id), "schema")
         schema_ab_file = os.path.join(schema_dir, "schema_ab.jsonl")
-        schema_c_file = os.path.join(schema_dir, "schema_c.json")
+        schema_c_manifest = (
+            schema_store.get_schema_c_manifest(schema_dir)
+            if os.path.isdir(schema_dir)
+            else None
+        )
         
         self.stdout.write(f"\n📋 Schema Files:")
         self.stdout.write(f"  Schema AB: {'✅' if os.path.exists(schema_ab_file) else '❌'}")
-        self.stdout.write(f"  Schema C: {'✅' if os.path.exists(schema_c_file) else '❌'}")
+        self.stdout.write(f"  Schema C: {'✅' if schema_c_manifest is not None else '❌'}")
         
         # Show sample schema data
         if os.path.exists(schema_ab_file):
@@ -49,22 +54,21 @@ class Command(BaseCommand):
                             self.stdout.write(f"  {i+1}. Invalid JSON: {line.strip()[:50]}...")
         
         # Show sample schema C data
-        if os.path.exists(schema_c_file):
+        if schema_c_manifest:
             self.stdout.write(f"\n📊 Schema C Sample:")
-            with open(schema_c_file, 'r') as f:
-                try:
-                    schema_c = json.load(f)
-                    db_names = list(schema_c.keys())[:3]
-                    for db_name in db_names:
-                        self.stdout.write(f"  Database: {db_name}")
-                        tables = schema_c[db_name].get('tables', {})
-                        table_names = list(tables.keys())[:2]
-                        for table_name in table_names:
-                            self.stdout.write(f"    Table: {table_name}")
-                            columns = tables[table_name].get('columns', [])
-                            self.stdout.write(f"      Columns: {', '.join(columns[:3])}{'...' if len(columns) > 3 else ''}")
-                except Exception as e:
-                    self.stdout.write(f"  ❌ Error reading schema C: {e}")
+            try:
+                db_names = list(schema_c_manifest.keys())[:3]
+                for db_name in db_names:
+                    self.stdout.write(f"  Database: {db_name}")
+                    db_schema = schema_store.load_schema_c(schema_dir, db_name) or {}
+                    tables = db_schema.get('tables', {})
+                    table_names = list(tables.keys())[:2]
+                    for table_name in table_names:
+                        self.stdout.write(f"    Table: {table_name}")
+                        columns = tables[table_name].get('columns', [])
+                        self.stdout.write(f"      Columns: {', '.join(columns[:3])}{'...' if len(columns) > 3 else ''}")
+            except Exception as e:
+                self.stdout.write(f"  ❌ Error reading schema C: {e}")
         
         # Show what Agent A would receive
         self.stdout.write(f"\n🤖 Agent A Input/Output Flow:")
@@ -80,7 +84,7 @@ class Command(BaseCommand):
         
         # Show what Agent C would receive
         self.stdout.write(f"\n🤖 Agent C Input/Output Flow:")
-        self.stdout.write(f"  Input: Agent B output + schema_c.json")
+        self.stdout.write(f"  Input: Agent B output + schema_c shard")
         self.stdout.write(f"  Process: Generates SQL query using table schemas")
         self.stdout.write(f"  Output: {{'query': '...', 'database': 'college_1', 'tables': ['students'], 'SQL': 'SELECT * FROM students', 'reasons': '...'}}")
         
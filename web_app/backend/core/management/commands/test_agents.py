@@ -4,6 +4,7 @@ import os
 from django.conf import settings
 from core.models import Files
 from agents import a_db_select, b_table_select, c_sql_generate
+from utils import schema_store
 
 
 class Command(BaseCommand):
@@ -84,14 +85,16 @@ class Command(BaseCommand):
         # Check schema files
         schema_dir = os.path.join(settings.MEDIA_ROOT, str(user_id), "schema")
         schema_ab_file = os.path.join(schema_dir, "schema_ab.jsonl")
-        schema_c_file = os.path.join(schema_dir, "schema_c.json")
+        schema_c_manifest = os.path.join(
+            schema_dir, schema_store.SCHEMA_C_DIR, schema_store.SCHEMA_C_MANIFEST
+        )
 
         self.stdout.write(f"📋 Schema Files:")
         self.stdout.write(
             f"  Schema AB: {'✅' if os.path.exists(schema_ab_file) else '❌'}"
         )
         self.stdout.write(
-            f"  Schema C: {'✅' if os.path.exists(schema_c_file) else '❌'}"
+            f"  Schema C: {'✅' if os.path.exists(schema_c_manifest) else '❌'}"
         )
 
         return True
@@ -43,4 +43,33 @@ class DailyUsage(models.Model):
     chats_used = models.IntegerField(default=0)
 
     class Meta:
-        unique_together = ("user", "date")
\ No newline at end of file
+        unique_together = ("user", "date")
+
+class SchemaJob(models.Model):
+    """Background schema extraction + embedding build for one user (see core/jobs.py)."""
+
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCEEDED = "succeeded"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCEEDED, "Succeeded"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    stage = models.CharField(max_length=32, blank=True, default="")
+    progress = models.FloatField(default=0.0)
+    detail = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Schema job {self.pk} ({self.status}) for {self.user}"
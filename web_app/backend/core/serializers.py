@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Files, APIKeys
+from .models import Files, APIKeys, SchemaJob
 
 
 class FilesSerializer(serializers.ModelSerializer):
@@ -28,3 +28,19 @@ class APIKeysSerializer(serializers.ModelSerializer):
             # Show first 8 and last 4 characters
             return obj.api_key[:8] + "..." + obj.api_key[-4:]
         return None
+
+
+class SchemaJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SchemaJob
+        fields = [
+            "id",
+            "status",
+            "stage",
+            "progress",
+            "detail",
+            "error",
+            "created_at",
+            "updated_at",
+        ]
+        read_only_fields = fields
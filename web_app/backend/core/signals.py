@@ -4,6 +4,7 @@ from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.core.cache import cache
 from .models import Files, APIKeys
+from utils import sql_connector
 from django.conf import settings
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -31,6 +32,13 @@ def delete_file_and_empty_folder(sender, instance, **kwargs):
         if os.path.isdir(folder_path) and not os.listdir(folder_path):
             os.rmdir(folder_path)
 
+# Drop cached paths/pooled connections of the SQL connector (stage D)
+@receiver(post_save, sender=Files)
+@receiver(post_delete, sender=Files)
+def forget_sql_connector_paths(sender, instance, **kwargs):
+    # A save may rename the database, so forget all of the user's entries
+    sql_connector.forget_db_paths(instance.user_id)
+
 # Update cache when APIKey instance is saved
 @receiver(post_save, sender=APIKeys)
 def update_api_key_cache(sender, instance, **kwargs):
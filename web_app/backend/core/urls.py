@@ -1,11 +1,12 @@
 from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import FilesViewSet, APIKeysViewSet, UsageView, download_chat_markdown, chats_view
+from .views import FilesViewSet, APIKeysViewSet, SchemaJobViewSet, UsageView, download_chat_markdown, chats_view
 
 # Register viewsets with the router
 router = DefaultRouter()
 router.register(r'files', FilesViewSet, basename='files')
 router.register(r'apikeys', APIKeysViewSet, basename='apikeys')
+router.register(r'jobs', SchemaJobViewSet, basename='jobs')
 
 urlpatterns = [
 	path('usage/', UsageView.as_view(), name='usage'),
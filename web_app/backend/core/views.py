@@ -13,16 +13,20 @@ from .api_storage import (
     OAuthRestrictedModelViewSet,
     FilesViewSet,
 )
+from .jobs import sync_user_schemas
 from .api_chat import APIKeysViewSet, UsageView, chats_view
+from .api_jobs import SchemaJobViewSet
 
 __all__ = [
     "download_chat_markdown",
     "is_valid_sqlite",
     "sanitize_and_replace",
     "save_to_model",
+    "sync_user_schemas",
     "OAuthRestrictedModelViewSet",
     "FilesViewSet",
     "APIKeysViewSet",
     "UsageView",
     "chats_view",
+    "SchemaJobViewSet",
 ]
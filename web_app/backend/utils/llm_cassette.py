@@ -0,0 +1,336 @@
+"""Record and replay LLM/embedding HTTP calls for offline benchmarks.
+
+When LLM_CASSETTE_MODE is set, `llm_pool` builds its shared httpx clients on
+one of these transports instead of the network:
+
+- "record": requests already on the cassette are replayed and the others go
+  to the API, with their responses appended to the cassette.
+- "replay": only the cassette is used. A request that is not on it gets a
+  404 error response, so the agent stage fails instead of calling out.
+
+Entries are keyed by a hash of the method, the URL path and the JSON body with
+sorted keys. The API key and host are not part of the key, so a cassette
+recorded against OpenAI replays against any key or OPENAI_BASE_URL. The
+cassette is a JSONL file (LLM_CASSETTE_PATH), one entry per line. Each entry
+keeps the status, content type, body text and the time to first byte and to
+the end of the response.
+
+A replayed response waits LLM_CASSETTE_LATENCY_SCALE x its recorded time plus
+LLM_CASSETTE_LATENCY_SECONDS. With a scale of 0 (the default), benchmarks
+measure only the pipeline's own overhead. Streamed (SSE) responses are
+replayed event by event, with the recorded time spread evenly across them.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+import httpx
+from django.conf import settings
+
+MODES = ("record", "replay")
+
+
+def get_mode():
+    """The configured cassette mode, or None when HTTP calls go to the API."""
+    mode = getattr(settings, "LLM_CASSETTE_MODE", None)
+    if not mode:
+        return None
+    if mode not in MODES:
+        raise ValueError(f"LLM_CASSETTE_MODE must be one of {MODES}, not {mode!r}")
+    return mode
+
+
+def request_key(request: httpx.Request) -> str:
+    """Hash of the request's method, URL path and (canonical JSON) body."""
+    body = request.content
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, ensure_ascii=False)
+        body = body.encode("utf-8")
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f"{request.method} {request.url.path}\n".encode("utf-8"))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class Cassette:
+    """The JSONL entry store, loaded once and appended to as entries are recorded."""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._entries = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        # First recording wins, so replays stay stable
+                        entries.setdefault(entry["key"], entry)
+        return entries
+
+    def get(self, key):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return self._entries.get(key)
+
+    def add(self, entry: dict):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            if entry["key"] in self._entries:
+                return
+            self._entries[entry["key"]] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def __len__(self):
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            return len(self._entries)
+
+
+_cassettes = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path=None) -> Cassette:
+    """The shared Cassette for `path` (default LLM_CASSETTE_PATH)."""
+    path = str(path or getattr(settings, "LLM_CASSETTE_PATH", "llm_cassette.jsonl"))
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
+
+
+# Replay
+
+
+def _delays(entry: dict):
+    """(seconds before the headers, seconds between body events) for a replay."""
+    scale = float(getattr(settings, "LLM_CASSETTE_LATENCY_SCALE", 0.0))
+    extra = float(getattr(settings, "LLM_CASSETTE_LATENCY_SECONDS", 0.0))
+    ttfb = entry.get("ttfb", 0.0) * scale + extra
+    rest = max(entry.get("elapsed", 0.0) - entry.get("ttfb", 0.0), 0.0) * scale
+    return ttfb, rest
+
+
+def _events(entry: dict) -> list:
+    body = entry["body"].encode("utf-8")
+    if not entry.get("content_type", "").startswith("text/event-stream"):
+        return [body]
+    events = [event + b"\n\n" for event in body.split(b"\n\n") if event]
+    return events or [body]
+
+
+def _missing(request: httpx.Request, key: str) -> httpx.Response:
+    message = f"No cassette entry for {request.method} {request.url.path} ({key[:12]})"
+    return httpx.Response(
+        404,
+        json={"error": {"message": message, "type": "cassette_miss"}},
+        request=request,
+    )
+
+
+class _ReplayStream(httpx.SyncByteStream):
+    def __init__(self, events, gap):
+        self._events, self._gap = events, gap
+
+    def __iter__(self):
+        for i, event in enumerate(self._events):
+            if i and self._gap:
+                time.sleep(self._gap)
+            yield event
+
+
+class _AsyncReplayStream(httpx.AsyncByteStream):
+    def __init__(self, events, gap):
+        self._events, self._gap = events, gap
+
+    async def __aiter__(self):
+        for i, event in enumerate(self._events):
+            if i and self._gap:
+                await asyncio.sleep(self._gap)
+            yield event
+
+
+def _replay_parts(entry: dict):
+    ttfb, rest = _delays(entry)
+    events = _events(entry)
+    gap = rest / (len(events) - 1) if len(events) > 1 else 0.0
+    headers = {"content-type": entry.get("content_type") or "application/json"}
+    return ttfb, events, gap, headers
+
+
+# Recording
+
+
+def _entry(key, request, response, body: bytes, ttfb, elapsed) -> dict:
+    return {
+        "key": key,
+        "method": request.method,
+        "path": request.url.path,
+        "status": response.status_code,
+        "content_type": response.headers.get("content-type", ""),
+        "body": body.decode("utf-8", errors="replace"),
+        "ttfb": round(ttfb, 6),
+        "elapsed": round(elapsed, 6),
+    }
+
+
+def _should_record(response) -> bool:
+    # Errors (bad key, rate limits) are not worth replaying
+    return response.status_code < 400
+
+
+class _RecordingStream(httpx.SyncByteStream):
+    """Passes the body through as it arrives and records it at the end."""
+
+    def __init__(self, stream, on_done):
+        self._stream, self._on_done = stream, on_done
+
+    def __iter__(self):
+        chunks = []
+        for chunk in self._stream:
+            chunks.append(chunk)
+            yield chunk
+        self._on_done(b"".join(chunks))
+
+    def close(self):
+        self._stream.close()
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, on_done):
+        self._stream, self._on_done = stream, on_done
+
+    async def __aiter__(self):
+        chunks = []
+        async for chunk in self._stream:
+            chunks.append(chunk)
+            yield chunk
+        self._on_done(b"".join(chunks))
+
+    async def aclose(self):
+        await self._stream.aclose()
+
+
+def _prepare(request: httpx.Request) -> str:
+    request.read()
+    # Plain bodies, so the cassette holds text rather than gzip bytes
+    request.headers["Accept-Encoding"] = "identity"
+    return request_key(request)
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """httpx transport that replays from, and in "record" mode adds to, a cassette."""
+
+    def __init__(self, mode: str, cassette: Cassette, limits: httpx.Limits = None):
+        self.mode = mode
+        self.cassette = cassette
+        self._live = (
+            httpx.HTTPTransport(limits=limits or httpx.Limits())
+            if mode == "record"
+            else None
+        )
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = _prepare(request)
+        entry = self.cassette.get(key)
+        if entry is not None:
+            ttfb, events, gap, headers = _replay_parts(entry)
+            if ttfb:
+                time.sleep(ttfb)
+            return httpx.Response(
+                entry["status"],
+                headers=headers,
+                stream=_ReplayStream(events, gap),
+                request=request,
+            )
+        if self._live is None:
+            return _missing(request, key)
+
+        started = time.perf_counter()
+        response = self._live.handle_request(request)
+        ttfb = time.perf_counter() - started
+        if not _should_record(response):
+            return response
+
+        def on_done(body):
+            elapsed = time.perf_counter() - started
+            self.cassette.add(_entry(key, request, response, body, ttfb, elapsed))
+
+        response.stream = _RecordingStream(response.stream, on_done)
+        return response
+
+    def close(self):
+        if self._live is not None:
+            self._live.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """Async variant of `CassetteTransport`."""
+
+    def __init__(self, mode: str, cassette: Cassette, limits: httpx.Limits = None):
+        self.mode = mode
+        self.cassette = cassette
+        self._live = (
+            httpx.AsyncHTTPTransport(limits=limits or httpx.Limits())
+            if mode == "record"
+            else None
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = _prepare(request)
+        entry = self.cassette.get(key)
+        if entry is not None:
+            ttfb, events, gap, headers = _replay_parts(entry)
+            if ttfb:
+                await asyncio.sleep(ttfb)
+            return httpx.Response(
+                entry["status"],
+                headers=headers,
+                stream=_AsyncReplayStream(events, gap),
+                request=request,
+            )
+        if self._live is None:
+            return _missing(request, key)
+
+        started = time.perf_counter()
+        response = await self._live.handle_async_request(request)
+        ttfb = time.perf_counter() - started
+        if not _should_record(response):
+            return response
+
+        def on_done(body):
+            elapsed = time.perf_counter() - started
+            self.cassette.add(_entry(key, request, response, body, ttfb, elapsed))
+
+        response.stream = _AsyncRecordingStream(response.stream, on_done)
+        return response
+
+    async def aclose(self):
+        if self._live is not None:
+            await self._live.aclose()
+
+
+def get_transport(limits: httpx.Limits = None):
+    """A CassetteTransport for the configured mode, or None when it is off."""
+    mode = get_mode()
+    return CassetteTransport(mode, get_cassette(), limits) if mode else None
+
+
+def get_async_transport(limits: httpx.Limits = None):
+    """An AsyncCassetteTransport for the configured mode, or None when it is off."""
+    mode = get_mode()
+    return AsyncCassetteTransport(mode, get_cassette(), limits) if mode else None
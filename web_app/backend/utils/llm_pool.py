@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import httpx
+from django.conf import settings
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+from utils import llm_cassette
+
+# One keep-alive connection pool shared by every LLM/embedding client. The API
+# key travels as a per-request header, so all users can reuse the same sockets.
+_http_client = None
+_async_http_client = None
+_http_lock = threading.Lock()
+
+# (api_key hash, model, temperature) -> ChatOpenAI / OpenAIEmbeddings
+_clients = OrderedDict()
+_clients_lock = threading.Lock()
+
+# Builds chat models instead of ChatOpenAI when set (see set_chat_model_factory)
+_chat_model_factory = None
+
+
+def get_http_client() -> httpx.Client:
+    """Return the process-wide httpx client, creating it on first use."""
+    global _http_client
+    if _http_client is None:
+        with _http_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    limits=_limits(),
+                    timeout=_timeout(),
+                    # record/replay instead of the network (utils/llm_cassette.py)
+                    transport=llm_cassette.get_transport(_limits()),
+                )
+    return _http_client
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=getattr(settings, "LLM_HTTP_MAX_CONNECTIONS", 50),
+        max_keepalive_connections=getattr(settings, "LLM_HTTP_MAX_KEEPALIVE", 20),
+        keepalive_expiry=getattr(settings, "LLM_HTTP_KEEPALIVE_EXPIRY", 60),
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(getattr(settings, "LLM_HTTP_TIMEOUT", 120), connect=10)
+
+
+class _PerLoopTransport(httpx.AsyncBaseTransport):
+    """
+    Async transport with one connection pool per running event loop. Pooled
+    connections are bound to the loop that opened them, and the same client
+    is used from the ASGI loop and from the short-lived loops of
+    async_to_sync under WSGI. A loop's pool goes away with the loop.
+    """
+
+    def __init__(self):
+        self._transports = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _current(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.get(loop)
+            if transport is None:
+                # record/replay instead of the network (utils/llm_cassette.py)
+                transport = llm_cassette.get_async_transport(
+                    _limits()
+                ) or httpx.AsyncHTTPTransport(limits=_limits())
+                self._transports[loop] = transport
+        return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._current().handle_async_request(request)
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            transport = self._transports.pop(loop, None)
+        if transport is not None:
+            await transport.aclose()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Return the process-wide async httpx client used by `ainvoke` calls. Its
+    connections are pooled per event loop (see _PerLoopTransport).
+    """
+    global _async_http_client
+    if _async_http_client is None:
+        with _http_lock:
+            if _async_http_client is None:
+                _async_http_client = httpx.AsyncClient(
+                    limits=_limits(),
+                    timeout=_timeout(),
+                    transport=_PerLoopTransport(),
+                )
+    return _async_http_client
+
+
+def _hash_key(api_key: str) -> str:
+    # Never keep raw API keys as dictionary keys
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+
+
+def _get_or_create(key, factory):
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+
+    client = factory()
+    with _clients_lock:
+        # Another thread may have raced us; keep whichever got there first
+        client = _clients.setdefault(key, client)
+        _clients.move_to_end(key)
+        max_size = getattr(settings, "LLM_POOL_MAX_SIZE", 64)
+        while len(_clients) > max_size:
+            _clients.popitem(last=False)
+    return client
+
+
+def set_chat_model_factory(factory):
+    """
+    Make `get_chat_model` return factory(api_key, model, temperature) instead of
+    a ChatOpenAI, e.g. an offline model for evaluation runs. None restores the
+    default.
+    """
+    global _chat_model_factory
+    _chat_model_factory = factory
+    clear()
+
+
+def get_chat_model(api_key: str, model: str = "gpt-5-mini", temperature: float = 0):
+    """Return a shared ChatOpenAI for (api_key, model, temperature)."""
+    if _chat_model_factory is not None:
+        return _chat_model_factory(api_key, model, temperature)
+    key = (_hash_key(api_key), "chat", model, temperature)
+    return _get_or_create(
+        key,
+        lambda: ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            api_key=api_key,
+            base_url=getattr(settings, "OPENAI_BASE_URL", None),
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client(),
+            # keep token usage when replies are streamed
+            stream_usage=True,
+        ),
+    )
+
+
+def get_embeddings(api_key: str, model: str = "text-embedding-ada-002"):
+    """Return a shared OpenAIEmbeddings client for (api_key, model)."""
+    key = (_hash_key(api_key), "embeddings", model, None)
+    return _get_or_create(
+        key,
+        lambda: OpenAIEmbeddings(
+            model=model,
+            api_key=api_key,
+            base_url=getattr(settings, "OPENAI_BASE_URL", None),
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client(),
+        ),
+    )
+
+
+def clear():
+    """Drop all pooled clients (the shared HTTP connection pool is kept)."""
+    with _clients_lock:
+        _clients.clear()
+
+
+def reset_http_clients():
+    """
+    Drop the shared HTTP clients and the pooled LLM clients using them, e.g.
+    after LLM_CASSETTE_MODE changes. New ones are built on next use.
+    """
+    global _http_client, _async_http_client
+    with _http_lock:
+        old = _http_client
+        _http_client = _async_http_client = None
+    clear()
+    if old is not None:
+        old.close()
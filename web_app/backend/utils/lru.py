@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+
+class ByteLRU:
+    """
+    Thread-safe LRU mapping bounded by the total size (in bytes) of its values.
+
+    Callers supply the size of each value when storing it; the least recently
+    used entries are evicted once `max_bytes` is exceeded. A value larger than
+    `max_bytes` on its own is never stored. `max_bytes <= 0` disables caching.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = int(max_bytes)
+        self._data = OrderedDict()  # key -> (value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, nbytes: int) -> bool:
+        """Store `value` under `key`. Returns False if it was too large to cache."""
+        nbytes = max(int(nbytes), 0)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if self.max_bytes <= 0 or nbytes > self.max_bytes:
+                return False
+            self._data[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes and self._data:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self._bytes -= entry[1]
+            return entry[0]
+
+    def pop_where(self, predicate) -> int:
+        """Remove every entry whose key satisfies `predicate(key)`; return the count."""
+        with self._lock:
+            doomed = [k for k in self._data if predicate(k)]
+            for k in doomed:
+                self._bytes -= self._data.pop(k)[1]
+            return len(doomed)
+
+    def items_where(self, predicate) -> list:
+        """Return [(key, value)] for keys satisfying `predicate(key)`, without touching recency."""
+        with self._lock:
+            return [(k, v) for k, (v, _) in self._data.items() if predicate(k)]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._bytes
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
@@ -0,0 +1,105 @@
+"""Process-wide pipeline metrics in the Prometheus text format (GET /metrics).
+
+Counters and histograms live in memory, per process. Under several worker
+processes, each one reports its own numbers, so scrape each worker or add the
+series up. Histogram buckets are in seconds.
+"""
+
+import threading
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# name -> (type, help)
+METRICS = {
+    "agent_stage_seconds": (
+        "histogram",
+        "Wall time of a pipeline stage, from start to its output being serialized.",
+    ),
+    "agent_phase_seconds": (
+        "histogram",
+        "Time a pipeline stage spent in one phase (schema_load, llm_wait, ...).",
+    ),
+    "agent_stage_total": ("counter", "Pipeline stages run, by outcome."),
+    "agent_llm_tokens_total": (
+        "counter",
+        "LLM tokens used by pipeline stages (kind: input, cached, output).",
+    ),
+}
+
+_lock = threading.Lock()
+# (name, labels) -> value
+_counters = {}
+# (name, labels) -> [bucket counts..., +Inf count, sum]
+_histograms = {}
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Add `value` to a counter."""
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name: str, value: float, **labels):
+    """Record one observation in a histogram."""
+    key = (name, _labels(labels))
+    with _lock:
+        series = _histograms.get(key)
+        if series is None:
+            series = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                series[i] += 1
+        series[len(LATENCY_BUCKETS)] += 1
+        series[-1] += value
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(series) for key, series in _histograms.items()}
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+            continue
+        for (metric, labels), series in sorted(histograms.items()):
+            if metric != name:
+                continue
+            for bound, count in zip(LATENCY_BUCKETS, series):
+                lines.append(
+                    f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {count}"
+                )
+            count = series[len(LATENCY_BUCKETS)]
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {round(series[-1], 6)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def clear():
+    """Reset every metric (e.g. between benchmark runs)."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
@@ -1,9 +1,12 @@
 import os
 import json
 import sqlite3
-from typing import Dict, Tuple, Union
+from pathlib import Path
+from typing import Callable, Dict, Optional, Union
 from django.conf import settings
 
+from utils import schema_store, vectorstore_cache
+
 
 def get_schema_dir(user_id: int) -> str:
     """
@@ -14,32 +17,25 @@ def get_schema_dir(user_id: int) -> str:
     return schema_dir
 
 
-def _exec_query(db_path: str, query: str) -> Tuple[Union[list, None], Union[str, None]]:
-    """
-    Execute a SQLite query against a specific database file path.
-    Returns (rows_as_list_of_dicts, error_message)
-    """
-    if not os.path.isfile(db_path):
-        return None, f"Database file not found: {db_path}"
+# One query per database: every table's columns and foreign keys via the
+# pragma table-valued functions. Rows come back grouped by table in
+# sqlite_master order, columns by cid, foreign keys in PRAGMA order.
+_SCHEMA_QUERY = """
+SELECT m.rowid AS tpos, m.name AS tbl, 0 AS kind, p.cid AS seq,
+       p.name AS col, p.pk AS pk, NULL AS ref_table, NULL AS ref_column
+FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+WHERE m.type = 'table'
+UNION ALL
+SELECT m.rowid, m.name, 1, f.id * 100000 + f.seq,
+       f."from", NULL, f."table", f."to"
+FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f
+WHERE m.type = 'table'
+ORDER BY tpos, kind, seq
+"""
 
-    try:
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute(query)
-        columns = [desc[0] for desc in cur.description] if cur.description else []
-        rows = cur.fetchall()
-        if columns:
-            result = [dict(zip(columns, row)) for row in rows]
-        else:
-            result = rows
-        return result, None
-    except sqlite3.Error as e:
-        return None, str(e)
-    finally:
-        try:
-            conn.close()  # type: ignore[name-defined]
-        except Exception:
-            pass
+
+def _connect_read_only(db_path: str) -> sqlite3.Connection:
+    return sqlite3.connect(f"{Path(db_path).as_uri()}?mode=ro", uri=True)
 
 
 def schema_extractor(db_key: str, db_path: str):
@@ -47,64 +43,57 @@ def schema_extractor(db_key: str, db_path: str):
     Extract schema (tables, columns, PK, FK) for one SQLite database.
     - db_key: logical database key (e.g., stored in Files.database)
     - db_path: absolute path to the .sqlite file
+    Opens the file once, read-only, and reads all metadata in a single query.
     """
-    tables, err = _exec_query(db_path, "SELECT name FROM sqlite_master WHERE type='table';")
-    if err:
-        return {"error": err, "database": db_key}
+    if not os.path.isfile(db_path):
+        return {"error": f"Database file not found: {db_path}", "database": db_key}
+
+    try:
+        conn = _connect_read_only(os.path.abspath(db_path))
+        try:
+            rows = conn.execute(_SCHEMA_QUERY).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        return {"error": str(e), "database": db_key}
 
     schema = {"tables": {}}
-    for table_dict in tables:
-        table_name = table_dict["name"] if isinstance(table_dict, dict) else table_dict[0]
-
-        cols_raw, err = _exec_query(db_path, f"PRAGMA table_info({table_name});")
-        if err:
-            return {"error": err, "database": db_key}
-        columns = []
-        pk_cols = []
-        for col in cols_raw:
-            name = col.get("name") if isinstance(col, dict) else col[1]
-            pk = col.get("pk") if isinstance(col, dict) else col[5]
-            columns.append(name)
+    for _, table_name, kind, _, col, pk, ref_table, ref_column in rows:
+        info = schema["tables"].setdefault(
+            table_name, {"columns": [], "primary_key": [], "foreign_keys": []}
+        )
+        if kind == 0:
+            info["columns"].append(col)
             if pk:
-                pk_cols.append(name)
-
-        fks_raw, err = _exec_query(db_path, f"PRAGMA foreign_key_list({table_name});")
-        if err:
-            return {"error": err, "database": db_key}
-        fk_list = []
-        for fk in fks_raw or []:
-            if isinstance(fk, dict):
-                fk_list.append({
-                    "from_column": fk.get("from"),
-                    "ref_table": fk.get("table"),
-                    "ref_column": fk.get("to"),
-                })
-            else:
-                # fallback for tuple format
-                # PRAGMA foreign_key_list returns: id,seq,table,from,to,on_update,on_delete,match
-                fk_list.append({
-                    "from_column": fk[3],
-                    "ref_table": fk[2],
-                    "ref_column": fk[4],
-                })
-
-        schema["tables"][table_name] = {
-            "columns": columns,
-            "primary_key": pk_cols,
-            "foreign_keys": fk_list,
-        }
+                info["primary_key"].append(col)
+        else:
+            info["foreign_keys"].append({
+                "from_column": col,
+                "ref_table": ref_table,
+                "ref_column": ref_column,
+            })
 
     return schema
 
 
-def build_schema_ab(sql_file_paths: Union[Dict[str, str], str], user_or_dir: Union[int, str]):
+def extract_schemas(paths: Dict[str, str], on_progress=None) -> Dict[str, dict]:
     """
-    Build schema for Agent A/B (flat JSONL with {db, table, columns}).
-    Save as schema_ab.jsonl and wipe old embeddings.
-    sql_file_paths: dict or JSON string of { "db_key": "/abs/path/to/db.sqlite" }
-    user_or_dir: user_id (int) or explicit schema_dir (str)
+    Run schema_extractor for many databases. Returns { db_key: schema_or_error }.
+    Databases are read one after another: each takes well under a millisecond
+    (one connection, one query), far less than a process pool costs to start.
+    on_progress(done, total) is called as each database finishes.
     """
-    # Parse inputs
+    total = len(paths)
+    results = {}
+    for done, (db_key, db_path) in enumerate(paths.items(), start=1):
+        results[db_key] = schema_extractor(db_key, os.path.normpath(db_path))
+        if on_progress:
+            on_progress(done, total)
+    return results
+
+
+def _resolve_inputs(sql_file_paths, user_or_dir):
+    """Normalise (sql_file_paths, user_or_dir) into (paths dict, schema_dir)."""
     if isinstance(sql_file_paths, str):
         paths = json.loads(sql_file_paths)
     else:
@@ -115,76 +104,213 @@ def build_schema_ab(sql_file_paths: Union[Dict[str, str], str], user_or_dir: Uni
         os.makedirs(schema_dir, exist_ok=True)
     else:
         schema_dir = get_schema_dir(user_or_dir)
+    return paths, schema_dir
 
-    # reset embeddings folder to avoid stale data
-    embeddings_folder = os.path.join(schema_dir, "embeddings")
-    if os.path.isdir(embeddings_folder):
-        for f in os.listdir(embeddings_folder):
-            try:
-                os.remove(os.path.join(embeddings_folder, f))
-            except Exception:
-                pass
-        try:
-            os.rmdir(embeddings_folder)
-        except Exception:
-            pass
+
+def _ab_line(db_key: str, table: str, columns: list) -> str:
+    # "database" must stay the first key: sync_schemas filters lines by prefix
+    obj = {"database": db_key, "table": table, "columns": columns}
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _ab_line_prefix(db_key: str) -> str:
+    return '{"database": ' + json.dumps(db_key, ensure_ascii=False) + ","
+
+
+def build_schema_ab(sql_file_paths: Union[Dict[str, str], str], user_or_dir: Union[int, str]):
+    """
+    Build schema for Agent A/B (flat JSONL with {db, table, columns}).
+    Save as schema_ab.jsonl plus its per-database index, re-extracting every database.
+    sql_file_paths: dict or JSON string of { "db_key": "/abs/path/to/db.sqlite" }
+    user_or_dir: user_id (int) or explicit schema_dir (str)
+    """
+    paths, schema_dir = _resolve_inputs(sql_file_paths, user_or_dir)
+
+    # Embeddings are reconciled against schema_ab.jsonl by Agent A on next load
+    vectorstore_cache.invalidate(schema_dir)
+    _forget_sources(schema_dir)
 
     lines = []
+    index_rows = []
 
-    for db_key, db_path in paths.items():
-        abs_path = os.path.normpath(db_path)
-        schema = schema_extractor(db_key, abs_path)
+    for db_key, schema in extract_schemas(paths).items():
         if "error" in schema:
             return schema
         for table, info in schema.get("tables", {}).items():
-            obj = {
-                "database": db_key,
-                "table": table,
-                "columns": info.get("columns", []),
-            }
-            lines.append(json.dumps(obj, ensure_ascii=False))
+            columns = info.get("columns", [])
+            lines.append(_ab_line(db_key, table, columns))
+            index_rows.append((db_key, table, columns))
 
     out_path = os.path.join(schema_dir, "schema_ab.jsonl")
     with open(out_path, "w", encoding="utf-8") as f:
         f.write("\n".join(lines))
 
-    return {"file": out_path, "count": len(lines), "embeddings": "reset"}
+    # Per-database lookup index used by Agent B and the schema endpoint
+    schema_store.write_ab_index(schema_dir, index_rows)
+
+    return {"file": out_path, "count": len(lines), "embeddings": "incremental"}
 
 
 def build_schema_c(sql_file_paths: Union[Dict[str, str], str], user_or_dir: Union[int, str]):
     """
-    Build schema for Agent C (nested JSON {db: {tables: {...}}}).
-    Save as schema_c.json
+    Build schema for Agent C ({tables: {...}} per database).
+    Save as one compact shard per database under schema_c/, plus a manifest.
     sql_file_paths: dict or JSON string of { "db_key": "/abs/path/to/db.sqlite" }
     user_or_dir: user_id (int) or explicit schema_dir (str)
     """
-    if isinstance(sql_file_paths, str):
-        paths = json.loads(sql_file_paths)
-    else:
-        paths = sql_file_paths
-
-    if isinstance(user_or_dir, str):
-        schema_dir = user_or_dir
-        os.makedirs(schema_dir, exist_ok=True)
-    else:
-        schema_dir = get_schema_dir(user_or_dir)
+    paths, schema_dir = _resolve_inputs(sql_file_paths, user_or_dir)
+    _forget_sources(schema_dir)
 
     combined_schema: Dict[str, dict] = {}
 
-    for db_key, db_path in paths.items():
-        abs_path = os.path.normpath(db_path)
-        schema = schema_extractor(db_key, abs_path)
+    for db_key, schema in extract_schemas(paths).items():
         if "error" in schema:
             return schema
         combined_schema[db_key] = schema
 
-    out_path = os.path.join(schema_dir, "schema_c.json")
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(combined_schema, f, indent=4, ensure_ascii=False)
+    schema_store.write_schema_c(schema_dir, combined_schema, replace_all=True)
+    out_path = os.path.join(schema_dir, schema_store.SCHEMA_C_DIR)
 
     return {"file": out_path, "databases": list(combined_schema.keys())}
 
 
+# Incremental maintenance
+
+SOURCES_FILE = "sources.json"
+
+
+def _source_stamp(db_path: str) -> dict:
+    st = os.stat(db_path)
+    return {"path": db_path, "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def _read_sources(schema_dir: str) -> dict:
+    try:
+        with open(os.path.join(schema_dir, SOURCES_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_sources(schema_dir: str, sources: dict):
+    path = os.path.join(schema_dir, SOURCES_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(sources, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _forget_sources(schema_dir: str):
+    # Full builds don't track sources; the next sync_schemas starts from scratch
+    try:
+        os.remove(os.path.join(schema_dir, SOURCES_FILE))
+    except OSError:
+        pass
+
+
+def _patch_schema_ab_file(out_path: str, remove: set, new_lines: list, rewrite: bool):
+    """Drop lines for databases in `remove` and append `new_lines`."""
+    if rewrite or not os.path.exists(out_path):
+        kept = []
+    elif remove:
+        prefixes = tuple(_ab_line_prefix(db) for db in remove)
+        with open(out_path, "r", encoding="utf-8") as f:
+            kept = [
+                line.rstrip("\n")
+                for line in f
+                if line.strip() and not line.startswith(prefixes)
+            ]
+    else:
+        # Pure additions: append without re-reading the file
+        if new_lines:
+            with open(out_path, "a", encoding="utf-8") as f:
+                if os.path.getsize(out_path):
+                    f.write("\n")
+                f.write("\n".join(new_lines))
+        return
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(kept + new_lines))
+    os.replace(tmp_path, out_path)
+
+
+def sync_schemas(
+    sql_file_paths: Union[Dict[str, str], str],
+    user_or_dir: Union[int, str],
+    on_progress: Optional[Callable[[int, int], None]] = None,
+):
+    """
+    Incrementally bring schema_ab (+ index) and schema_c in line with `sql_file_paths`.
+
+    Only databases that are new, whose file changed (path, mtime or size) or that
+    are no longer listed are touched; the rest of the artifacts are patched in place.
+    The FAISS index is reconciled with schema_ab.jsonl by Agent A on its next load,
+    so only the affected vectors are removed/added.
+    Databases that fail extraction are left out and retried on the next sync.
+    on_progress(done, total) is called after each database is extracted.
+    """
+    paths, schema_dir = _resolve_inputs(sql_file_paths, user_or_dir)
+    ab_file = os.path.join(schema_dir, schema_store.SCHEMA_AB_FILE)
+
+    previous = _read_sources(schema_dir)
+    if not os.path.exists(ab_file) or schema_store.get_schema_c_manifest(schema_dir) is None:
+        previous = {}
+    full = not previous
+
+    current = {}
+    for db_key, db_path in paths.items():
+        try:
+            current[db_key] = _source_stamp(os.path.normpath(db_path))
+        except OSError:
+            continue  # file vanished: treat as removed
+
+    removed = [db for db in previous if db not in current]
+    to_extract = {
+        db: stamp["path"] for db, stamp in current.items() if previous.get(db) != stamp
+    }
+    summary = {
+        "added": [db for db in to_extract if db not in previous],
+        "updated": [db for db in to_extract if db in previous],
+        "removed": removed,
+        "errors": {},
+    }
+    if not full and not removed and not to_extract:
+        return summary
+
+    extracted = {}
+    for db_key, schema in extract_schemas(to_extract, on_progress).items():
+        if "error" in schema:
+            summary["errors"][db_key] = schema["error"]
+        else:
+            extracted[db_key] = schema
+
+    # Old artifacts of removed and re-extracted databases must go
+    remove = set(removed) | (set(to_extract) & set(previous))
+
+    new_lines, index_rows = [], []
+    for db_key, schema in extracted.items():
+        for table, info in schema.get("tables", {}).items():
+            columns = info.get("columns", [])
+            new_lines.append(_ab_line(db_key, table, columns))
+            index_rows.append((db_key, table, columns))
+
+    _patch_schema_ab_file(ab_file, remove, new_lines, rewrite=full)
+    if full:
+        schema_store.write_ab_index(schema_dir, index_rows)
+    else:
+        schema_store.update_ab_index(schema_dir, index_rows, remove)
+    schema_store.write_schema_c(
+        schema_dir, extracted, remove=remove - set(extracted), replace_all=full
+    )
+
+    sources = {db: stamp for db, stamp in previous.items() if db not in remove}
+    sources.update({db: current[db] for db in extracted})
+    _write_sources(schema_dir, sources)
+    vectorstore_cache.invalidate(schema_dir)
+    return summary
+
+
 def run(request, media_path: str):
     """
     Django endpoint for schema build.
@@ -0,0 +1,157 @@
+"""Compact Agent C schema prompts.
+
+Agent B has already picked the relevant tables, so Agent C only needs those,
+plus any tables that sit on the foreign-key path joining them. They are
+rendered as one DDL-like line per table instead of indented JSON:
+
+    orders(id PK, customer_id -> customers.id, total)
+
+If the text is still over SCHEMA_PRUNE_MAX_TOKENS, it is cut down in stages.
+First the join tables keep only their key columns. Then the selected tables
+lose their non-key columns from the end.
+"""
+
+import json
+from collections import deque
+
+from django.conf import settings
+
+from utils.tokens import count_tokens
+
+
+def _match_tables(tables: dict, selected) -> list:
+    """Selected names mapped to schema table names (case-insensitive), in order."""
+    by_lower = {name.lower(): name for name in tables}
+    matched = []
+    for name in selected or []:
+        table = by_lower.get(str(name).lower())
+        if table and table not in matched:
+            matched.append(table)
+    return matched
+
+
+def _fk_graph(tables: dict) -> dict:
+    graph = {name: set() for name in tables}
+    for name, info in tables.items():
+        for fk in info.get("foreign_keys", []):
+            ref = fk.get("ref_table")
+            if ref in graph and ref != name:
+                graph[name].add(ref)
+                graph[ref].add(name)
+    return graph
+
+
+def _shortest_path(graph: dict, start: str, goal: str, max_hops: int):
+    parents = {start: None}
+    queue = deque([(start, 0)])
+    while queue:
+        node, hops = queue.popleft()
+        if node == goal:
+            path = []
+            while node is not None:
+                path.append(node)
+                node = parents[node]
+            return path[::-1]
+        if hops >= max_hops:
+            continue
+        for neighbour in sorted(graph[node]):
+            if neighbour not in parents:
+                parents[neighbour] = node
+                queue.append((neighbour, hops + 1))
+    return None
+
+
+def join_tables(tables: dict, selected: list, max_hops: int) -> list:
+    """Tables outside `selected` on the shortest FK paths between selected tables."""
+    graph = _fk_graph(tables)
+    extra = []
+    for i, start in enumerate(selected):
+        for goal in selected[i + 1:]:
+            path = _shortest_path(graph, start, goal, max_hops) or []
+            for table in path[1:-1]:
+                if table not in selected and table not in extra:
+                    extra.append(table)
+    return extra
+
+
+def _key_columns(info: dict) -> set:
+    keys = set(info.get("primary_key", []))
+    keys.update(fk.get("from_column") for fk in info.get("foreign_keys", []))
+    return keys
+
+
+def render_table(name: str, info: dict, max_other_columns=None) -> str:
+    """One line: name(col PK, col -> ref.col, ...). Non-key columns past the cap are elided."""
+    primary = set(info.get("primary_key", []))
+    refs = {}
+    for fk in info.get("foreign_keys", []):
+        refs.setdefault(fk.get("from_column"), []).append(
+            f"{fk.get('ref_table')}.{fk.get('ref_column')}"
+        )
+    keys = _key_columns(info)
+
+    parts, others, omitted = [], 0, 0
+    for col in info.get("columns", []):
+        if col not in keys:
+            if max_other_columns is not None and others >= max_other_columns:
+                omitted += 1
+                continue
+            others += 1
+        part = col
+        if col in primary:
+            part += " PK"
+        for ref in refs.get(col, []):
+            part += f" -> {ref}"
+        parts.append(part)
+    if omitted:
+        parts.append(f"... +{omitted} more")
+    return f"{name}({', '.join(parts)})"
+
+
+def _render(tables: dict, selected: list, joins: list, join_cap, selected_cap) -> str:
+    lines = [render_table(t, tables[t], selected_cap) for t in selected]
+    lines += [render_table(t, tables[t], join_cap) for t in joins]
+    return "\n".join(lines)
+
+
+def compact_schema(schema: dict, selected_tables, max_tokens=None, full_tokens=None):
+    """
+    Render the part of `schema` ({"tables": {...}}) that Agent C needs for
+    `selected_tables`. Returns (text, stats). If none of the selected tables
+    exist, every table is rendered so C still has something to work with.
+    `full_tokens` is the unpruned schema's size if already known
+    (schema_store.schema_c_tokens); otherwise it is counted here.
+    """
+    tables = (schema or {}).get("tables", {})
+    if max_tokens is None:
+        max_tokens = getattr(settings, "SCHEMA_PRUNE_MAX_TOKENS", 3000)
+    max_hops = getattr(settings, "SCHEMA_PRUNE_MAX_JOIN_HOPS", 3)
+
+    selected = _match_tables(tables, selected_tables) or sorted(tables)
+    joins = join_tables(tables, selected, max_hops)
+
+    text = _render(tables, selected, joins, None, None)
+    tokens = count_tokens(text)
+    truncated = False
+    if max_tokens and tokens > max_tokens:
+        truncated = True
+        # Join tables only matter for their keys
+        text = _render(tables, selected, joins, 0, None)
+        tokens = count_tokens(text)
+        widest = max((len(tables[t].get("columns", [])) for t in selected), default=0)
+        cap = widest
+        while tokens > max_tokens and cap > 0:
+            cap //= 2
+            text = _render(tables, selected, joins, 0, cap)
+            tokens = count_tokens(text)
+
+    if full_tokens is None:
+        full_tokens = count_tokens(json.dumps(schema or {}, ensure_ascii=False))
+    stats = {
+        "schema_tokens": tokens,
+        "full_schema_tokens": full_tokens,
+        "tables": len(selected),
+        "join_tables": joins,
+        "truncated": truncated,
+    }
+    return text, stats
@@ -0,0 +1,320 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Iterable, List, Tuple
+from django.conf import settings
+
+from utils.lru import ByteLRU
+from utils.tokens import count_tokens
+
+SCHEMA_AB_FILE = "schema_ab.jsonl"
+SCHEMA_AB_INDEX = "schema_ab.sqlite"
+SCHEMA_C_DIR = "schema_c"
+SCHEMA_C_MANIFEST = "manifest.json"
+LEGACY_SCHEMA_C_FILE = "schema_c.json"
+
+# Parsed per-database lookups, keyed by (source file, file stamp, ...)
+_cache = ByteLRU(getattr(settings, "SCHEMA_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+def _stamp(path: str):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def schema_version(schema_dir: str):
+    """
+    Version stamp of a user's schema artifacts (schema_ab.jsonl and the schema_c
+    manifest), or None if no schema has been built. Changes on every sync that
+    modifies the schemas.
+    """
+    ab = _stamp(os.path.join(schema_dir, SCHEMA_AB_FILE))
+    if ab is None:
+        return None
+    return (ab, _stamp(os.path.join(schema_dir, SCHEMA_C_DIR, SCHEMA_C_MANIFEST)))
+
+
+# Agent A/B index (schema_ab.sqlite)
+
+
+def write_ab_index(schema_dir: str, rows: Iterable[Tuple[str, str, List[str]]]):
+    """
+    Write the per-database index for schema_ab next to schema_ab.jsonl.
+    rows: iterable of (database, table, columns) in schema_ab order.
+    The index is built in a temp file and swapped in atomically.
+    """
+    out_path = os.path.join(schema_dir, SCHEMA_AB_INDEX)
+    tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(
+            "CREATE TABLE schema_ab ("
+            " position INTEGER PRIMARY KEY,"
+            " database TEXT NOT NULL,"
+            " table_name TEXT NOT NULL,"
+            " columns TEXT NOT NULL)"
+        )
+        conn.executemany(
+            "INSERT INTO schema_ab (database, table_name, columns) VALUES (?, ?, ?)",
+            (
+                (db, table, json.dumps(columns or [], ensure_ascii=False))
+                for db, table, columns in rows
+            ),
+        )
+        conn.execute("CREATE INDEX idx_schema_ab_database ON schema_ab (database)")
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def update_ab_index(schema_dir: str, rows: Iterable[Tuple[str, str, List[str]]], remove=()):
+    """
+    Patch the schema_ab index in place: delete every row of the databases in
+    `remove`, then insert `rows`. Falls back to a rebuild from schema_ab.jsonl
+    (which callers update first) when the index does not exist yet.
+    """
+    index_path = os.path.join(schema_dir, SCHEMA_AB_INDEX)
+    if not os.path.exists(index_path):
+        return _ab_index_path(schema_dir)
+
+    conn = sqlite3.connect(index_path)
+    try:
+        with conn:
+            conn.executemany(
+                "DELETE FROM schema_ab WHERE database = ?", ((db,) for db in remove)
+            )
+            conn.executemany(
+                "INSERT INTO schema_ab (database, table_name, columns) VALUES (?, ?, ?)",
+                (
+                    (db, table, json.dumps(columns or [], ensure_ascii=False))
+                    for db, table, columns in rows
+                ),
+            )
+    finally:
+        conn.close()
+    return index_path
+
+
+def _rows_from_jsonl(schema_file: str):
+    with open(schema_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except Exception:
+                continue
+            yield obj.get("database"), obj.get("table"), obj.get("columns", []) or []
+
+
+def _ab_index_path(schema_dir: str):
+    """
+    Return the schema_ab index path, building it from schema_ab.jsonl when it is
+    missing (schemas created before the index existed). None if neither exists.
+    """
+    index_path = os.path.join(schema_dir, SCHEMA_AB_INDEX)
+    if os.path.exists(index_path):
+        return index_path
+    schema_file = os.path.join(schema_dir, SCHEMA_AB_FILE)
+    if not os.path.exists(schema_file):
+        return None
+    return write_ab_index(schema_dir, _rows_from_jsonl(schema_file))
+
+
+def get_table_entries(schema_dir: str, db_name: str):
+    """
+    Return the schema_ab entries for one database as a list of
+    {"database", "table", "columns"} dicts, or None if no schema has been built.
+    """
+    index_path = _ab_index_path(schema_dir)
+    if index_path is None:
+        return None
+
+    key = ("ab", os.path.realpath(index_path), _stamp(index_path), db_name)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    conn = sqlite3.connect(f"file:{index_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT table_name, columns FROM schema_ab WHERE database = ? ORDER BY position",
+            (db_name,),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    entries = [
+        {"database": db_name, "table": table, "columns": json.loads(columns)}
+        for table, columns in rows
+    ]
+    _cache.put(key, entries, sum(len(t) + len(c) for t, c in rows) * 2)
+    return entries
+
+
+def get_database_schema(schema_dir: str, db_name: str) -> dict:
+    """
+    Return {"tables": [...], "columns": [...]} for one database, with columns
+    de-duplicated across tables in first-seen order.
+    """
+    entries = get_table_entries(schema_dir, db_name) or []
+    tables = [e["table"] for e in entries]
+    columns = list(dict.fromkeys(c for e in entries for c in e["columns"]))
+    return {"tables": tables, "columns": columns}
+
+
+# Agent C shards (schema_c/<shard>.json + schema_c/manifest.json)
+
+
+def _atomic_write_json(path: str, obj):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def _shard_name(db_name: str) -> str:
+    # Readable but filesystem-safe, with a hash suffix so distinct names never collide
+    safe = re.sub(r"[^A-Za-z0-9_.-]", "_", db_name)[:64]
+    digest = hashlib.sha1(db_name.encode("utf-8")).hexdigest()[:8]
+    return f"{safe}-{digest}.json"
+
+
+def _read_manifest(shard_dir: str) -> dict:
+    try:
+        with open(os.path.join(shard_dir, SCHEMA_C_MANIFEST), "r", encoding="utf-8") as f:
+            return json.load(f).get("databases", {})
+    except (OSError, ValueError):
+        return {}
+
+
+def write_schema_c(schema_dir: str, schemas: dict, remove=(), replace_all: bool = False):
+    """
+    Write per-database Agent C schemas as compact shards plus a manifest.
+    - schemas: { db_key: {"tables": {...}} } to write (or overwrite)
+    - remove: db keys whose shards should be deleted
+    - replace_all: drop every database not present in `schemas`
+    Returns the manifest mapping { db_key: {"file": ..., "tables": n} }.
+    """
+    shard_dir = os.path.join(schema_dir, SCHEMA_C_DIR)
+    os.makedirs(shard_dir, exist_ok=True)
+
+    manifest = {} if replace_all else _read_manifest(shard_dir)
+    for db_name in remove:
+        manifest.pop(db_name, None)
+    for db_name, schema in schemas.items():
+        shard = _shard_name(db_name)
+        _atomic_write_json(os.path.join(shard_dir, shard), schema)
+        manifest[db_name] = {"file": shard, "tables": len(schema.get("tables", {}))}
+
+    _atomic_write_json(
+        os.path.join(shard_dir, SCHEMA_C_MANIFEST), {"databases": manifest}
+    )
+
+    # Remove shards no longer referenced by the manifest
+    keep = {entry["file"] for entry in manifest.values()} | {SCHEMA_C_MANIFEST}
+    for name in os.listdir(shard_dir):
+        if name not in keep and name.endswith(".json"):
+            try:
+                os.remove(os.path.join(shard_dir, name))
+            except OSError:
+                pass
+
+    # The monolithic file is superseded by the shards
+    legacy = os.path.join(schema_dir, LEGACY_SCHEMA_C_FILE)
+    if os.path.exists(legacy):
+        os.remove(legacy)
+    return manifest
+
+
+def get_schema_c_manifest(schema_dir: str):
+    """
+    Return { db_key: {"file": ..., "tables": n} } for the user's Agent C schema,
+    or None if no schema has been built. A legacy schema_c.json is split into
+    shards the first time it is seen.
+    """
+    shard_dir = os.path.join(schema_dir, SCHEMA_C_DIR)
+    manifest_path = os.path.join(shard_dir, SCHEMA_C_MANIFEST)
+    if not os.path.exists(manifest_path):
+        legacy = os.path.join(schema_dir, LEGACY_SCHEMA_C_FILE)
+        if not os.path.exists(legacy):
+            return None
+        with open(legacy, "r", encoding="utf-8") as f:
+            write_schema_c(schema_dir, json.load(f), replace_all=True)
+
+    key = ("c-manifest", os.path.realpath(manifest_path), _stamp(manifest_path))
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    manifest = _read_manifest(shard_dir)
+    _cache.put(key, manifest, len(manifest) * 128)
+    return manifest
+
+
+def _schema_c_shard(schema_dir: str, db_name: str):
+    """(path, stamp) of one database's schema_c shard, or None if it is unknown."""
+    manifest = get_schema_c_manifest(schema_dir)
+    if not manifest or db_name not in manifest:
+        return None
+    shard_path = os.path.join(schema_dir, SCHEMA_C_DIR, manifest[db_name]["file"])
+    stamp = _stamp(shard_path)
+    return (shard_path, stamp) if stamp is not None else None
+
+
+def load_schema_c(schema_dir: str, db_name: str):
+    """
+    Return the Agent C schema {"tables": {...}} for one database, reading only
+    that database's shard. None if the database (or the schema) is unknown.
+    """
+    shard = _schema_c_shard(schema_dir, db_name)
+    if shard is None:
+        return None
+    shard_path, stamp = shard
+    key = ("c", os.path.realpath(shard_path), stamp)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    with open(shard_path, "r", encoding="utf-8") as f:
+        raw = f.read()
+    schema = json.loads(raw)
+    _cache.put(key, schema, len(raw) * 4)
+    return schema
+
+
+def schema_c_tokens(schema_dir: str, db_name: str):
+    """
+    Token count of one database's full Agent C schema as JSON (the size before
+    pruning), counted once per shard version. None if the database is unknown.
+    """
+    shard = _schema_c_shard(schema_dir, db_name)
+    if shard is None:
+        return None
+    shard_path, stamp = shard
+    key = ("c-tokens", os.path.realpath(shard_path), stamp)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+    schema = load_schema_c(schema_dir, db_name)
+    if schema is None:
+        return None
+    tokens = count_tokens(json.dumps(schema, ensure_ascii=False))
+    _cache.put(key, tokens, 64)
+    return tokens
+
+
+def clear():
+    _cache.clear()
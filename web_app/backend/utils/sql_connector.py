@@ -1,13 +1,64 @@
 import sqlite3
 import os
+import re
 from django.apps import apps
+from django.conf import settings
+
+from utils import sql_guard, sqlite_pool, timing
+from utils.lru import ByteLRU
+
+# (user_id, db_name) -> resolved file path; invalidated by core.signals on Files changes
+_path_cache = ByteLRU(getattr(settings, "SQL_PATH_CACHE_MAX_BYTES", 1024 * 1024))
+
+# (user_id, db_name, normalized SQL, file identity, caps) -> SELECT output
+_result_cache = ByteLRU(getattr(settings, "SQL_RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Quoted literals/identifiers are kept verbatim when normalizing SQL
+_QUOTED_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])""")
+_READ_ONLY_RE = re.compile(r"^\s*(select|with|values)\b", re.IGNORECASE)
+# Results that depend on more than the file contents are never cached
+_VOLATILE_RE = re.compile(
+    r"\b(random|randomblob|changes|total_changes|last_insert_rowid)\s*\(|"
+    r"\bcurrent_(date|time|timestamp)\b|'now'",
+    re.IGNORECASE,
+)
+
+
+def forget_db_paths(user_id: int, db_name: str = None):
+    """Drop cached paths and pooled connections for a user's database (or all of them)."""
+
+    def matches(key):
+        return key[0] == user_id and (db_name is None or key[1] == db_name)
+
+    _path_cache.pop_where(matches)
+    _result_cache.pop_where(matches)
+    sqlite_pool.discard(matches)
 
 
 def _get_db_path_for_user(user_id: int, db_name: str):
     """
     Return absolute file path for `db_name` owned by `user_id`, or None.
-    Very small and explicit: uses the Django `Files` model.
+    Lookups are cached; a cached path whose file has vanished is looked up again.
     """
+    key = (user_id, db_name)
+    path = _path_cache.get(key)
+    if path is not None and os.path.isfile(path):
+        return path
+
+    path = _lookup_db_path(user_id, db_name)
+    if path:
+        _path_cache.put(key, path, len(path) + 64)
+    else:
+        _path_cache.pop(key)
+    return path
+
+
+def get_db_path(user_id: int, db_name: str):
+    """Absolute path of `db_name` owned by `user_id`, or None (cached lookup)."""
+    return _get_db_path_for_user(user_id, db_name)
+
+
+def _lookup_db_path(user_id: int, db_name: str):
     Files = apps.get_model("core", "Files")
     f = Files.objects.filter(user_id=user_id, database=db_name).first()
     if not f or not f.file:
@@ -22,42 +73,164 @@ def _get_db_path_for_user(user_id: int, db_name: str):
     return path
 
 
-def _execute_sql_at_path(db_path: str, query: str):
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace outside quoted text and drop trailing semicolons."""
+    parts = _QUOTED_RE.split(query.strip())
+    for i in range(0, len(parts), 2):
+        parts[i] = re.sub(r"\s+", " ", parts[i])
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def _cacheable(query: str) -> bool:
+    return bool(_READ_ONLY_RE.match(query)) and not _VOLATILE_RE.search(query)
+
+
+def _execute_cached(db_path: str, query: str, user_id: int, db_name: str, max_rows, max_bytes):
+    """
+    `_execute_sql_at_path` behind a result cache. The key includes the file's
+    identity (inode, mtime, size), so any change to the database is a miss.
+    """
+    identity = sqlite_pool.file_identity(db_path)
+    if identity is None or not _cacheable(query):
+        return _execute_sql_at_path(db_path, query, (user_id, db_name), max_rows, max_bytes)
+
+    key = (user_id, db_name, normalize_sql(query), identity, max_rows, max_bytes)
+    cached = _result_cache.get(key)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    output = _execute_sql_at_path(db_path, query, (user_id, db_name), max_rows, max_bytes)
+    # Only cache if the file did not change while the query ran
+    if output.get("success") and sqlite_pool.file_identity(db_path) == identity:
+        nbytes = sum(
+            sum(_value_bytes(v) for v in row.values()) + 64
+            for row in output.get("result", [])
+        )
+        _result_cache.put(key, output, nbytes * 2 + len(key[2]) + 256)
+    return output
+
+
+def _value_bytes(value) -> int:
+    if isinstance(value, (str, bytes)):
+        return len(value) + 2
+    return 8
+
+
+def _fetch_bounded(cur, max_rows: int, max_bytes: int, on_rows=None):
+    """
+    Fetch rows from `cur` in chunks of SQL_RESULT_CHUNK_ROWS until the result
+    ends or would exceed `max_rows` rows / roughly `max_bytes` bytes.
+    With `on_rows(columns, rows)` each chunk is handed over and nothing is kept.
+    Returns (kept_rows, row_count, truncated).
+    """
+    columns = [d[0] for d in cur.description]
+    chunk_rows = max(int(getattr(settings, "SQL_RESULT_CHUNK_ROWS", 500)), 1)
+    kept, count, nbytes, truncated = [], 0, 0, False
+
+    while not truncated:
+        chunk = cur.fetchmany(chunk_rows)
+        if not chunk:
+            break
+        batch = []
+        for row in chunk:
+            size = sum(_value_bytes(v) for v in row) + 4
+            if count >= max_rows or nbytes + size > max_bytes:
+                truncated = True
+                break
+            batch.append(row)
+            count += 1
+            nbytes += size
+        if on_rows is not None:
+            if batch:
+                on_rows(columns, [list(row) for row in batch])
+        else:
+            kept.extend(batch)
+    return kept, count, truncated
+
+
+def _result_limits(payload: dict, streaming: bool):
+    """Row/byte caps for one query; a client `max_rows` may only lower the configured cap."""
+    prefix = "SQL_STREAM" if streaming else "SQL_RESULT"
+    max_rows = int(getattr(settings, f"{prefix}_MAX_ROWS", 10000))
+    max_bytes = int(getattr(settings, f"{prefix}_MAX_BYTES", 16 * 1024 * 1024))
+    try:
+        requested = int(payload.get("max_rows") or 0)
+    except (TypeError, ValueError):
+        requested = 0
+    if requested > 0:
+        max_rows = min(max_rows, requested)
+    return max_rows, max_bytes
+
+
+def _execute_sql_at_path(
+    db_path: str,
+    query: str,
+    pool_key=None,
+    max_rows: int = 10000,
+    max_bytes: int = 16 * 1024 * 1024,
+    on_rows=None,
+):
     """
     Execute SQL against the sqlite file at db_path. Return dict with either
     `{'success': True, 'result': ...}` or `{'error': '...'}`.
-    For SELECT queries we return a list of dicts (columns -> values). For other
-    statements we return rows_affected.
+    For SELECT queries `result` is a list of dicts (columns -> values), capped
+    at `max_rows`/`max_bytes` with `truncated` set when rows were left out.
+    With `on_rows(columns, rows)` the rows are streamed in chunks instead and
+    `result` is left empty. Connections are pooled per `pool_key` (default: the
+    path) and read-only, so statements that would modify the database fail.
+    Statements are checked and time/work-limited by utils.sql_guard.
     """
     if not db_path or not os.path.isfile(db_path):
         return {"error": f"Database file not found: {db_path}"}
 
     try:
-        conn = sqlite3.connect(db_path)
-        cur = conn.cursor()
-        cur.execute(query)
-
-        # If it's a SELECT-like statement, cursor.description is set
-        if cur.description:
-            columns = [d[0] for d in cur.description]
-            rows = cur.fetchall()
-            result = [dict(zip(columns, row)) for row in rows]
-            return {"success": True, "result": result}
-        else:
-            # Non-select: commit and report affected rows
-            conn.commit()
-            return {"success": True, "rows_affected": cur.rowcount}
+        with sqlite_pool.connection(pool_key or db_path, db_path) as conn:
+            if sql_guard.enabled():
+                verdict = sql_guard.check_plan(conn, query)
+                if verdict:
+                    return verdict
+
+            with sql_guard.budget(conn) as budget:
+                if on_rows is not None:
+                    client_on_rows = on_rows
+
+                    def on_rows(columns, rows):
+                        # Waiting for the client does not count against the time budget
+                        with budget.paused():
+                            client_on_rows(columns, rows)
+
+                cur = conn.cursor()
+                try:
+                    cur.execute(query)
+
+                    # If it's a SELECT-like statement, cursor.description is set
+                    if cur.description:
+                        columns = [d[0] for d in cur.description]
+                        rows, row_count, truncated = _fetch_bounded(
+                            cur, max_rows, max_bytes, on_rows
+                        )
+                        output = {
+                            "success": True,
+                            "result": [dict(zip(columns, row)) for row in rows],
+                            "row_count": row_count,
+                            "truncated": truncated,
+                        }
+                        if on_rows is not None:
+                            output["columns"] = columns
+                            output["streamed"] = True
+                        return output
+                    return {"success": True, "rows_affected": max(cur.rowcount, 0)}
+                except sqlite3.OperationalError:
+                    # The progress handler aborted the statement
+                    if budget.exceeded:
+                        return budget.error()
+                    raise
+                finally:
+                    cur.close()
+    except FileNotFoundError:
+        return {"error": f"Database file not found: {db_path}"}
     except sqlite3.Error as e:
         return {"error": str(e)}
-    finally:
-        try:
-            cur.close()
-        except Exception:
-            pass
-        try:
-            conn.close()
-        except Exception:
-            pass
 
 
 def run(api_key, payload: dict):
@@ -83,17 +256,20 @@ def run(api_key, payload: dict):
         if not db_path:
             return {"error": f"Database '{db_name}' not found for user {user_id}"}
 
-        return _execute_sql_at_path(db_path, query)
+        max_rows, max_bytes = _result_limits(payload, streaming=False)
+        return _execute_cached(db_path, query, user_id, db_name, max_rows, max_bytes)
     except Exception as e:
         return {"error": f"SQL connector failed: {str(e)}"}
 
 
-def run_sql(api_key, payload: dict, user_id: int = None):
+def run_sql(api_key, payload: dict, user_id: int = None, on_rows=None):
     """
     Minimal, Django-first entrypoint used by the agents pipeline.
     Called as `run_sql(api_key, payload, user_id)` from `agents.views`.
 
     Expected payload (from Agent C): { 'database': name, 'SQL': 'SELECT ...' }
+    Optional `on_rows(columns, rows)` streams the result in chunks (see
+    `_execute_sql_at_path`); streamed results use the SQL_STREAM_* caps.
     """
     try:
         db_name = payload.get("database")
@@ -110,6 +286,35 @@ def run_sql(api_key, payload: dict, user_id: int = None):
         if not db_path:
             return {"error": f"Database '{db_name}' not found for user {user_id}"}
 
-        return _execute_sql_at_path(db_path, query)
+        max_rows, max_bytes = _result_limits(payload, streaming=on_rows is not None)
+        with timing.phase("sql_exec"):
+            if on_rows is not None:
+                # Streamed results are not cached
+                return _execute_sql_at_path(
+                    db_path, query, (user_id, db_name), max_rows, max_bytes, on_rows
+                )
+            return _execute_cached(db_path, query, user_id, db_name, max_rows, max_bytes)
     except Exception as e:
-        return {"error": f"SQL connector failed: {str(e)}"}
\ No newline at end of file
+        return {"error": f"SQL connector failed: {str(e)}"}
+
+
+def validate_sql(user_id: int, db_name: str, query: str):
+    """
+    Check that `query` compiles against the user's database without running it
+    (SQLite `EXPLAIN`). Returns None if it does, else an error message.
+    """
+    if not db_name:
+        return "database name is required"
+    if not query:
+        return "query is required"
+    db_path = _get_db_path_for_user(user_id, db_name)
+    if not db_path:
+        return f"Database '{db_name}' not found for user {user_id}"
+    try:
+        with sqlite_pool.connection((user_id, db_name), db_path) as conn:
+            conn.execute(f"EXPLAIN {query}").fetchall()
+        return None
+    except FileNotFoundError:
+        return f"Database file not found: {db_path}"
+    except (sqlite3.Error, ValueError) as e:
+        return str(e)
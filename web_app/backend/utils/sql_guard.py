@@ -0,0 +1,222 @@
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+from django.conf import settings
+
+# Result error_type for queries rejected or aborted by the guard
+TOO_EXPENSIVE = "query_too_expensive"
+
+# "SCAN t", "SCAN b b", "SCAN t USING COVERING INDEX i" (full index scan): the
+# name is a table, an alias, or a subquery/CTE materialized by SQLite
+_SCAN_RE = re.compile(r"^SCAN (.+?)(?: (?:USING|VIRTUAL TABLE) .*)?$")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enabled() -> bool:
+    return bool(_setting("SQL_GUARD_ENABLED", True))
+
+
+def too_expensive(reason: str, message: str, **details) -> dict:
+    """Structured result for a query the guard refused to run (or stopped)."""
+    return {
+        "error": f"Query too expensive: {message}",
+        "error_type": TOO_EXPENSIVE,
+        "reason": reason,
+        "details": details,
+    }
+
+
+def _unquote(name: str) -> str:
+    if len(name) > 1 and name[0] in "\"'`[" and name[-1] in "\"'`]":
+        return name[1:-1]
+    return name
+
+
+def _table_names(conn) -> dict:
+    """Lowercased table name -> table name (SQLite names are case-insensitive)."""
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    return {name.lower(): name for (name,) in rows}
+
+
+# A table name in a statement: "quoted", `quoted`, [quoted] or a bare word
+_NAME = r"(\"[^\"]+\"|`[^`]+`|\[[^\]]+\]|\w+)"
+
+
+def _resolve_table(name: str, query: str, tables: dict):
+    """Map a plan name (table or alias) back to a table name, or None."""
+    table = tables.get(name.lower())
+    if table is not None:
+        return table
+    # "<table> [AS] <alias>" somewhere in the statement
+    pattern = re.compile(
+        _NAME + r"\s+(?:as\s+)?[\"`\[]?" + re.escape(name) + r"[\"`\]]?(?![\w])",
+        re.IGNORECASE,
+    )
+    for match in pattern.finditer(query):
+        table = tables.get(_unquote(match.group(1)).lower())
+        if table is not None:
+            return table
+    return None
+
+
+def _largest_table(conn, query: str, tables: dict):
+    """(table, rows) of the largest table the statement names, else of the database."""
+    named = [
+        table
+        for table in tables.values()
+        if re.search(r"(?<!\w)" + re.escape(table) + r"(?!\w)", query, re.IGNORECASE)
+    ]
+    sizes = [(estimate_rows(conn, table), table) for table in named or tables.values()]
+    if not sizes:
+        return None, 0
+    rows, table = max(sizes)
+    return table, rows
+
+
+def estimate_rows(conn, table: str) -> int:
+    """Cheap row estimate: max(rowid) (a b-tree seek), else sqlite_stat1, else 0."""
+    quoted = '"' + table.replace('"', '""') + '"'
+    try:
+        (value,) = conn.execute(f"SELECT max(rowid) FROM {quoted}").fetchone()
+        return int(value or 0)
+    except sqlite3.Error:
+        pass  # WITHOUT ROWID table
+    try:
+        row = conn.execute(
+            "SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1", (table,)
+        ).fetchone()
+        return int(row[0].split()[0]) if row else 0
+    except (sqlite3.Error, ValueError, IndexError):
+        return 0
+
+
+def check_plan(conn, query: str):
+    """
+    Inspect `EXPLAIN QUERY PLAN` before running `query`. Returns a
+    `too_expensive` result for a full scan over more than SQL_GUARD_MAX_SCAN_ROWS
+    rows or a nested full-scan join (cartesian product) whose row product
+    exceeds SQL_GUARD_MAX_JOIN_ROWS; None if the plan looks acceptable or
+    cannot be inspected (the statement's own error surfaces when it runs).
+    A scan that cannot be traced back to a table (a materialized subquery or
+    CTE) is assumed to be as large as the largest table the statement names.
+    """
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+    except sqlite3.Error:
+        return None
+
+    max_scan = int(_setting("SQL_GUARD_MAX_SCAN_ROWS", 20_000_000))
+    max_join = int(_setting("SQL_GUARD_MAX_JOIN_ROWS", 100_000_000))
+    tables = None
+    largest = None
+    scans_by_parent = {}
+
+    for _, parent, _, detail in plan:
+        match = _SCAN_RE.match(detail or "")
+        if not match:
+            continue
+        if tables is None:
+            tables = _table_names(conn)
+        name = _unquote(match.group(1))
+        if name == "CONSTANT ROW":
+            continue
+        table = _resolve_table(name, query, tables)
+        if table is not None:
+            rows = estimate_rows(conn, table)
+        else:
+            if largest is None:
+                largest = _largest_table(conn, query, tables)
+            table, rows = name, largest[1]
+        if rows > max_scan:
+            return too_expensive(
+                "full_scan",
+                f"full scan of table '{table}' (~{rows:,} rows)",
+                table=table,
+                estimated_rows=rows,
+                limit=max_scan,
+            )
+        scans_by_parent.setdefault(parent, []).append((table, rows))
+
+    for scans in scans_by_parent.values():
+        if len(scans) < 2:
+            continue
+        product = 1
+        for _, rows in scans:
+            product *= max(rows, 1)
+        if product > max_join:
+            names = [table for table, _ in scans]
+            return too_expensive(
+                "cartesian_product",
+                f"unindexed join of {', '.join(names)} (~{product:,} row combinations)",
+                tables=names,
+                estimated_rows=product,
+                limit=max_join,
+            )
+    return None
+
+
+class Budget:
+    """Wall-clock and VM-step budget enforced through sqlite3's progress handler."""
+
+    def __init__(self, timeout: float, max_steps: int, interval: int):
+        self.deadline = time.monotonic() + timeout
+        self.timeout = timeout
+        self.max_steps = max_steps
+        self.interval = interval
+        self.steps = 0
+        self.exceeded = None  # "timeout" | "vm_steps"
+
+    def _check(self):
+        self.steps += self.interval
+        if self.max_steps and self.steps > self.max_steps:
+            self.exceeded = "vm_steps"
+            return 1
+        if self.timeout and time.monotonic() > self.deadline:
+            self.exceeded = "timeout"
+            return 1
+        return 0
+
+    @contextmanager
+    def paused(self):
+        """Time spent inside this block (e.g. waiting on a slow client) is not counted."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.deadline += time.monotonic() - started
+
+    def error(self) -> dict:
+        if self.exceeded == "vm_steps":
+            return too_expensive(
+                "vm_steps",
+                f"exceeded {self.max_steps:,} SQLite VM steps",
+                limit=self.max_steps,
+            )
+        return too_expensive(
+            "timeout", f"exceeded {self.timeout:g}s of execution time", limit=self.timeout
+        )
+
+
+@contextmanager
+def budget(conn):
+    """
+    Run the block under the configured SQL_GUARD_* budgets; yields the Budget.
+    With SQL_GUARD_ENABLED off the Budget never stops the statement.
+    """
+    if not enabled():
+        yield Budget(0, 0, 1)
+        return
+    governor = Budget(
+        float(_setting("SQL_GUARD_TIMEOUT_SECONDS", 10)),
+        int(_setting("SQL_GUARD_MAX_VM_STEPS", 1_000_000_000)),
+        max(int(_setting("SQL_GUARD_PROGRESS_INTERVAL", 1000)), 1),
+    )
+    conn.set_progress_handler(governor._check, governor.interval)
+    try:
+        yield governor
+    finally:
+        conn.set_progress_handler(None, 0)
@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from django.conf import settings
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def file_identity(path: str):
+    """(device, inode, mtime_ns, size) of `path`, or None if it is missing."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def open_read_only(path: str) -> sqlite3.Connection:
+    """Open `path` read-only with the configured PRAGMAs applied."""
+    conn = sqlite3.connect(
+        f"{Path(path).as_uri()}?mode=ro", uri=True, check_same_thread=False
+    )
+    conn.execute(f"PRAGMA mmap_size = {int(_setting('SQL_POOL_MMAP_SIZE', 64 * 1024 * 1024))}")
+    # Negative cache_size is in KiB rather than pages
+    conn.execute(f"PRAGMA cache_size = -{int(_setting('SQL_POOL_CACHE_SIZE_KIB', 16 * 1024))}")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class _Entry:
+    __slots__ = ("path", "identity", "idle")
+
+    def __init__(self, path, identity):
+        self.path = path
+        self.identity = identity
+        self.idle = []  # [(connection, returned_at)]
+
+
+# key -> _Entry, least recently used first
+_pools = OrderedDict()
+_lock = threading.Lock()
+_last_sweep = 0.0
+
+
+def _sweep_idle(now):
+    # Caller holds _lock
+    global _last_sweep
+    idle_seconds = _setting("SQL_POOL_IDLE_SECONDS", 300)
+    if now - _last_sweep < min(idle_seconds, 30):
+        return []
+    _last_sweep = now
+    expired = []
+    for key, entry in list(_pools.items()):
+        keep = []
+        for conn, returned_at in entry.idle:
+            (expired if now - returned_at > idle_seconds else keep).append(
+                (conn, returned_at)
+            )
+        entry.idle = keep
+    return [conn for conn, _ in expired]
+
+
+def _checkout(key, path):
+    identity = file_identity(path)
+    if identity is None:
+        raise FileNotFoundError(path)
+
+    stale = []
+    with _lock:
+        stale.extend(_sweep_idle(time.monotonic()))
+        entry = _pools.get(key)
+        if entry is not None and (entry.path != path or entry.identity != identity):
+            # File was replaced or the key now points elsewhere
+            stale.extend(conn for conn, _ in entry.idle)
+            entry = None
+        if entry is None:
+            entry = _pools[key] = _Entry(path, identity)
+        _pools.move_to_end(key)
+        while len(_pools) > max(_setting("SQL_POOL_MAX_DATABASES", 64), 1):
+            _, evicted = _pools.popitem(last=False)
+            stale.extend(conn for conn, _ in evicted.idle)
+        conn = entry.idle.pop()[0] if entry.idle else None
+
+    for old in stale:
+        _close(old)
+    return (conn or open_read_only(path)), entry
+
+
+def _checkin(key, conn, entry):
+    try:
+        if conn.in_transaction:
+            conn.rollback()
+    except sqlite3.Error:
+        _close(conn)
+        return
+    with _lock:
+        current = _pools.get(key)
+        if (
+            current is entry
+            and entry.identity == file_identity(entry.path)
+            and len(entry.idle) < _setting("SQL_POOL_MAX_PER_DATABASE", 4)
+        ):
+            entry.idle.append((conn, time.monotonic()))
+            return
+    _close(conn)
+
+
+@contextmanager
+def connection(key, path: str):
+    """
+    Borrow a pooled read-only connection to the SQLite file at `path`.
+    `key` identifies the pool (e.g. (user_id, database)). Connections are
+    reopened when the file's identity changes and closed after sitting idle
+    for SQL_POOL_IDLE_SECONDS.
+    """
+    conn, entry = _checkout(key, path)
+    try:
+        yield conn
+    finally:
+        _checkin(key, conn, entry)
+
+
+def discard(predicate=None):
+    """Close idle connections of every pool whose key satisfies `predicate` (all if None)."""
+    with _lock:
+        keys = [k for k in _pools if predicate is None or predicate(k)]
+        entries = [_pools.pop(k) for k in keys]
+    for entry in entries:
+        for conn, _ in entry.idle:
+            _close(conn)
+    return len(keys)
@@ -0,0 +1,335 @@
+"""Tests for utils (SQL guard, schema store, LLM client pool, cassettes). Run with `python manage.py test utils.tests`."""
+
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import httpx
+from django.test import SimpleTestCase, override_settings
+
+from utils import llm_cassette, llm_pool, schema_store, sql_guard
+
+
+class StubOpenAI:
+    """
+    Local OpenAI-compatible server: /chat/completions answers "ok" (as SSE when
+    the request asks to stream). Every request is kept in `requests`.
+    """
+
+    def __init__(self):
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                stub.requests.append({"path": self.path, "headers": dict(self.headers), "body": body})
+                if body.get("stream"):
+                    self.reply("text/event-stream", stub.stream_body())
+                else:
+                    self.reply("application/json", json.dumps(stub.completion()).encode())
+
+            def reply(self, content_type, data):
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def completion(content="ok"):
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": 0,
+            "model": "stub",
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4},
+        }
+
+    @staticmethod
+    def stream_body() -> bytes:
+        events = []
+        for delta in ({"role": "assistant", "content": "o"}, {"content": "k"}):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": "stub",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            events.append(f"data: {json.dumps(chunk)}\n\n")
+        events.append("data: [DONE]\n\n")
+        return "".join(events).encode()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(SQL_GUARD_MAX_SCAN_ROWS=1_000, SQL_GUARD_MAX_JOIN_ROWS=100_000)
+class CheckPlanTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        path = os.path.join(self.tmp, "guard.sqlite")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE Orders (id INTEGER PRIMARY KEY, customer TEXT)")
+        conn.execute('CREATE TABLE "order items" (id INTEGER PRIMARY KEY, qty INTEGER)')
+        conn.execute("CREATE TABLE small (id INTEGER PRIMARY KEY)")
+        conn.executemany(
+            "INSERT INTO Orders VALUES (?, ?)", ((i, f"c{i}") for i in range(1, 2_001))
+        )
+        conn.executemany('INSERT INTO "order items" VALUES (?, 1)', ((i,) for i in range(1, 2_001)))
+        conn.executemany("INSERT INTO small VALUES (?)", ((i,) for i in range(1, 11)))
+        conn.commit()
+        conn.close()
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def check(self, query):
+        return sql_guard.check_plan(self.conn, query)
+
+    def test_small_scan_passes(self):
+        self.assertIsNone(self.check("SELECT * FROM small"))
+
+    def test_table_name_case_differs_from_schema(self):
+        verdict = self.check("SELECT * FROM orders")
+        self.assertEqual(verdict["reason"], "full_scan")
+        self.assertEqual(verdict["details"]["table"], "Orders")
+
+    def test_quoted_name_with_spaces(self):
+        verdict = self.check('SELECT * FROM "order items"')
+        self.assertEqual(verdict["reason"], "full_scan")
+        self.assertEqual(verdict["details"]["table"], "order items")
+
+    @override_settings(SQL_GUARD_MAX_SCAN_ROWS=10_000)
+    def test_aliased_self_join(self):
+        verdict = self.check("SELECT * FROM orders o1, orders o2")
+        self.assertEqual(verdict["reason"], "cartesian_product")
+        self.assertEqual(verdict["details"]["tables"], ["Orders", "Orders"])
+        self.assertEqual(verdict["details"]["estimated_rows"], 2_000 * 2_000)
+
+    @override_settings(SQL_GUARD_MAX_SCAN_ROWS=10_000)
+    def test_unresolved_scan_is_estimated_conservatively(self):
+        verdict = self.check(
+            "WITH w AS (SELECT * FROM orders) SELECT * FROM w, w AS w2"
+        )
+        self.assertEqual(verdict["reason"], "cartesian_product")
+        self.assertEqual(verdict["details"]["estimated_rows"], 2_000 * 2_000)
+
+    def test_indexed_join_passes(self):
+        self.assertIsNone(
+            self.check("SELECT * FROM small s JOIN orders o ON o.id = s.id")
+        )
+
+
+class BudgetTests(SimpleTestCase):
+    QUERY = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n LIMIT 100000) SELECT count(*) FROM n"
+
+    @override_settings(SQL_GUARD_MAX_VM_STEPS=10_000, SQL_GUARD_PROGRESS_INTERVAL=100)
+    def test_vm_step_budget_stops_statement(self):
+        conn = sqlite3.connect(":memory:")
+        with sql_guard.budget(conn) as budget:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute(self.QUERY).fetchall()
+        self.assertEqual(budget.error()["reason"], "vm_steps")
+
+    @override_settings(
+        SQL_GUARD_ENABLED=False,
+        SQL_GUARD_MAX_VM_STEPS=10_000,
+        SQL_GUARD_PROGRESS_INTERVAL=100,
+    )
+    def test_disabled_guard_sets_no_budget(self):
+        conn = sqlite3.connect(":memory:")
+        with sql_guard.budget(conn) as budget:
+            self.assertEqual(conn.execute(self.QUERY).fetchone(), (100000,))
+        self.assertIsNone(budget.exceeded)
+
+
+class SchemaTokensTests(SimpleTestCase):
+    SCHEMA = {"tables": {"singer": {"columns": ["id", "name"], "primary_key": ["id"], "foreign_keys": []}}}
+
+    def setUp(self):
+        self.schema_dir = tempfile.mkdtemp()
+        schema_store.clear()
+        schema_store.write_schema_c(self.schema_dir, {"concert": self.SCHEMA})
+
+    def tearDown(self):
+        schema_store.clear()
+        shutil.rmtree(self.schema_dir, ignore_errors=True)
+
+    def test_full_schema_is_counted_once_per_version(self):
+        with mock.patch.object(schema_store, "count_tokens", wraps=schema_store.count_tokens) as counted:
+            first = schema_store.schema_c_tokens(self.schema_dir, "concert")
+            self.assertEqual(schema_store.schema_c_tokens(self.schema_dir, "concert"), first)
+            self.assertEqual(counted.call_count, 1)
+
+            bigger = {"tables": {**self.SCHEMA["tables"], "concert": {"columns": ["id", "year"]}}}
+            schema_store.write_schema_c(self.schema_dir, {"concert": bigger})
+            self.assertGreater(schema_store.schema_c_tokens(self.schema_dir, "concert"), first)
+            self.assertEqual(counted.call_count, 2)
+        self.assertIsNone(schema_store.schema_c_tokens(self.schema_dir, "missing"))
+
+
+class LLMPoolTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubOpenAI()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.settings_override = override_settings(
+            OPENAI_BASE_URL=self.stub.url, LLM_CASSETTE_MODE=None
+        )
+        self.settings_override.enable()
+        llm_pool.reset_http_clients()
+        self.stub.requests.clear()
+
+    def tearDown(self):
+        llm_pool.reset_http_clients()
+        self.settings_override.disable()
+
+    def test_clients_are_pooled_per_api_key(self):
+        first = llm_pool.get_chat_model("key-one")
+        self.assertIs(llm_pool.get_chat_model("key-one"), first)
+        other = llm_pool.get_chat_model("key-two")
+        self.assertIsNot(other, first)
+        self.assertIs(
+            llm_pool.get_embeddings("key-one"), llm_pool.get_embeddings("key-one")
+        )
+
+        # Every key's client sends through the one shared connection pool
+        http_client = llm_pool.get_http_client()
+        self.assertIs(first.http_client, http_client)
+        self.assertIs(other.http_client, http_client)
+
+    def test_requests_reach_the_stub_with_each_key(self):
+        self.assertEqual(llm_pool.get_chat_model("key-one").invoke("hi").content, "ok")
+        self.assertEqual(llm_pool.get_chat_model("key-two").invoke("hi").content, "ok")
+        self.assertEqual(
+            [r["headers"]["Authorization"] for r in self.stub.requests],
+            ["Bearer key-one", "Bearer key-two"],
+        )
+        self.assertTrue(all(r["path"] == "/v1/chat/completions" for r in self.stub.requests))
+
+    def test_reset_http_clients(self):
+        model = llm_pool.get_chat_model("key-one")
+        http_client = llm_pool.get_http_client()
+
+        llm_pool.reset_http_clients()
+        self.assertTrue(http_client.is_closed)
+        self.assertIsNot(llm_pool.get_http_client(), http_client)
+        fresh = llm_pool.get_chat_model("key-one")
+        self.assertIsNot(fresh, model)
+        self.assertIs(fresh.http_client, llm_pool.get_http_client())
+        self.assertEqual(fresh.invoke("hi").content, "ok")
+
+
+class LLMCassetteTests(SimpleTestCase):
+    BODY = {"model": "stub", "messages": [{"role": "user", "content": "hi"}]}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubOpenAI()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, "cassette.jsonl")
+        self.stub.requests.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def http_client(self, mode):
+        # A fresh Cassette each time, so replays read what was written to disk
+        transport = llm_cassette.CassetteTransport(mode, llm_cassette.Cassette(self.path))
+        return httpx.Client(base_url=self.stub.url, transport=transport)
+
+    def post(self, client, body, stream=False):
+        url = "/chat/completions"
+        if not stream:
+            return client.post(url, json=body)
+        with client.stream("POST", url, json=body) as response:
+            return response.status_code, b"".join(response.iter_raw())
+
+    def test_record_then_replay(self):
+        with self.http_client("record") as client:
+            recorded = self.post(client, self.BODY)
+            # Recorded once; the same request is then served from the cassette
+            self.assertEqual(self.post(client, self.BODY).json(), recorded.json())
+        self.assertEqual(len(self.stub.requests), 1)
+        with open(self.path, encoding="utf-8") as f:
+            (entry,) = [json.loads(line) for line in f]
+        self.assertEqual(
+            entry["key"], llm_cassette.request_key(recorded.request)
+        )
+
+        with self.http_client("replay") as client:
+            # Key order in the JSON body doesn't change the request hash
+            reordered = dict(reversed(list(self.BODY.items())))
+            replayed = self.post(client, reordered)
+            self.assertEqual(replayed.status_code, 200)
+            self.assertEqual(replayed.json(), recorded.json())
+
+            missing = self.post(client, {**self.BODY, "model": "other"})
+            self.assertEqual(missing.status_code, 404)
+            self.assertEqual(missing.json()["error"]["type"], "cassette_miss")
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_streamed_body_replays_byte_for_byte(self):
+        body = {**self.BODY, "stream": True}
+        with self.http_client("record") as client:
+            status, recorded = self.post(client, body, stream=True)
+        self.assertEqual((status, recorded), (200, StubOpenAI.stream_body()))
+
+        with self.http_client("replay") as client:
+            self.assertEqual(self.post(client, body, stream=True), (200, recorded))
+
+        async def replay_async():
+            transport = llm_cassette.AsyncCassetteTransport(
+                "replay", llm_cassette.Cassette(self.path)
+            )
+            async with httpx.AsyncClient(base_url=self.stub.url, transport=transport) as client:
+                async with client.stream("POST", "/chat/completions", json=body) as response:
+                    return response.status_code, b"".join(
+                        [chunk async for chunk in response.aiter_raw()]
+                    )
+
+        self.assertEqual(asyncio.run(replay_async()), (200, recorded))
+        self.assertEqual(len(self.stub.requests), 1)
@@ -0,0 +1,82 @@
+"""High-resolution timing of pipeline stages, broken into phases.
+
+The pipeline views create a StageTimer per stage and activate it with `use`
+around the agent call. Code anywhere below reports its time with
+`phase(name)`: schema_load, vector_search, prompt_build, llm_wait, parse,
+sql_exec, serialization. The timer travels in a contextvar, so agents need no
+extra parameters. It follows sync_to_async and asyncio tasks, but not plain
+thread pools. Without an active timer, `phase` costs one contextvar lookup.
+
+Phases must not nest. "other" is the stage's total minus its phases: queueing,
+client setup and everything else that is ours but not instrumented.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+PHASES = (
+    "schema_load",
+    "vector_search",
+    "prompt_build",
+    "llm_wait",
+    "parse",
+    "sql_exec",
+    "serialization",
+)
+
+_current = ContextVar("stage_timer", default=None)
+
+
+class StageTimer:
+    """Wall time of one stage (time.perf_counter) and the time spent per phase."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = None
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def stop(self) -> float:
+        """Set the total to the time since the timer was created (may be called again)."""
+        self.total = time.perf_counter() - self.started
+        return self.total
+
+    def as_dict(self) -> dict:
+        total = self.total if self.total is not None else self.stop()
+        with self._lock:
+            phases = {name: round(s, 6) for name, s in self.phases.items()}
+        return {
+            "total": round(total, 6),
+            "phases": phases,
+            "other": round(max(total - sum(phases.values()), 0.0), 6),
+        }
+
+
+@contextmanager
+def use(timer: StageTimer):
+    """Make `timer` the one `phase` reports to, in this context."""
+    token = _current.set(timer)
+    try:
+        yield timer
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def phase(name: str):
+    """Add the time spent in the block to the active timer's `name` phase."""
+    timer = _current.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
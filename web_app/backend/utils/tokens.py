@@ -0,0 +1,74 @@
+import threading
+
+# tiktoken downloads its encoding files on first use; without network access
+# (or the package) token counts fall back to a characters/4 estimate.
+_encoding = None
+_encoding_failed = False
+_lock = threading.Lock()
+
+DEFAULT_ENCODING = "o200k_base"
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+                except Exception:
+                    _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in `text` (exact with tiktoken, else ~len/4)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def is_exact() -> bool:
+    """True if counts come from a real tokenizer rather than the estimate."""
+    return _get_encoding() is not None
+
+
+def llm_usage(response):
+    """
+    Token usage of one chat model response, from its `usage_metadata`:
+    {"input_tokens", "cached_tokens", "output_tokens", "cached_ratio"}, or None.
+    cached_tokens are prompt tokens served from the provider's prefix cache.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None
+    input_tokens = int(usage.get("input_tokens") or 0)
+    cached = int((usage.get("input_token_details") or {}).get("cache_read") or 0)
+    return {
+        "input_tokens": input_tokens,
+        "cached_tokens": cached,
+        "output_tokens": int(usage.get("output_tokens") or 0),
+        "cached_ratio": round(cached / input_tokens, 4) if input_tokens else 0.0,
+    }
+
+
+def sum_llm_usage(usages):
+    """Add up `llm_usage` dicts (None entries are skipped); None if there are none."""
+    usages = [u for u in usages if u]
+    if not usages:
+        return None
+    total = {
+        key: sum(u.get(key, 0) for u in usages)
+        for key in ("input_tokens", "cached_tokens", "output_tokens")
+    }
+    total["cached_ratio"] = (
+        round(total["cached_tokens"] / total["input_tokens"], 4)
+        if total["input_tokens"]
+        else 0.0
+    )
+    return total
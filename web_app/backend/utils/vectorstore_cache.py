@@ -0,0 +1,80 @@
+import os
+import threading
+from django.conf import settings
+
+from utils.lru import ByteLRU
+
+# Rough per-document overhead (Document object, docstore/id mappings) added to
+# the page content size when estimating how much memory a vectorstore holds.
+_DOC_OVERHEAD_BYTES = 256
+
+_cache = ByteLRU(getattr(settings, "VECTORSTORE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# One lock per schema directory so concurrent requests don't load/patch the same index twice
+_locks = {}
+_locks_guard = threading.Lock()
+
+
+def _key(schema_dir: str) -> str:
+    # The schema directory is MEDIA_ROOT/<user_id>/schema, so it identifies the user
+    return os.path.realpath(schema_dir)
+
+
+def lock_for(schema_dir: str) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(_key(schema_dir), threading.Lock())
+
+
+def schema_fingerprint(schema_file: str):
+    """
+    Return a cheap version stamp for schema_ab.jsonl: (mtime_ns, size), or None
+    if the file does not exist. Any rewrite of the schema changes the stamp.
+    """
+    try:
+        st = os.stat(schema_file)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def estimate_vectorstore_bytes(vectorstore) -> int:
+    """Estimate the resident size of a langchain FAISS vectorstore."""
+    index = getattr(vectorstore, "index", None)
+    vectors = int(getattr(index, "ntotal", 0)) * int(getattr(index, "d", 0)) * 4
+    docs = getattr(getattr(vectorstore, "docstore", None), "_dict", {}) or {}
+    text = sum(len(d.page_content) + _DOC_OVERHEAD_BYTES for d in docs.values())
+    return vectors + text
+
+
+def get(schema_dir: str, fingerprint):
+    """Return the cached vectorstore for `schema_dir` if it matches `fingerprint`."""
+    if fingerprint is None:
+        return None
+    entry = _cache.get(_key(schema_dir))
+    if entry is None:
+        return None
+    cached_fingerprint, vectorstore = entry
+    if cached_fingerprint != fingerprint:
+        # Schema was rebuilt since this index was loaded
+        _cache.pop(_key(schema_dir))
+        return None
+    return vectorstore
+
+
+def put(schema_dir: str, fingerprint, vectorstore) -> bool:
+    if fingerprint is None:
+        return False
+    return _cache.put(
+        _key(schema_dir),
+        (fingerprint, vectorstore),
+        estimate_vectorstore_bytes(vectorstore),
+    )
+
+
+def invalidate(schema_dir: str):
+    """Drop the cached vectorstore for one user's schema directory."""
+    _cache.pop(_key(schema_dir))
+
+
+def clear():
+    _cache.clear()
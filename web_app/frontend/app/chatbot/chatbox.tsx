@@ -292,7 +292,7 @@ function BotJsonRender({ data }: { data: any }) {
           )}
           {agentInfo.name === "Agent C - SQL Generation" && (
             <div className="text-xs text-gray-400 space-y-1">
-              <div>1. <span className="text-blue-400">Schema Loading</span> - Load full schema (schema_c.json) with PK/FK relationships</div>
+              <div>1. <span className="text-blue-400">Schema Loading</span> - Load the selected database schema (schema_c shard) with PK/FK relationships</div>
               <div>2. <span className="text-blue-400">Table Filtering</span> - Focus on selected tables from Agent B</div>
               <div>3. <span className="text-blue-400">Relationship Mapping</span> - Analyze foreign key constraints and join possibilities</div>
               <div>4. <span className="text-blue-400">LLM Generation</span> - Pass full context to LLM to generate optimized SQL query</div>
@@ -928,7 +928,9 @@ function BotJsonRender({ data }: { data: any }) {
             <div className="bg-gray-800 rounded-lg p-3">
               <div className="text-xs font-semibold text-gray-300 mb-2">📊 Query Results</div>
               <div className="text-xs text-gray-400 mb-2">
-                Found {data.result.length} rows in the database
+                {data.truncated
+                  ? `Showing the first ${data.result.length} rows (result truncated)`
+                  : `Found ${data.result.length} rows in the database`}
               </div>
             <div className="flex gap-2 mb-2">
               <button
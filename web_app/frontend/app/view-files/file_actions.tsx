@@ -1,5 +1,5 @@
 import React from "react";
-import { FileItem } from "./page";
+import { FileItem, SchemaJob } from "./page";
 
 export interface file_actions_props {
   selected: number[];
@@ -17,6 +17,7 @@ export interface file_actions_props {
   setSelected: React.Dispatch<React.SetStateAction<number[]>>;
   setSpiderLoading: React.Dispatch<React.SetStateAction<boolean>>;
   spiderLoading: boolean;
+  trackJob: (job?: SchemaJob | null) => Promise<void>;
 }
 
 const FileActions: React.FC<file_actions_props> = ({
@@ -35,6 +36,7 @@ const FileActions: React.FC<file_actions_props> = ({
   setSelected,
   setSpiderLoading,
   spiderLoading,
+  trackJob,
 }) => {
   const allSelected = files.length > 0 && selected.length === files.length;
   
@@ -70,9 +72,10 @@ const FileActions: React.FC<file_actions_props> = ({
             const formData = new FormData();
             for (let i = 0; i < files.length; ++i) formData.append("file", files[i]);
             console.log("Add button: uploading", files.length, "files");
-            await apiFetch("/api/core/files/", { method: "POST", body: formData });
+            const res = await apiFetch("/api/core/files/", { method: "POST", body: formData });
             console.log("Add button: fetchFiles");
             await fetchFiles();
+            trackJob((res as any)?.job);
           } catch (e: any) {
             console.error("Add button: error", e);
             alert(e.message || JSON.stringify(e));
@@ -116,9 +119,10 @@ const FileActions: React.FC<file_actions_props> = ({
         setClearLoading(true);
         try {
           console.log("Clear All button: apiFetch");
-          await apiFetch("/api/core/files/clear/", { method: "DELETE" });
+          const res = await apiFetch("/api/core/files/clear/", { method: "DELETE" });
           console.log("Clear All button: fetchFiles");
           await fetchFiles();
+          trackJob((res as any)?.job);
         } catch (e: any) {
           console.error("Clear All button: error", e);
           alert(e.message || JSON.stringify(e));
@@ -154,9 +158,10 @@ const FileActions: React.FC<file_actions_props> = ({
         setSpiderLoading(true);
         try {
           console.log("Add All Spider button: apiFetch");
-          await apiFetch("/api/core/files/add_spider_databases/", { method: "POST" });
+          const res = await apiFetch("/api/core/files/add_spider_databases/", { method: "POST" });
           console.log("Add All Spider button: fetchFiles");
           await fetchFiles();
+          trackJob((res as any)?.job);
         } catch (e: any) {
           console.error("Add All Spider button: error", e);
           alert(e.message || JSON.stringify(e));
@@ -13,6 +13,17 @@ export interface FileItem {
   file: string;
 }
 
+// Background schema/embedding build started by an upload or delete (/api/core/jobs/)
+export interface SchemaJob {
+  id: number;
+  status: "pending" | "running" | "succeeded" | "failed";
+  stage?: string;
+  progress?: number;
+  error?: string;
+}
+
+const JOB_POLL_MS = 1500;
+
 // Helper to download file with correct extension
 function downloadFile(f: FileItem) {
   return async (e: React.MouseEvent) => {
@@ -66,6 +77,29 @@ const ViewFilesPage: React.FC = () => {
   const [addLoading, setAddLoading] = useState(false);
   const [spiderLoading, setSpiderLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
+  const [job, setJob] = useState<SchemaJob | null>(null);
+
+  // Poll a schema job until it finishes, so a failed build is visible to the user
+  const trackJob = async (started?: SchemaJob | null) => {
+    if (!started || typeof started.id !== "number") return;
+    let current: SchemaJob = started;
+    setJob(current);
+    while (current.status === "pending" || current.status === "running") {
+      await new Promise((res) => setTimeout(res, JOB_POLL_MS));
+      try {
+        const data = await apiFetch(`/api/core/jobs/${current.id}/`);
+        if (typeof data === "undefined") return; // apiFetch handled logout/redirect
+        current = data as SchemaJob;
+        setJob(current);
+      } catch (e) {
+        console.warn("trackJob: poll failed", e);
+        return;
+      }
+    }
+    if (current.status === "failed") {
+      alert(`Preparing your databases failed: ${current.error || "unknown error"}`);
+    }
+  };
 
   const fetchFiles = async () => {
     setLoading(true);
@@ -117,11 +151,13 @@ const ViewFilesPage: React.FC = () => {
     document.body.style.cursor = "wait";
     console.log("Delete button: start", selected);
     try {
+      let lastJob: SchemaJob | null = null;
       for (const id of selected) {
         try {
           console.log("Delete button: deleting", id);
           const delRes = await apiFetch(`/api/core/files/${id}/`, { method: "DELETE" });
           if (typeof delRes === "undefined") return; // apiFetch handled logout/redirect
+          lastJob = (delRes as any)?.job ?? lastJob;
           console.log("Delete button: deleted", id);
         } catch (e: any) {
           console.error("Delete button: error", id, e);
@@ -134,6 +170,7 @@ const ViewFilesPage: React.FC = () => {
       setSelected([]);
       console.log("Delete button: fetchFiles");
       await fetchFiles();
+      trackJob(lastJob);
     } finally {
       setDeleteLoading(false);
       document.body.style.cursor = "default";
@@ -168,6 +205,15 @@ const ViewFilesPage: React.FC = () => {
         ) : (
           <div>Storage: <span className="text-gray-400">Loading...</span></div>
         )}
+        {job && (
+          <div className={job.status === "failed" ? "text-red-400" : undefined}>
+            {job.status === "failed"
+              ? `Preparing databases failed: ${job.error || "unknown error"}`
+              : job.status === "succeeded"
+              ? "Databases ready."
+              : `Preparing databases (${job.stage || job.status}) ${Math.round((job.progress ?? 0) * 100)}%`}
+          </div>
+        )}
       </div>
       {/* Order control moved to top as requested */}
       <div className="flex items-center gap-3 mb-4">
@@ -199,6 +245,7 @@ const ViewFilesPage: React.FC = () => {
         setSelected={setSelected}
         setSpiderLoading={setSpiderLoading}
         spiderLoading={spiderLoading}
+        trackJob={trackJob}
       />
       {loading && <div className="mb-4 text-gray-500">Loading...</div>}
   {/* error popup only, no HTML error rendering */}